@@ -11,6 +11,7 @@ from instamatic.exceptions import TEMControllerError
 from instamatic.formats import write_tiff
 from instamatic.image_utils import rotate_image
 
+from .cache import StateCache
 from .deflectors import *
 from .lenses import *
 from .microscope import Microscope
@@ -113,6 +114,9 @@ class TEMController:
         self.screen = Screen(tem)
         self.mode = Mode(tem)
 
+        self.cache = StateCache()
+        self._invalidate_cache_on_change()
+
         self.autoblank = False
         self._saved_alignments = config.get_alignments()
 
@@ -155,6 +159,34 @@ class TEMController:
     @spotsize.setter
     def spotsize(self, value: int):
         self.tem.setSpotSize(value)
+        self.cache.invalidate('SpotSize')
+
+    def _invalidate_cache_on_change(self):
+        """Make sure that cached values are invalidated whenever they are
+        changed through the controller."""
+        controls = {
+            'GunShift': self.gunshift,
+            'GunTilt': self.guntilt,
+            'BeamShift': self.beamshift,
+            'BeamTilt': self.beamtilt,
+            'ImageShift1': self.imageshift1,
+            'ImageShift2': self.imageshift2,
+            'DiffShift': self.diffshift,
+            'StagePosition': self.stage,
+            'Magnification': self.magnification,
+            'DiffFocus': self.difffocus,
+            'Brightness': self.brightness,
+        }
+
+        for key, control in controls.items():
+            control._setter = self.cache.invalidates(control._setter, key)
+            if isinstance(control, Deflector):
+                control.neutral = self.cache.invalidates(control.neutral, key)
+
+        self.magnification._indexsetter = self.cache.invalidates(self.magnification._indexsetter, 'Magnification')
+
+        # the function mode affects all other values
+        self.mode._setter = self.cache.invalidates(self.mode._setter)
 
     def acquire_at_items(self, *args, **kwargs) -> None:
         """Class to automated acquisition at many stage locations. The
@@ -433,76 +465,145 @@ class TEMController:
         gm = GridMontage(self)
         return gm
 
-    def to_dict(self, *keys) -> dict:
+    def _batch(self, calls: list) -> list:
+        """Evaluate a list of `(func_name, args, kwargs)` on the microscope.
+
+        If the microscope is accessed through the TEM server, all calls
+        are sent in a single round trip. Errors (`ValueError`) are
+        returned in place of the result.
+        """
+        if hasattr(self.tem, 'batch'):
+            return self.tem.batch(calls, return_exceptions=True)
+
+        results = []
+        for func_name, args, kwargs in calls:
+            try:
+                ret = getattr(self.tem, func_name)(*args, **kwargs)
+            except ValueError as e:
+                ret = e
+            results.append(ret)
+        return results
+
+    def to_dict(self, *keys, cached: bool = False) -> dict:
         """Store microscope parameters to dict.
 
         keys: tuple of str (optional)
             If any keys are specified, dict is returned with only the given properties
+        cached: bool
+            Use the values from `self.cache` where available, see `instamatic.TEMController.cache`
 
         self.to_dict('all') or self.to_dict() will return all properties
         """
         # Each of these costs about 40-60 ms per call on a JEOL 2100, stage is 265 ms per call
+        # Using the TEM server, they are requested in a single round trip
         funcs = {
-            'FunctionMode': self.tem.getFunctionMode,
-            'GunShift': self.gunshift.get,
-            'GunTilt': self.guntilt.get,
-            'BeamShift': self.beamshift.get,
-            'BeamTilt': self.beamtilt.get,
-            'ImageShift1': self.imageshift1.get,
-            'ImageShift2': self.imageshift2.get,
-            'DiffShift': self.diffshift.get,
-            'StagePosition': self.stage.get,
-            'Magnification': self.magnification.get,
-            'DiffFocus': self.difffocus.get,
-            'Brightness': self.brightness.get,
-            'SpotSize': self.tem.getSpotSize,
+            'FunctionMode': ('getFunctionMode', None),
+            'GunShift': ('getGunShift', DeflectorTuple),
+            'GunTilt': ('getGunTilt', DeflectorTuple),
+            'BeamShift': ('getBeamShift', DeflectorTuple),
+            'BeamTilt': ('getBeamTilt', DeflectorTuple),
+            'ImageShift1': ('getImageShift1', DeflectorTuple),
+            'ImageShift2': ('getImageShift2', DeflectorTuple),
+            'DiffShift': ('getDiffShift', DeflectorTuple),
+            'StagePosition': ('getStagePosition', StagePositionTuple),
+            'Magnification': ('getMagnification', None),
+            'DiffFocus': ('getDiffFocus', None),
+            'Brightness': ('getBrightness', None),
+            'SpotSize': ('getSpotSize', None),
         }
 
-        dct = {}
+        if len(keys) == 1 and isinstance(keys[0], (tuple, list)):
+            keys = tuple(keys[0])
 
         if 'all' in keys or not keys:
-            keys = funcs.keys()
+            keys = tuple(funcs.keys())
+
+        results = {}
+
+        if cached:
+            for key in keys:
+                try:
+                    results[key] = self.cache.get(key)
+                except KeyError:
+                    pass
+
+        missing = [key for key in keys if key not in results]
+        generations = [self.cache.generation(key) for key in missing]
+
+        calls = [(funcs[key][0], (), {}) for key in missing]
+
+        for key, generation, ret in zip(missing, generations, self._batch(calls)):
+            if isinstance(ret, Exception) and not isinstance(ret, ValueError):
+                raise ret
+            # also cache errors, e.g. DiffFocus is not available outside diffraction mode
+            self.cache.set(key, ret, generation=generation)
+            results[key] = ret
+
+        dct = {}
 
         for key in keys:
-            try:
-                dct[key] = funcs[key]()
-            except ValueError:
+            ret = results[key]
+
+            if isinstance(ret, ValueError):
                 # print(f"No such key: `{key}`")
-                pass
+                continue
+
+            wrapper = funcs[key][1]
+            dct[key] = wrapper(*ret) if wrapper else ret
 
         return dct
 
     def from_dict(self, dct: dict):
-        """Restore microscope parameters from dict."""
+        """Restore microscope parameters from dict.
+
+        The function mode is set first, and nothing else is set if that
+        fails. The other parameters depend on the mode and are set in a
+        single batch. They call the `set*` functions of the microscope
+        interface directly (`self.tem`), bypassing the controller wrappers
+        (e.g. `self.stage.set`), and all of them are tried; the first error
+        is raised afterwards.
+        """
         funcs = {
-            # 'FunctionMode': self.tem.setFunctionMode,
-            'GunShift': self.gunshift.set,
-            'GunTilt': self.guntilt.set,
-            'BeamShift': self.beamshift.set,
-            'BeamTilt': self.beamtilt.set,
-            'ImageShift1': self.imageshift1.set,
-            'ImageShift2': self.imageshift2.set,
-            'DiffShift': self.diffshift.set,
-            'StagePosition': self.stage.set,
-            'Magnification': self.magnification.set,
-            'DiffFocus': self.difffocus.set,
-            'Brightness': self.brightness.set,
-            'SpotSize': self.tem.setSpotSize,
+            # 'FunctionMode': 'setFunctionMode',
+            'GunShift': 'setGunShift',
+            'GunTilt': 'setGunTilt',
+            'BeamShift': 'setBeamShift',
+            'BeamTilt': 'setBeamTilt',
+            'ImageShift1': 'setImageShift1',
+            'ImageShift2': 'setImageShift2',
+            'DiffShift': 'setDiffShift',
+            'StagePosition': 'setStagePosition',
+            'Magnification': 'setMagnification',
+            'DiffFocus': 'setDiffFocus',
+            'Brightness': 'setBrightness',
+            'SpotSize': 'setSpotSize',
         }
 
         mode = dct['FunctionMode']
-        self.tem.setFunctionMode(mode)
+        try:
+            self.tem.setFunctionMode(mode)
+        finally:
+            self.cache.invalidate()
+
+        calls = []
 
         for k, v in dct.items():
             if k in funcs:
-                func = funcs[k]
+                func_name = funcs[k]
             else:
                 continue
 
-            try:
-                func(*v)
-            except TypeError:
-                func(v)
+            args = tuple(v) if isinstance(v, (tuple, list)) else (v,)
+            calls.append((func_name, args, {}))
+
+        # Using the TEM server, the values are set in a single round trip
+        results = self._batch(calls)
+
+        self.cache.invalidate()
+
+        for ret in results:
+            if isinstance(ret, Exception):
+                raise ret
 
     def get_raw_image(self, exposure: float = None, binsize: int = None) -> np.ndarray:
         """Simplified function equivalent to `get_image` that only returns the
@@ -623,7 +724,7 @@ class TEMController:
         if not header_keys:
             h = {}
         else:
-            h = self.to_dict(header_keys)
+            h = self.to_dict(header_keys, cached=True)
 
         if self.autoblank:
             self.beam.unblank()
@@ -0,0 +1,111 @@
+import threading
+import time
+from functools import wraps
+
+# Time (in seconds) that the values in the image header are cached for.
+# Values are also invalidated whenever they are changed through the controller,
+# the time-to-live only covers changes made on the microscope itself (e.g. using the knobs).
+# A value of 0 means the value is always read from the microscope.
+DEFAULT_TTL = {
+    'FunctionMode': 1.0,
+    'GunShift': 60.0,
+    'GunTilt': 60.0,
+    'BeamShift': 5.0,
+    'BeamTilt': 30.0,
+    'ImageShift1': 30.0,
+    'ImageShift2': 30.0,
+    'DiffShift': 30.0,
+    'StagePosition': 0.0,
+    'Magnification': 1.0,
+    'DiffFocus': 1.0,
+    'Brightness': 5.0,
+    'SpotSize': 5.0,
+}
+
+
+class StateCache:
+    """Cache for microscope values that rarely change, e.g. for assembling
+    image headers without reading every value from the microscope.
+
+    Each key has its own time-to-live in seconds (`ttl`), keys that are
+    not listed are not cached. Use `invalidate` or wrap the setter
+    functions using `invalidates` to clear the cached value when it is
+    changed.
+    """
+
+    def __init__(self, ttl: dict = None):
+        super().__init__()
+
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+
+        self.enabled = True
+
+        self._values = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(keys={tuple(self._values.keys())})'
+
+    def get(self, key: str):
+        """Return the cached value for `key`.
+
+        Raises KeyError if the value is not cached or has expired.
+        """
+        ttl = self.ttl.get(key, 0.0)
+
+        with self._lock:
+            value, timestamp = self._values[key]
+
+        if not self.enabled or time.perf_counter() - timestamp > ttl:
+            raise KeyError(key)
+
+        return value
+
+    def generation(self, key: str) -> int:
+        """Return the generation counter for `key`, which is incremented on
+        every invalidation.
+
+        Pass it to `set` to avoid caching a value that was read before
+        an invalidation.
+        """
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key: str, value, generation: int = None):
+        """Store `value` for `key`.
+
+        If `generation` is given, the value is only stored if the key
+        has not been invalidated since.
+        """
+        if not self.ttl.get(key, 0.0):
+            return
+
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, 0):
+                return
+            self._values[key] = (value, time.perf_counter())
+
+    def invalidate(self, *keys):
+        """Clear the cached values for `keys`, or all values if no keys are
+        given."""
+        with self._lock:
+            if not keys:
+                keys = tuple(self.ttl.keys())
+            for key in keys:
+                self._values.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def invalidates(self, func, *keys):
+        """Wrap `func` so that calling it invalidates `keys` (all keys if none
+        are given)."""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.invalidate(*keys)
+
+        return wrapper
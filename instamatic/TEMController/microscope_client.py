@@ -1,16 +1,20 @@
+import asyncio
 import atexit
 import datetime
+import itertools
 import json
 import pickle
 import socket
 import subprocess as sp
 import threading
 import time
+import weakref
 from functools import wraps
 
 from instamatic import config
 from instamatic.exceptions import TEMCommunicationError, exception_list
-from instamatic.server.serializer import dumper, loader
+from instamatic.server.framing import async_recv_msg, async_send_msg, recv_msg, send_msg, set_nodelay
+from instamatic.server.serializer import dumper, get_serializer, handshake, loader, parse_handshake_reply
 
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
@@ -33,12 +37,45 @@ def start_server_in_subprocess():
     atexit.register(kill_server, p)
 
 
+def unpack_response(status: int, data, return_exceptions: bool = False):
+    """Return the data from a server response, or raise the error returned
+    by the server.
+
+    If `return_exceptions` is set, the error is returned instead of
+    raised.
+    """
+    if status == 200:
+        return data
+
+    elif status == 500:
+        error_code, args = data
+        error = exception_list.get(error_code, TEMCommunicationError)(*args)
+        if return_exceptions:
+            return error
+        raise error
+
+    else:
+        raise ConnectionError(f'Unknown status code: {status}')
+
+
+def make_dct(func_name: str, args: tuple = (), kwargs: dict = None) -> dict:
+    """Make request dict for the TEM server."""
+    return {'func_name': func_name,
+            'args': tuple(args),
+            'kwargs': kwargs if kwargs else {}}
+
+
 class MicroscopeClient:
     """Simulates a Microscope object and synchronizes calls over a socket
     server.
 
     For documentation, see the actual python interface to the microscope
     API.
+
+    The client can be shared between threads. Every request is tagged
+    with an id, and responses are handed to the thread waiting for them,
+    so that a slow call (e.g. a stage movement) in one thread does not
+    block read-only calls from another.
     """
 
     def __init__(self, *, interface: str):
@@ -48,6 +85,16 @@ class MicroscopeClient:
         self.name = interface
         self._bufsize = BUFSIZE
 
+        self._ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._recv_condition = threading.Condition()
+        self._receiving = False
+        self._responses = {}
+        self._abandoned = set()
+
+        self._loader = loader
+        self._dumper = dumper
+
         try:
             self.connect()
         except ConnectionRefusedError:
@@ -73,8 +120,13 @@ class MicroscopeClient:
     def connect(self):
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.connect((HOST, PORT))
+        set_nodelay(self.s)
         print(f'Connected to TEM server ({HOST}:{PORT})')
 
+        send_msg(self.s, handshake())
+        self.protocol = parse_handshake_reply(recv_msg(self.s))
+        self._loader, self._dumper = get_serializer(self.protocol)
+
     def __getattr__(self, func_name):
         try:
             wrapped = self._dct[func_name]
@@ -90,30 +142,123 @@ class MicroscopeClient:
 
         return wrapper
 
+    def _send_dct(self, dct) -> int:
+        """Send request `dct` to the server without waiting for the response,
+        returns the request id."""
+        request_id = next(self._ids)
+        dct['id'] = request_id
+
+        with self._send_lock:
+            send_msg(self.s, self._dumper(dct))
+
+        return request_id
+
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
-        self.s.send(dumper(dct))
+        request_id = self._send_dct(dct)
 
-        response = self.s.recv(self._bufsize)
+        response = self._wait_for_response(request_id)
 
-        if response:
-            status, data = loader(response)
+        return unpack_response(response['status'], response['data'])
 
-        if status == 200:
-            return data
+    def _wait_for_response(self, request_id: int) -> dict:
+        """Wait for the response to request `request_id`.
 
-        elif status == 500:
-            error_code, args = data
-            raise exception_list.get(error_code, TEMCommunicationError)(*args)
+        One waiting thread at a time reads from the socket, and hands
+        responses for other requests to the threads waiting for them.
+        """
+        with self._recv_condition:
+            while request_id not in self._responses and self._receiving:
+                self._recv_condition.wait()
+            if request_id in self._responses:
+                return self._responses.pop(request_id)
+            self._receiving = True
 
-        else:
-            raise ConnectionError(f'Unknown status code: {status}')
+        try:
+            while True:
+                message = recv_msg(self.s)
+                if not message:
+                    raise ConnectionError('Connection closed by the TEM server')
+
+                response = self._loader(message)
+                if response['id'] == request_id:
+                    return response
+
+                with self._recv_condition:
+                    if response['id'] in self._abandoned:
+                        # nobody will collect this response
+                        self._abandoned.discard(response['id'])
+                    else:
+                        self._responses[response['id']] = response
+                    self._recv_condition.notify_all()
+        finally:
+            with self._recv_condition:
+                self._receiving = False
+                self._recv_condition.notify_all()
+
+    def _discard_response(self, request_id: int) -> None:
+        """Drop the response to `request_id`, called when its `PendingCall`
+        is garbage collected before the result was collected."""
+        with self._recv_condition:
+            if self._responses.pop(request_id, None) is None:
+                self._abandoned.add(request_id)
+
+    def batch(self, calls: list, return_exceptions: bool = False) -> list:
+        """Evaluate a list of calls on the microscope in a single round trip.
+
+        Parameters
+        ----------
+        calls : list
+            List of `(func_name, args, kwargs)`, where args and kwargs are optional.
+            The calls are evaluated in the given order.
+        return_exceptions : bool
+            If True, errors are returned in place of the result, otherwise
+            the first error is raised (after all calls have been evaluated).
+
+        Returns
+        -------
+        results : list
+            List with the return value of each call.
+
+        Usage:
+            shift, mag, mode = tem.batch([('getBeamShift',), ('getMagnification',), ('getFunctionMode',)])
+        """
+        batch = [self._make_dct(*call) for call in calls]
+        data = self._eval_dct({'batch': batch})
+
+        return [unpack_response(status, ret, return_exceptions=return_exceptions) for status, ret in data]
+
+    def submit(self, func_name: str, args: tuple = (), kwargs: dict = None, ordered: bool = False) -> 'PendingCall':
+        """Send a call to the server without waiting for the result, so that
+        several independent requests can be in flight at the same time.
+
+        Read-only calls (`get*`/`is*`) may be evaluated before earlier
+        state-changing calls, unless `ordered` is set.
+
+        Returns a `PendingCall`, use `.result()` to retrieve the return value.
+
+        Usage:
+            pos = tem.submit('getStagePosition')
+            mag = tem.submit('getMagnification')
+            pos, mag = pos.result(), mag.result()
+        """
+        dct = self._make_dct(func_name, args, kwargs)
+        if ordered:
+            dct['ordered'] = True
+        request_id = self._send_dct(dct)
+        return PendingCall(self, request_id)
+
+    def _make_dct(self, func_name: str, args: tuple = (), kwargs: dict = None) -> dict:
+        if func_name not in self._dct:
+            raise AttributeError(f'`{self.__class__.__name__}` object has no attribute `{func_name}`')
+        return make_dct(func_name, args, kwargs)
 
     def _init_dict(self):
         from instamatic.TEMController.microscope import get_tem
         tem = get_tem(interface=self.interface)
 
         self._dct = {key: value for key, value in tem.__dict__.items() if not key.startswith('_')}
+        self._dct['get_call_statistics'] = None
 
     def __dir__(self):
         return self._dct.keys()
@@ -125,6 +270,182 @@ class MicroscopeClient:
             config.settings.use_goniotool = self.is_goniotool_available()
 
 
+class PendingCall:
+    """Result of a call submitted with `MicroscopeClient.submit`.
+
+    If the result is never collected, the response is dropped by the
+    client when the `PendingCall` is garbage collected.
+    """
+
+    def __init__(self, client: MicroscopeClient, request_id: int):
+        super().__init__()
+        self._client = client
+        self._request_id = request_id
+        self._response = None
+        self._finalizer = weakref.finalize(self, client._discard_response, request_id)
+
+    def __repr__(self):
+        state = 'done' if self._response else 'pending'
+        return f'{self.__class__.__name__}(id={self._request_id}, {state})'
+
+    def result(self):
+        """Wait for the response and return the result (or raise the error
+        returned by the server)."""
+        if self._response is None:
+            self._response = self._client._wait_for_response(self._request_id)
+            self._finalizer.detach()
+        return unpack_response(self._response['status'], self._response['data'])
+
+
+class AsyncMicroscopeClient:
+    """asyncio version of `MicroscopeClient`. The functions of the microscope
+    interface return coroutines, so that independent calls can be
+    overlapped without threads. Requires a running TEM server.
+
+    Usage:
+        async with AsyncMicroscopeClient(interface='jeol') as tem:
+            await tem.setStagePosition(a=20)
+            pos, mag = await asyncio.gather(tem.getStagePosition(), tem.getMagnification())
+    """
+
+    def __init__(self, *, interface: str):
+        super().__init__()
+
+        self.interface = interface
+        self.name = interface
+
+        self.s = None
+        self._ids = itertools.count()
+        self._pending = {}
+        self._reader = None
+        self._send_lock = None
+
+        self._loader = loader
+        self._dumper = dumper
+
+        self._init_dict()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        """Connect to the TEM server and start listening for responses."""
+        loop = asyncio.get_running_loop()
+
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setblocking(False)
+        await loop.sock_connect(self.s, (HOST, PORT))
+        set_nodelay(self.s)
+        print(f'Connected to TEM server ({HOST}:{PORT})')
+
+        await async_send_msg(loop, self.s, handshake())
+        self.protocol = parse_handshake_reply(await async_recv_msg(loop, self.s))
+        self._loader, self._dumper = get_serializer(self.protocol)
+
+        # large messages are sent in parts, which must not be interleaved
+        self._send_lock = asyncio.Lock()
+
+        self._reader = loop.create_task(self._read_responses())
+
+    async def close(self):
+        """Close the connection to the TEM server, calls that are waiting
+        for a response raise `TEMCommunicationError`."""
+        if self._reader:
+            self._reader.cancel()
+            self._reader = None
+        if self.s:
+            self.s.close()
+            self.s = None
+
+        self._fail_pending(TEMCommunicationError('Connection to the TEM server was closed'))
+
+    def _fail_pending(self, error: Exception):
+        """Raise `error` in all calls that are waiting for a response."""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def _read_responses(self):
+        """Read responses from the socket and hand them to the waiting
+        calls."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                message = await async_recv_msg(loop, self.s)
+                if not message:
+                    raise ConnectionError('Connection closed by the TEM server')
+
+                response = self._loader(message)
+                future = self._pending.pop(response['id'], None)
+                if future and not future.done():
+                    future.set_result(response)
+        except (OSError, ConnectionError) as e:
+            # mark the client as disconnected, so that later calls raise instead of waiting forever
+            self.s.close()
+            self.s = None
+            self._reader = None
+
+            self._fail_pending(TEMCommunicationError(f'Lost connection to the TEM server: {e}'))
+
+    def __getattr__(self, func_name):
+        try:
+            wrapped = self._dct[func_name]
+        except KeyError as e:
+            raise AttributeError(f'`{self.__class__.__name__}` object has no attribute `{func_name}`') from e
+
+        @wraps(wrapped)
+        async def wrapper(*args, **kwargs):
+            dct = make_dct(func_name, args, kwargs)
+            return await self._eval_dct(dct)
+
+        return wrapper
+
+    async def _eval_dct(self, dct):
+        """Send `dct` to the server and wait for the response."""
+        if not self.s:
+            raise TEMCommunicationError('Not connected to the TEM server, use `connect` first')
+
+        loop = asyncio.get_running_loop()
+
+        request_id = next(self._ids)
+        dct['id'] = request_id
+
+        future = loop.create_future()
+        self._pending[request_id] = future
+
+        try:
+            async with self._send_lock:
+                await async_send_msg(loop, self.s, self._dumper(dct))
+            response = await future
+        finally:
+            self._pending.pop(request_id, None)
+
+        return unpack_response(response['status'], response['data'])
+
+    async def batch(self, calls: list, return_exceptions: bool = False) -> list:
+        """Evaluate a list of `(func_name, args, kwargs)` in a single round
+        trip, see `MicroscopeClient.batch`."""
+        batch = [make_dct(*call) for call in calls]
+        data = await self._eval_dct({'batch': batch})
+
+        return [unpack_response(status, ret, return_exceptions=return_exceptions) for status, ret in data]
+
+    def _init_dict(self):
+        from instamatic.TEMController.microscope import get_tem
+        tem = get_tem(interface=self.interface)
+
+        self._dct = {key: value for key, value in tem.__dict__.items() if not key.startswith('_')}
+        self._dct['get_call_statistics'] = None
+
+    def __dir__(self):
+        return self._dct.keys()
+
+
 class TraceVariable:
     """Simple class to trace a variable over time.
 
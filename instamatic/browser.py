@@ -2,11 +2,10 @@ import os
 import time
 
 import matplotlib.pyplot as plt
-import mrcfile
 import numpy as np
 from pyserialem import read_nav_file
 
-from instamatic.formats import read_tiff
+from instamatic.formats import MrcStack, read_tiff
 
 
 class Browser:
@@ -23,9 +22,10 @@ class Browser:
     def set_images(self, mmm: str = 'mmm.mrc'):
         """Set the path to the image data (medium mag).
 
-        Must be mrc format and contain multiple pages.
+        Must be mrc format and contain multiple pages. The images are
+        memory mapped and only read when displayed.
         """
-        self.mmap = mrcfile.mmap(mmm)
+        self.mmap = MrcStack(mmm)
 
     def set_nav_file(self, nav: str = 'output.nav'):
         """Set the `.nav` file to load the stage/image coordinates from."""
@@ -5,15 +5,16 @@ import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from instamatic import config
 from instamatic.image_utils import autoscale, imgscale
+from instamatic.imreg import Registrar
 from instamatic.processing.find_holes import find_holes
 from instamatic.tools import find_beam_center, printer
 
 from .filenames import *
 from .fit import fit_affine_transformation
+from .pipeline import CorrelationPipeline
 
 logger = logging.getLogger(__name__)
 
@@ -158,37 +159,43 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
     print('Beamshift: x={} | y={}'.format(*beamshift_cent))
     print('Pixel: x={} | y={}'.format(*pixel_cent))
 
-    shifts = []
     beampos = []
 
     n = int((gridsize - 1) / 2)  # number of points = n*(n+1)
     x_grid, y_grid = np.meshgrid(np.arange(-n, n + 1) * stepsize, np.arange(-n, n + 1) * stepsize)
     tot = gridsize * gridsize
 
-    i = 0
-    for dx, dy in np.stack([x_grid, y_grid]).reshape(2, -1).T:
-        ctrl.beamshift.set(x=x_cent + dx, y=y_cent + dy)
+    # the images are cross correlated in the background while the next one is collected
+    with CorrelationPipeline(Registrar(img_cent, upsample_factor=10), preprocess=lambda img: imgscale(img, scale)) as pipeline:
+        try:
+            i = 0
+            for dx, dy in np.stack([x_grid, y_grid]).reshape(2, -1).T:
+                with pipeline.timer('move'):
+                    ctrl.beamshift.set(x=x_cent + dx, y=y_cent + dy)
 
-        printer(f'Position: {i + 1}/{tot}: {ctrl.beamshift}')
+                printer(f'Position: {i + 1}/{tot}: {ctrl.beamshift}')
 
-        outfile = os.path.join(outdir, 'calib_beamshift_{i:04d}') if save_images else None
+                outfile = os.path.join(outdir, 'calib_beamshift_{i:04d}') if save_images else None
 
-        comment = f'Calib image {i}: dx={dx} - dy={dy}'
-        img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys='BeamShift')
-        img = imgscale(img, scale)
+                comment = f'Calib image {i}: dx={dx} - dy={dy}'
+                with pipeline.timer('acquire'):
+                    img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys='BeamShift')
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+                pipeline.submit(img)
 
-        beamshift = np.array(h['BeamShift'])
-        beampos.append(beamshift)
-        shifts.append(shift)
+                beamshift = np.array(h['BeamShift'])
+                beampos.append(beamshift)
+
+                i += 1
+        finally:
+            print('')
+            # print "\nReset to center"
 
-        i += 1
+            ctrl.beamshift.set(*beamshift_cent)
 
-    print('')
-    # print "\nReset to center"
+        shifts = pipeline.results()
 
-    ctrl.beamshift.set(*beamshift_cent)
+    pipeline.print_timings()
 
     # correct for binsize, store in binsize=1
     shifts = np.array(shifts) * binsize / scale
@@ -221,6 +228,7 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
     beamshift_cent = np.array(h_cent['BeamShift'])
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    registrar = Registrar(img_cent, upsample_factor=10)
 
     binsize = h_cent['ImageBinsize']
 
@@ -242,7 +250,7 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
         print('Image:', fn)
         print('Beamshift: x={} | y={}'.format(*beamshift))
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift = registrar.register(img)
 
         beampos.append(beamshift)
         shifts.append(shift)
@@ -5,14 +5,15 @@ import sys
 
 import matplotlib.pyplot as plt
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from instamatic import config
 from instamatic.image_utils import autoscale, imgscale
+from instamatic.imreg import Registrar
 from instamatic.tools import printer
 
 from .filenames import *
 from .fit import fit_affine_transformation
+from .pipeline import CorrelationPipeline
 
 logger = logging.getLogger(__name__)
 
@@ -218,35 +219,41 @@ def calibrate_directbeam_live(ctrl, key='DiffShift', gridsize=None, stepsize=Non
 
     print('{}: x={} | y={}'.format(key, *readout_cent))
 
-    shifts = []
     readouts = []
 
     n = int((gridsize - 1) / 2)  # number of points = n*(n+1)
     x_grid, y_grid = np.meshgrid(np.arange(-n, n + 1) * stepsize, np.arange(-n, n + 1) * stepsize)
     tot = gridsize * gridsize
 
-    for i, (dx, dy) in enumerate(np.stack([x_grid, y_grid]).reshape(2, -1).T):
-        i += 1
+    # the images are cross correlated in the background while the next one is collected
+    with CorrelationPipeline(Registrar(img_cent, upsample_factor=10), preprocess=lambda img: imgscale(img, scale)) as pipeline:
+        try:
+            for i, (dx, dy) in enumerate(np.stack([x_grid, y_grid]).reshape(2, -1).T):
+                i += 1
 
-        attr.set(x=x_cent + dx, y=y_cent + dy)
+                with pipeline.timer('move'):
+                    attr.set(x=x_cent + dx, y=y_cent + dy)
 
-        printer(f'Position: {i}/{tot}: {attr}')
+                printer(f'Position: {i}/{tot}: {attr}')
 
-        outfile = os.path.join(outdir, f'calib_db_{key}_{i:04d}') if save_images else None
+                outfile = os.path.join(outdir, f'calib_db_{key}_{i:04d}') if save_images else None
 
-        comment = f'Calib image {i}: dx={dx} - dy={dy}'
-        img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys=key)
-        img = imgscale(img, scale)
+                comment = f'Calib image {i}: dx={dx} - dy={dy}'
+                with pipeline.timer('acquire'):
+                    img, h = ctrl.get_image(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys=key)
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+                pipeline.submit(img)
 
-        readout = np.array(h[key])
-        readouts.append(readout)
-        shifts.append(shift)
+                readout = np.array(h[key])
+                readouts.append(readout)
+        finally:
+            print('')
+            # print "\nReset to center"
+            attr.set(*readout_cent)
+
+        shifts = pipeline.results()
 
-    print('')
-    # print "\nReset to center"
-    attr.set(*readout_cent)
+    pipeline.print_timings()
 
     # correct for binsize, store in binsize=1
     shifts = np.array(shifts) * binsize / scale
@@ -269,6 +276,7 @@ def calibrate_directbeam_from_file(center_fn, other_fn, key='DiffShift'):
     readout_cent = np.array(h_cent[key])
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    registrar = Registrar(img_cent, upsample_factor=10)
 
     binsize = h_cent['ImageBinsize']
 
@@ -287,7 +295,7 @@ def calibrate_directbeam_from_file(center_fn, other_fn, key='DiffShift'):
         print('Image:', fn)
         print('{}: dx={} | dy={}'.format(key, *readout))
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift = registrar.register(img)
 
         readouts.append(readout)
         shifts.append(shift)
@@ -3,11 +3,11 @@ import sys
 import time
 
 import numpy as np
-from skimage.registration import phase_cross_correlation
 
 from instamatic import config
 from instamatic.formats import read_image
 from instamatic.image_utils import autoscale, imgscale
+from instamatic.imreg import Registrar
 from instamatic.io import get_new_work_subdirectory
 
 from .calibrate_stage_lowmag import CalibStage
@@ -93,6 +93,7 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
     xy_cent = np.array([x_cent, y_cent])
 
     img_cent, scale = autoscale(img_cent)
+    registrar = Registrar(img_cent, upsample_factor=10)
 
     stagepos = []
     shifts = []
@@ -131,7 +132,7 @@ def calibrate_mag1_live(ctrl, gridsize=5, stepsize=5000, minimize_backlash=True,
 
             img = imgscale(img, scale)
 
-            shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+            shift = registrar.register(img)
 
             xobs = stage.x
             yobs = stage.y
@@ -193,6 +194,7 @@ def calibrate_mag1_from_image_fn(center_fn, other_fn):
     binsize = int(bin_x)
 
     img_cent, scale = autoscale(img_cent, maxdim=512)
+    registrar = Registrar(img_cent, upsample_factor=10)
 
     x_cent, y_cent, _, _, _ = h_cent['StagePosition']
 
@@ -213,7 +215,7 @@ def calibrate_mag1_from_image_fn(center_fn, other_fn):
         print('Image:', fn)
         print(f'Stageposition: x={xobs:.0f} | y={yobs:.0f}')
 
-        shift, error, phasediff = phase_cross_correlation(img_cent, img, upsample_factor=10)
+        shift = registrar.register(img)
         print('Shift:', shift)
         print()
 
@@ -4,12 +4,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import yaml
 from scipy import stats
-from skimage.registration import phase_cross_correlation
 
 from instamatic import config
 from instamatic.calibrate.fit import fit_affine_transformation
+from instamatic.calibrate.pipeline import CorrelationPipeline
 from instamatic.formats import read_tiff, write_tiff
 from instamatic.image_utils import rotate_image
+from instamatic.imreg import Registrar
 from instamatic.io import get_new_work_subdirectory
 
 np.set_printoptions(suppress=True)
@@ -38,11 +39,22 @@ def get_outlier_filter(data, threshold: float = 2.0) -> list:
 
 
 def cross_correlate_image_pairs(pairs: tuple) -> list:
-    """Cross correlate image pairs."""
+    """Cross correlate image pairs.
+
+    The spectrum of the reference image is only calculated when the
+    reference changes, so that pairs that share the first image reuse
+    it.
+    """
+    registrar = Registrar(upsample_factor=10)
+    reference = None
+
     translations = []
     for img0, img1 in pairs:
-        translation, error, phasediff = phase_cross_correlation(img0, img1, upsample_factor=10)
-        print(f'shift {translation} error {error:.4f} phasediff {phasediff:.4f}')
+        if img0 is not reference:
+            registrar.set_reference(img0)
+            reference = img0
+        translation, peak = registrar.register(img1, return_peak=True)
+        print(f'shift {translation} peak {peak:.4f}')
         translations.append(translation)
     return translations
 
@@ -160,42 +172,51 @@ def calibrate_stage_from_stageshifts(ctrl,
     mode = ctrl.mode.get()
     binning = ctrl.cam.getBinning()
 
-    pairs = []
+    # each image is cross correlated with the previous one in the background while the stage moves
+    with CorrelationPipeline(Registrar(upsample_factor=10)) as pipeline:
 
-    for i, (n_steps, step) in enumerate(args):
-        j = 0
+        for i, (n_steps, step) in enumerate(args):
+            j = 0
 
-        current_stage_pos = ctrl.stage
-        dx, dy = step
+            current_stage_pos = ctrl.stage
+            dx, dy = step
 
-        last_img, _ = ctrl.get_image()
+            with pipeline.timer('acquire'):
+                last_img, _ = ctrl.get_image()
 
-        if drc:
-            write_tiff(drc / f'{i}_{j}.tiff', last_img)
+            if drc:
+                write_tiff(drc / f'{i}_{j}.tiff', last_img)
 
-        for j in range(1, n_steps):
-            new_x_pos = current_stage_pos.x + dx
-            new_y_pos = current_stage_pos.y + dy
-            ctrl.stage.set_xy_with_backlash_correction(x=new_x_pos, y=new_y_pos)
+            for j in range(1, n_steps):
+                new_x_pos = current_stage_pos.x + dx
+                new_y_pos = current_stage_pos.y + dy
+                with pipeline.timer('move'):
+                    ctrl.stage.set_xy_with_backlash_correction(x=new_x_pos, y=new_y_pos)
 
-            img, _ = ctrl.get_image()
+                with pipeline.timer('acquire'):
+                    img, _ = ctrl.get_image()
 
-            if drc:
-                write_tiff(drc / f'{i}_{j}.tiff', img)
+                if drc:
+                    write_tiff(drc / f'{i}_{j}.tiff', img)
 
-            pairs.append((last_img, img))
-            stage_shifts.append((dx, dy))
+                pipeline.submit(img, reference=last_img)
+                stage_shifts.append((dx, dy))
 
-            current_stage_pos = ctrl.stage
+                current_stage_pos = ctrl.stage
 
-            print(f'{i:02d}-{j:02d}: {current_stage_pos}')
+                print(f'{i:02d}-{j:02d}: {current_stage_pos}')
 
-            last_img = img
+                last_img = img
 
-        # return to original position
-        ctrl.stage.xy = (stage_x, stage_y)
+            # return to original position
+            with pipeline.timer('move'):
+                ctrl.stage.xy = (stage_x, stage_y)
 
-    translations = cross_correlate_image_pairs(pairs)
+        translations = pipeline.results()
+
+    for translation in translations:
+        print(f'shift {translation}')
+    pipeline.print_timings()
 
     # Filter outliers
     sel = get_outlier_filter(translations)
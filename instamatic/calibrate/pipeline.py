@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from instamatic.imreg import Registrar
+
+
+class CorrelationPipeline:
+    """Cross correlate calibration images in a background thread, so that the
+    correlation of image `n` overlaps with moving the microscope to and
+    exposing image `n+1`.
+
+    Images are registered in the order they are submitted against the
+    reference of the `registrar`, or against the `reference` given with
+    the image (the spectrum is only recalculated when it changes).
+    `preprocess(img)` is applied in the worker before the correlation
+    (e.g. `imgscale`).
+
+    The time spent in each phase is recorded with `timer(name)` (used
+    for the hardware steps) and reported by `print_timings`.
+
+    Usage:
+        with CorrelationPipeline(Registrar(img_cent, upsample_factor=10)) as pipeline:
+            for ...:
+                with pipeline.timer('move'):
+                    ctrl.beamshift.set(x, y)
+                with pipeline.timer('acquire'):
+                    img, h = ctrl.get_image()
+                pipeline.submit(img)
+            shifts = pipeline.results()
+        pipeline.print_timings()
+    """
+
+    def __init__(self, registrar: Registrar = None, preprocess=None):
+        super().__init__()
+
+        self.registrar = registrar or Registrar(upsample_factor=10)
+        self.preprocess = preprocess
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='CorrelationWorker')
+        self._futures = []
+        self._reference = None
+        self._lock = threading.Lock()
+
+        self.timings = defaultdict(float)
+        self._t_start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def _add_time(self, name: str, dt: float) -> None:
+        with self._lock:
+            self.timings[name] += dt
+
+    @contextmanager
+    def timer(self, name: str):
+        """Add the time spent in the block to phase `name`."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(name, time.perf_counter() - t0)
+
+    def _register(self, img: np.ndarray, reference: np.ndarray = None) -> np.ndarray:
+        with self.timer('correlate'):
+            if self.preprocess:
+                img = self.preprocess(img)
+            if reference is not None and reference is not self._reference:
+                self.registrar.set_reference(self.preprocess(reference) if self.preprocess else reference)
+                self._reference = reference
+            return self.registrar.register(img)
+
+    def submit(self, img: np.ndarray, reference: np.ndarray = None) -> None:
+        """Queue `img` for registration, returns immediately."""
+        self._futures.append(self._executor.submit(self._register, img, reference))
+
+    def results(self) -> list:
+        """Wait for the queued images, and return the shifts in the order
+        they were submitted."""
+        with self.timer('wait'):
+            shifts = [future.result() for future in self._futures]
+        self.timings['total'] = time.perf_counter() - self._t_start
+        return shifts
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def print_timings(self) -> None:
+        """Print the time spent in each phase.
+
+        `correlate` runs in the background, so only `wait` (time spent
+        waiting for the correlations after the last image) adds to the
+        total time on top of the hardware steps.
+        """
+        timings = dict(self.timings)
+        total = timings.pop('total', time.perf_counter() - self._t_start)
+        n = len(self._futures)
+
+        print(f'\nTotal time: {total:.2f} s ({n} images)')
+        for name, dt in timings.items():
+            print(f'  {name:10s} {dt:8.2f} s ({dt / max(n, 1):.3f} s/image)')
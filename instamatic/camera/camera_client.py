@@ -1,18 +1,29 @@
+import asyncio
 import atexit
 import socket
 import subprocess as sp
 import time
+import weakref
 from functools import wraps
 
 import numpy as np
 
 from instamatic import config
 from instamatic.exceptions import TEMCommunicationError, exception_list
+from instamatic.server.framing import (
+    async_recv_array,
+    async_recv_msg,
+    async_send_msg,
+    recv_array,
+    recv_msg,
+    send_msg,
+    set_nodelay,
+)
 from instamatic.server.serializer import pickle_dumper as dumper
 from instamatic.server.serializer import pickle_loader as loader
 
 if config.settings.cam_use_shared_memory:
-    from multiprocessing import shared_memory
+    from instamatic.server.shm_ring import SharedMemoryRing
 
 HOST = config.settings.cam_server_host
 PORT = config.settings.cam_server_port
@@ -75,18 +86,14 @@ class CamClient:
         self.use_shared_memory = config.settings.cam_use_shared_memory and self.is_local_connection
         print('Use shared memory:', self.use_shared_memory)
 
-        self.buffers = {}
-        self.shms = {}
+        self.rings = {}
+        self._release = []
 
         self._init_dict()
         self._init_attr_dict()
 
         atexit.register(self.s.close)
 
-        xres, yres = self.getImageDimensions()
-        bitdepth = 4
-        self._imagebufsize = bitdepth * xres * yres + self._bufsize
-
     @property
     def is_local_connection(self):
         """Check if the socket connection is a local connection."""
@@ -95,6 +102,7 @@ class CamClient:
     def connect(self):
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s.connect((HOST, PORT))
+        set_nodelay(self.s)
         print(f'Connected to CAM server ({HOST}:{PORT})')
 
     def __getattr__(self, attr_name):
@@ -117,20 +125,30 @@ class CamClient:
 
     def _eval_dct(self, dct):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'."""
-        self.s.send(dumper(dct))
-
         acquiring_image = dct['attr_name'] == 'getImage'
 
-        if acquiring_image and not self.use_shared_memory:
-            response = self.s.recv(self._imagebufsize)
-        else:
-            response = self.s.recv(self._bufsize)
+        if acquiring_image:
+            dct['shared_memory'] = self.use_shared_memory
 
-        if response:
-            status, data = loader(response)
+        if self._release:
+            # hand back shared memory slots of frames that are no longer referenced
+            dct['release'], self._release = self._release, []
+
+        send_msg(self.s, dumper(dct))
+
+        response = recv_msg(self.s)
 
-        if self.use_shared_memory and acquiring_image:
-            data = self.get_data_from_shared_memory(**data)
+        if not response:
+            raise ConnectionError('Connection closed by the CAM server')
+
+        status, data = loader(response)
+
+        if acquiring_image and status == 200:
+            if 'name' in data:
+                data = self.get_data_from_shared_memory(**data)
+            else:
+                # raw image buffer follows the header
+                data = recv_array(self.s, **data)
 
         if status == 200:
             return data
@@ -158,35 +176,181 @@ class CamClient:
     def __dir__(self):
         return tuple(self._dct.keys()) + tuple(self._attr_dct.keys())
 
-    def get_data_from_shared_memory(self, name: str, shape: tuple, dtype: str, **kwargs):
-        """Grab image data from shared buffer."""
-        dtype = getattr(np, dtype)
-
-        # Initialize shared memory object
-        if name not in self.shms:
-            shm = shared_memory.SharedMemory(name=name)
-            self.shms[name] = shm
-            if self.verbose:
-                print('Read shared memory: `{name}`')
+    def get_data_from_shared_memory(self, name: str, shape: tuple, dtype: str, nslots: int, slot: int, seq: int, **kwargs):
+        """Grab image data from the shared ring buffer.
 
-        # Initialize shared memory buffer
-        if name not in self.buffers:
+        Returns a view of the frame in shared memory. The slot is handed
+        back to the server with the next request once the returned array
+        and all views derived from it are garbage collected, until then
+        the server will not overwrite it.
+        """
+        # Connect to shared memory ring buffer
+        if name not in self.rings:
             if self.verbose:
-                print(f'Connect to buffer: `{name}` | {shape} ({dtype})')
-            shm = self.shms[name]
-            self.buffers[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                print(f'Connect to buffer: `{name}` | {nslots}x{shape} ({dtype})')
+            self.rings[name] = SharedMemoryRing.attach(name=name, shape=shape, dtype=dtype, nslots=nslots)
 
-        # Copy data from shared image buffer
         if self.verbose:
-            print(f'Retrieve data from buffer `{name}`')
+            print(f'Retrieve data from buffer `{name}` (slot={slot}, seq={seq})')
+
+        ring = self.rings[name]
+        owner = _SlotOwner(ring.frames[slot])
+
+        # every view of `data` keeps `owner` alive through its `.base` chain
+        weakref.finalize(owner, self._release_slot, name, slot, seq)
 
-        buffer = self.buffers[name]
-        data = buffer[:]
+        return np.asarray(owner)
 
-        return data
+    def _release_slot(self, name: str, slot: int, seq: int) -> None:
+        """Hand the slot back to the server with the next request."""
+        self._release.append((name, slot, seq))
 
     def block(self):
         raise NotImplementedError('This camera cannot be streamed.')
 
     def unblock(self):
         raise NotImplementedError('This camera cannot be streamed.')
+
+
+class _SlotOwner:
+    """Owner of a frame in the shared ring buffer.
+
+    Arrays made with `np.asarray(owner)` have it as their `.base`, and so
+    do all views derived from them (slices, transposes, etc.), so that it
+    is only garbage collected once none of them are in use.
+    """
+
+    def __init__(self, frame: np.ndarray):
+        super().__init__()
+        self._frame = frame
+        self.__array_interface__ = frame.__array_interface__
+
+
+class AsyncCamClient:
+    """asyncio version of `CamClient`. The functions and attributes of the
+    camera interface return coroutines, so that image acquisition can be
+    overlapped with other (microscope) calls without threads. Requires a
+    running CAM server.
+
+    Usage:
+        async with AsyncCamClient(name='timepix', interface='timepix') as cam:
+            img, _ = await asyncio.gather(cam.getImage(exposure=0.5), tem.setStagePosition(a=20))
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interface: str,
+    ):
+        super().__init__()
+
+        self.name = name
+        self.interface = interface
+        self.verbose = False
+
+        self.s = None
+        self.use_shared_memory = False
+        self.rings = {}
+        self._release = []
+        self._attr_dct = {}
+        self._lock = None
+
+        self._init_dict()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def connect(self):
+        """Connect to the CAM server."""
+        loop = asyncio.get_running_loop()
+
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.s.setblocking(False)
+        await loop.sock_connect(self.s, (HOST, PORT))
+        set_nodelay(self.s)
+        print(f'Connected to CAM server ({HOST}:{PORT})')
+
+        # the server handles the requests of a connection one at a time
+        self._lock = asyncio.Lock()
+
+        self.use_shared_memory = config.settings.cam_use_shared_memory and self.is_local_connection
+
+        self._attr_dct = await self._eval_dct({'attr_name': 'get_attrs'})
+
+    async def close(self):
+        """Close the connection to the CAM server."""
+        if self.s:
+            self.s.close()
+            self.s = None
+
+    is_local_connection = CamClient.is_local_connection
+
+    def __getattr__(self, attr_name):
+        if attr_name in self._dct:
+            wrapped = self._dct[attr_name]
+        elif attr_name in self._attr_dct:
+            dct = {'attr_name': attr_name}
+            return self._eval_dct(dct)
+        else:
+            raise AttributeError(f'`{self.__class__.__name__}` object has no attribute `{attr_name}`')
+
+        @wraps(wrapped)
+        async def wrapper(*args, **kwargs):
+            dct = {'attr_name': attr_name,
+                   'args': args,
+                   'kwargs': kwargs}
+            return await self._eval_dct(dct)
+
+        return wrapper
+
+    async def _eval_dct(self, dct):
+        """Send `dct` to the server and wait for the response."""
+        if not self.s:
+            raise TEMCommunicationError('Not connected to the CAM server, use `connect` first')
+
+        loop = asyncio.get_running_loop()
+
+        acquiring_image = dct['attr_name'] == 'getImage'
+
+        if acquiring_image:
+            dct['shared_memory'] = self.use_shared_memory
+
+        async with self._lock:
+            if self._release:
+                dct['release'], self._release = self._release, []
+
+            await async_send_msg(loop, self.s, dumper(dct))
+
+            response = await async_recv_msg(loop, self.s)
+
+            if not response:
+                raise ConnectionError('Connection closed by the CAM server')
+
+            status, data = loader(response)
+
+            if acquiring_image and status == 200:
+                if 'name' in data:
+                    data = self.get_data_from_shared_memory(**data)
+                else:
+                    data = await async_recv_array(loop, self.s, **data)
+
+        if status == 200:
+            return data
+
+        elif status == 500:
+            error_code, args = data
+            raise exception_list.get(error_code, TEMCommunicationError)(*args)
+
+        else:
+            raise ConnectionError(f'Unknown status code: {status}')
+
+    _init_dict = CamClient._init_dict
+    get_data_from_shared_memory = CamClient.get_data_from_shared_memory
+    _release_slot = CamClient._release_slot
+
+    def __dir__(self):
+        return tuple(self._dct.keys()) + tuple(self._attr_dct.keys())
@@ -5,6 +5,9 @@ import numpy as np
 from instamatic.image_utils import autoscale
 
 from .camera import Camera
+from .frame_ring import FrameRing
+from .frame_ring import Subscription
+from .renderer import FrameRenderer
 
 
 class VideoStream(threading.Thread):
@@ -34,6 +37,8 @@ class VideoStream(threading.Thread):
         self.display_dim = 512
 
         self.frame, scale = autoscale(np.ones(self.dimensions), maxdim=self.display_dim)
+        self.ring = FrameRing(size=1)
+        self.renderer = None
 
     def __getattr__(self, attrname):
         """Pass attribute lookups to self.cam to prevent AttributeError."""
@@ -51,13 +56,33 @@ class VideoStream(threading.Thread):
 
         self.frame, scale = autoscale(frame, maxdim=self.display_dim)
 
+        self.ring.publish(self.frame, acquired=True)
+
         return frame
 
+    def subscribe(self, name: str = None) -> Subscription:
+        """Subscribe to the (downscaled) frames, see `FrameRing`."""
+        return self.ring.subscribe(name)
+
+    def dropped_frames(self) -> dict:
+        return self.ring.dropped_frames()
+
+    def start_renderer(self, **kwargs) -> FrameRenderer:
+        """Render the frames for display in a worker thread (see
+        `FrameRenderer`), `kwargs` are passed to the renderer."""
+        if self.renderer is None:
+            kwargs.setdefault('dynamic_range', self.cam.dynamic_range)
+            self.renderer = FrameRenderer(self.subscribe('renderer'), **kwargs).start()
+            self.ring.publish(self.frame)
+        return self.renderer
+
     def update_frametime(self, frametime):
         self.frametime = frametime
 
     def close(self):
-        pass
+        if self.renderer is not None:
+            self.renderer.stop()
+        self.ring.close()
 
     def block(self):
         pass
@@ -65,7 +90,7 @@ class VideoStream(threading.Thread):
     def unblock(self):
         pass
 
-    def continuous_collection(self, exposure=0.1, n=100, callback=None):
+    def continuous_collection(self, exposure=0.1, n=100, callback=None, filename=None):
         """Function to continuously collect data Blocks the videostream while
         collecting data, and only shows collected images.
 
@@ -73,10 +98,12 @@ class VideoStream(threading.Thread):
             exposure time
         n: int
             number of frames to collect
-            if defined, returns a list of collected frames
+            if defined, returns an array with the collected frames (n, h, w)
         callback: function
             This function is called on every iteration with the image as first argument
             Should return True or False if data collection is to continue
+        filename: str
+            Additionally save the frames to a `.npy` file (only without `callback`)
         """
         buffer = []
 
@@ -98,7 +125,10 @@ class VideoStream(threading.Thread):
         self.unblock()
 
         if not callback:
-            return buffer
+            stack = np.stack(buffer)
+            if filename:
+                np.save(filename, stack)
+            return stack
 
     def show_stream(self):
         from instamatic.gui import videostream_frame
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+Frame = namedtuple('Frame', 'seq timestamp frame acquired')
+Frame.__doc__ = """Frame published to a `FrameRing`, `seq` counts from 0, `timestamp`
+is from `time.monotonic()`, `acquired` is True for frames that were
+requested with `VideoStream.getImage`."""
+
+
+class FrameRing:
+    """Fixed-size ring buffer of the most recent frames from the camera
+    stream.
+
+    The grabber publishes every frame with a sequence number and a
+    monotonic timestamp. Consumers (GUI, drift monitor, recorder) each
+    `subscribe` to the ring, and read the frames at their own pace with
+    their own cursor. A subscriber that falls more than `size` frames
+    behind loses the oldest frames, these are counted in its `dropped`
+    attribute.
+
+    Frames are stored by reference (not copied), so they must not be
+    modified after they are published.
+
+    Usage:
+        ring = FrameRing(size=4)
+        sub = ring.subscribe('drift')
+        ring.publish(frame)
+        item = sub.get(timeout=1.0)  # Frame(seq, timestamp, frame, acquired)
+    """
+
+    def __init__(self, size: int = 4):
+        super().__init__()
+
+        self.size = size
+        self.seq = -1
+
+        self._slots = [None] * size
+        self._cond = threading.Condition()
+        self.subscriptions = []
+
+    def publish(self, frame: np.ndarray, acquired: bool = False) -> int:
+        """Add a frame to the ring and wake up the subscribers, returns its
+        sequence number."""
+        timestamp = time.monotonic()
+        with self._cond:
+            self.seq += 1
+            self._slots[self.seq % self.size] = Frame(self.seq, timestamp, frame, acquired)
+            self._cond.notify_all()
+        return self.seq
+
+    def latest(self) -> Frame:
+        """Return the most recent frame, or None if nothing has been
+        published yet."""
+        with self._cond:
+            if self.seq < 0:
+                return None
+            return self._slots[self.seq % self.size]
+
+    def subscribe(self, name: str = None) -> 'Subscription':
+        """Return a new subscription, which receives the frames published
+        from now on."""
+        with self._cond:
+            subscription = Subscription(self, name=name, cursor=self.seq)
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: 'Subscription') -> None:
+        with self._cond:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+            subscription.closed = True
+            self._cond.notify_all()
+
+    def dropped_frames(self) -> dict:
+        """Return the number of dropped frames for every subscriber."""
+        with self._cond:
+            return {sub.name: sub.dropped for sub in self.subscriptions}
+
+    def close(self) -> None:
+        """Close all subscriptions, so that waiting subscribers return."""
+        for subscription in list(self.subscriptions):
+            self.unsubscribe(subscription)
+
+
+class Subscription:
+    """Cursor into a `FrameRing`, see `FrameRing.subscribe`.
+
+    `received` counts the frames returned by `get`, `dropped` the frames
+    that were skipped, because they were overwritten before they were
+    read or because `latest=True` was used.
+    """
+
+    def __init__(self, ring: FrameRing, name: str = None, cursor: int = -1):
+        super().__init__()
+
+        self.ring = ring
+        self.name = name
+        self.cursor = cursor
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, cursor={self.cursor}, received={self.received}, dropped={self.dropped})'
+
+    def get(self, timeout: float = None, latest: bool = False) -> Frame:
+        """Wait for the next frame and return it.
+
+        If `latest` is True, skip to the most recent frame (e.g. for
+        display). Returns None if no frame arrived within `timeout`
+        seconds, or if the subscription was closed.
+        """
+        ring = self.ring
+        with ring._cond:
+            ready = ring._cond.wait_for(lambda: ring.seq > self.cursor or self.closed, timeout=timeout)
+            if not ready or self.closed:
+                return None
+
+            if latest:
+                seq = ring.seq
+            else:
+                # the oldest frame that has not been overwritten yet
+                seq = max(self.cursor + 1, ring.seq - ring.size + 1)
+
+            self.dropped += seq - self.cursor - 1
+            self.received += 1
+            self.cursor = seq
+            return ring._slots[seq % ring.size]
+
+    def pending(self) -> int:
+        """Number of frames published since the last `get`."""
+        return self.ring.seq - self.cursor
+
+    def close(self) -> None:
+        self.ring.unsubscribe(self)
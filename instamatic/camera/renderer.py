@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRenderer:
+    """Render the frames from the camera stream for display in a worker
+    thread, so that the GUI only has to blit the result.
+
+    The frames are read from a `subscription` to the camera stream (see
+    `FrameRing`). The worker always skips to the most recent frame, so
+    frames that arrive while it is busy are dropped (counted in
+    `subscription.dropped`). Every frame is:
+
+        1. downsampled by an integer stride to at most ~`maxdim` pixels
+           (or to `resize` if given)
+        2. mapped to uint8 through a lookup table, which combines the
+           contrast (`display_range`, or a running estimate of the
+           `percentile` with `auto_contrast`) and the `brightness`
+
+    The settings are plain attributes and may be changed at any time,
+    they are applied to the next frame.
+
+    Usage:
+        renderer = FrameRenderer(stream.subscribe('renderer'), dynamic_range=11800).start()
+        image, count = renderer.latest()
+    """
+
+    def __init__(self,
+                 subscription,
+                 dynamic_range: int = 2**16 - 1,
+                 maxdim: int = 512,
+                 percentile: float = 99.5,
+                 smoothing: float = 0.3,
+                 ):
+        super().__init__()
+
+        self.subscription = subscription
+        self.dynamic_range = dynamic_range
+        self.maxdim = maxdim
+        self.percentile = percentile
+        self.smoothing = smoothing
+
+        self.auto_contrast = True
+        self.display_range = dynamic_range
+        self.brightness = 1.0
+        self.resize = None
+
+        self.image = None
+        self.count = 0
+        self.render_time = 0.0
+
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+
+        self._vmax = None
+        self._lut = None
+        self._lut_key = None
+
+        self.thread = None
+
+    def start(self) -> 'FrameRenderer':
+        self.thread = threading.Thread(target=self.run, name='FrameRenderer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopEvent.set()
+        self.subscription.close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def latest(self) -> tuple:
+        """Return the last rendered image (uint8) and its count, the count
+        is increased with every rendered frame."""
+        with self._lock:
+            return self.image, self.count
+
+    def run(self) -> None:
+        while not self._stopEvent.is_set():
+            item = self.subscription.get(latest=True)
+            if item is None:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                image = self.render(item.frame)
+            except Exception:
+                # keep the display alive, the next frame may render fine
+                logger.exception('Could not render frame %d', item.seq)
+                continue
+            self.render_time = time.perf_counter() - t0
+
+            with self._lock:
+                self.image = image
+                self.count += 1
+
+    def downsample(self, frame: np.ndarray) -> np.ndarray:
+        """Return a strided view of the frame that fits the display size."""
+        maxdim = max(self.resize) if self.resize else self.maxdim
+        step = max(1, max(frame.shape) // maxdim)
+        return frame[::step, ::step]
+
+    def update_contrast(self, frame: np.ndarray) -> float:
+        """Return the value that maps to white.
+
+        With `auto_contrast`, the percentile is calculated on a sparse
+        sample of the frame, and averaged with the previous estimate to
+        reduce flickering.
+        """
+        if not self.auto_contrast:
+            return max(1.0, float(self.display_range))
+
+        sample = frame[::4, ::4].ravel()
+        k = min(sample.size - 1, int(sample.size * self.percentile / 100))
+        high = float(np.partition(sample, k)[k]) + 1
+
+        if self._vmax is None:
+            self._vmax = high
+        else:
+            self._vmax += self.smoothing * (high - self._vmax)
+        return self._vmax
+
+    def lookup_table(self, size: int, vmax: float) -> np.ndarray:
+        """Return the lookup table from pixel value to uint8, it is only
+        recalculated when the contrast or brightness change."""
+        key = (size, vmax, self.brightness)
+        if key != self._lut_key:
+            scale = 255.0 * self.brightness / vmax
+            lut = np.arange(size, dtype=np.float32)
+            lut *= scale
+            np.clip(lut, 0, 255, out=lut)
+            self._lut = lut.astype(np.uint8)
+            self._lut_key = key
+        return self._lut
+
+    def render(self, frame: np.ndarray) -> np.ndarray:
+        """Render the frame to a display-ready uint8 image."""
+        frame = self.downsample(np.asarray(frame))
+        vmax = self.update_contrast(frame)
+
+        if frame.dtype.kind in 'ui':
+            size = 256 if frame.dtype.itemsize == 1 else 2**16
+            # values outside of the table are clipped to the first/last entry
+            image = np.take(self.lookup_table(size, vmax), frame, mode='clip')
+        else:
+            image = frame * np.float32(255.0 * self.brightness / vmax)
+            image = np.clip(image, 0, 255, out=image).astype(np.uint8)
+
+        if self.resize and image.shape != tuple(self.resize):
+            image = np.asarray(Image.fromarray(image).resize(self.resize))
+
+        return image
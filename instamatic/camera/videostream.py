@@ -1,15 +1,127 @@
 import atexit
 import threading
+import time
+
+import numpy as np
 
 from .camera import Camera
+from .frame_ring import FrameRing
+from .frame_ring import Subscription
+from .renderer import FrameRenderer
+
+
+class Recording:
+    """Preallocated stack of `n` frames recorded by the `ImageGrabber`.
+
+    The stack is allocated when the first frame arrives (the shape and
+    dtype are taken from the frame), as a contiguous array, or as a `.npy`
+    file that is memory mapped if `filename` is given (for long runs that
+    do not fit in memory). Every frame is copied into the next slot, and
+    its `time.monotonic()` timestamp (at readout) is stored in
+    `timestamps`.
+
+    Use `wait` to block until the recording is complete, and `stop` to end
+    it early, `frames` returns the recorded part of the stack. The memory
+    mapped file is flushed before the recording is marked as done.
+    """
+
+    def __init__(self, n: int, exposure: float, filename: str = None):
+        super().__init__()
+
+        self.n = n
+        self.exposure = exposure
+        self.filename = filename
+
+        self.stack = None
+        self.timestamps = np.full(n, np.nan)
+        self.count = 0
+
+        self.stopEvent = threading.Event()
+        self.doneEvent = threading.Event()
+
+        # the grabber thread that records the frames, set by `ImageGrabber.record`
+        self.thread = None
+
+    def allocate(self, frame) -> None:
+        shape = (self.n, *frame.shape)
+        if self.filename:
+            self.stack = np.lib.format.open_memmap(self.filename, mode='w+', dtype=frame.dtype, shape=shape)
+        else:
+            self.stack = np.empty(shape, dtype=frame.dtype)
+
+    def add(self, frame):
+        """Store the frame in the next slot, returns the slot."""
+        if self.stack is None:
+            self.allocate(frame)
+
+        i = self.count
+        self.timestamps[i] = time.monotonic()
+        self.stack[i] = frame
+        self.count += 1
+
+        if self.count == self.n:
+            self.finish()
+
+        return self.stack[i]
+
+    def finish(self) -> None:
+        """Flush the stack to the file (if memory mapped), and mark the
+        recording as done."""
+        if isinstance(self.stack, np.memmap):
+            self.stack.flush()
+        self.doneEvent.set()
+
+    @property
+    def done(self) -> bool:
+        return self.doneEvent.is_set()
+
+    def stop(self, timeout: float = None) -> bool:
+        """End the recording after the current frame, and wait until it is
+        done (max `timeout` s). Returns False if it is not done in time."""
+        self.stopEvent.set()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.doneEvent.wait(timeout=0.1):
+            if self.thread is None or not self.thread.is_alive():
+                # the grabber is gone, so nothing else writes to the stack
+                self.finish()
+            elif deadline is not None and time.perf_counter() > deadline:
+                return False
+        return True
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the recording is done (max `timeout` s), returns False
+        if it is not done in time.
+
+        Raises RuntimeError if the grabber thread has exited before the
+        recording was done (e.g. because the camera raised an error).
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.doneEvent.wait(timeout=0.1):
+            if self.thread is not None and not self.thread.is_alive() and not self.done:
+                raise RuntimeError(f'Recording stopped after {self.count}/{self.n} frames, the image grabber has exited')
+            elif deadline is not None and time.perf_counter() > deadline:
+                return False
+        return True
+
+    @property
+    def frames(self):
+        """The recorded frames (a view of the stack)."""
+        if self.stack is None:
+            return np.empty((0, 0, 0))
+        return self.stack[:self.count]
 
 
 class ImageGrabber:
     """Continuously read out the camera for continuous acquisition.
 
-    When the continousCollectionEvent is set, the camera will set the
-    exposure to `frametime`, otherwise, the default camera exposure is
-    used.
+    The camera is read out with an exposure of `frametime`, unless the
+    continuousCollectionEvent is set. In that case, the grabber sleeps
+    until a frame is requested with the acquireInitiateEvent, which is
+    read out with `exposure`.
+
+    While a `Recording` is set with `record`, the camera is read out back
+    to back with the exposure of the recording, and every frame returned
+    by the camera is copied into the next slot of its stack.
 
     The callback function is used to send the frame back to the parent
     routine.
@@ -42,6 +154,31 @@ class ImageGrabber:
         self.acquireInitiateEvent = threading.Event()
         self.acquireCompleteEvent = threading.Event()
         self.continuousCollectionEvent = threading.Event()
+        self.wakeEvent = threading.Event()
+
+        self.recording = None
+
+    def record(self, recording: Recording) -> Recording:
+        """Start recording, returns immediately."""
+        if self.recording is not None:
+            raise RuntimeError('A recording is already in progress')
+        recording.thread = self.thread
+        self.recording = recording
+        self.wakeEvent.set()
+        return recording
+
+    def _record_frame(self):
+        recording = self.recording
+
+        frame = self.cam.getImage(exposure=recording.exposure, binsize=self.binsize)
+        frame = recording.add(frame)
+
+        if recording.stopEvent.is_set() and not recording.done:
+            recording.finish()
+        if recording.done:
+            self.recording = None
+
+        self.callback(frame)
 
     def run(self):
         while not self.stopEvent.is_set():
@@ -52,23 +189,46 @@ class ImageGrabber:
                 frame = self.cam.getImage(exposure=self.exposure, binsize=self.binsize)
                 self.callback(frame, acquire=True)
 
-            elif not self.continuousCollectionEvent.is_set():
+            elif self.recording is not None:
+                self._record_frame()
+
+            elif self.continuousCollectionEvent.is_set():
+                # streaming is paused, wait for the next request (or `stop`)
+                self.wakeEvent.wait()
+                self.wakeEvent.clear()
+
+            else:
                 frame = self.cam.getImage(exposure=self.frametime, binsize=self.binsize)
                 self.callback(frame)
 
+        # the grabber was stopped, end the recording in progress
+        if self.recording is not None:
+            self.recording.finish()
+
     def start_loop(self):
         self.thread = threading.Thread(target=self.run, args=(), daemon=True)
         self.thread.start()
 
     def stop(self):
         self.stopEvent.set()
+        # wake up the loop if it is waiting for a request
+        self.wakeEvent.set()
         self.thread.join()
+        if self.recording is not None:
+            self.recording.finish()
 
 
 class VideoStream(threading.Thread):
-    """Handle the continuous stream of incoming data from the ImageGrabber."""
+    """Handle the continuous stream of incoming data from the ImageGrabber.
+
+    Every frame is published to a ring buffer of the last `ring_size`
+    frames (see `FrameRing`). Consumers get the frames with their own
+    cursor through `subscribe`, `frame` is the most recent frame. The ring
+    keeps every frame in it alive (e.g. 16 MB for a 2k x 2k float32
+    frame), so keep `ring_size` small.
+    """
 
-    def __init__(self, cam='simulate'):
+    def __init__(self, cam='simulate', ring_size: int = 4):
         threading.Thread.__init__(self)
 
         if isinstance(cam, str):
@@ -84,7 +244,8 @@ class VideoStream(threading.Thread):
         self.name = self.cam.name
 
         self.frametime = self.default_exposure
-        self.frame = None
+        self.ring = FrameRing(size=ring_size)
+        self.renderer = None
 
         self.grabber = self.setup_grabber()
 
@@ -106,16 +267,37 @@ class VideoStream(threading.Thread):
     def start(self):
         self.grabber.start_loop()
 
+    @property
+    def frame(self):
+        """The most recent frame, or None."""
+        item = self.ring.latest()
+        return None if item is None else item.frame
+
     def send_frame(self, frame, acquire=False):
         if acquire:
             self.grabber.lock.acquire(True)
-            self.acquired_frame = self.frame = frame
+            self.acquired_frame = frame
             self.grabber.lock.release()
+            self.ring.publish(frame, acquired=True)
             self.grabber.acquireCompleteEvent.set()
         else:
-            self.grabber.lock.acquire(True)
-            self.frame = frame
-            self.grabber.lock.release()
+            self.ring.publish(frame)
+
+    def subscribe(self, name: str = None) -> Subscription:
+        """Subscribe to the frames from the stream, see `FrameRing`."""
+        return self.ring.subscribe(name)
+
+    def dropped_frames(self) -> dict:
+        """Return the number of dropped frames for every subscriber."""
+        return self.ring.dropped_frames()
+
+    def start_renderer(self, **kwargs) -> FrameRenderer:
+        """Render the streamed frames for display in a worker thread (see
+        `FrameRenderer`), `kwargs` are passed to the renderer."""
+        if self.renderer is None:
+            kwargs.setdefault('dynamic_range', self.cam.dynamic_range)
+            self.renderer = FrameRenderer(self.subscribe('renderer'), **kwargs).start()
+        return self.renderer
 
     def setup_grabber(self):
         grabber = ImageGrabber(self.cam, callback=self.send_frame, frametime=self.frametime)
@@ -133,6 +315,7 @@ class VideoStream(threading.Thread):
             self.grabber.binsize = binsize
 
         self.grabber.acquireInitiateEvent.set()
+        self.grabber.wakeEvent.set()
 
         self.grabber.acquireCompleteEvent.wait()
 
@@ -150,6 +333,9 @@ class VideoStream(threading.Thread):
 
     def close(self):
         self.grabber.stop()
+        if self.renderer is not None:
+            self.renderer.stop()
+        self.ring.close()
 
     def block(self):
         self.grabber.continuousCollectionEvent.set()
@@ -157,7 +343,17 @@ class VideoStream(threading.Thread):
     def unblock(self):
         self.grabber.continuousCollectionEvent.clear()
 
-    def continuous_collection(self, exposure=0.1, n=100, callback=None):
+    def record(self, n: int, exposure: float = 0.1, filename: str = None) -> Recording:
+        """Record `n` frames back to back into a preallocated stack, returns
+        the `Recording` immediately (see `Recording.wait`).
+
+        The frames are also published to the stream, so that the live
+        view continues during the recording. If `filename` is given, the
+        stack is written to a memory mapped `.npy` file.
+        """
+        return self.grabber.record(Recording(n, exposure=exposure, filename=filename))
+
+    def continuous_collection(self, exposure=0.1, n=100, callback=None, filename=None):
         """Function to continuously collect data Blocks the videostream while
         collecting data, and only shows collected images.
 
@@ -165,33 +361,28 @@ class VideoStream(threading.Thread):
             exposure time
         n: int
             number of frames to collect
-            if defined, returns a list of collected frames
+            if defined, returns an array with the collected frames (n, h, w),
+            which are recorded into a preallocated stack (see `record`)
         callback: function
             This function is called on every iteration with the image as first argument
             Should return True or False if data collection is to continue
+        filename: str
+            Record the frames to a memory mapped `.npy` file (only without `callback`)
         """
-        buffer = []
+        if not callback:
+            recording = self.record(n, exposure=exposure, filename=filename)
+            recording.wait()
+            return recording.frames
 
         go_on = True
-        i = 0
 
         self.block()
         while go_on:
-            i += 1
-
             img = self.getImage(exposure=exposure)
-
-            if callback:
-                go_on = callback(img)
-            else:
-                buffer.append(img)
-                go_on = i < n
+            go_on = callback(img)
 
         self.unblock()
 
-        if not callback:
-            return buffer
-
     def show_stream(self):
         from instamatic.gui import videostream_frame
         t = threading.Thread(target=videostream_frame.start_gui, args=(self, ), daemon=True)
@@ -9,6 +9,7 @@ import numpy as np
 import instamatic
 from instamatic import config
 from instamatic.formats import write_tiff
+from instamatic.processing.acquisition_pipeline import AcquisitionPipeline
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
 
 # degrees to rotate before activating data collection procedure
@@ -245,7 +246,12 @@ class Experiment:
         self.setup_paths()
         self.log_start_status()
 
-        buffer = []
+        # diffraction frames are corrected and written in the background during data collection
+        buffer = AcquisitionPipeline(tiff_path=self.tiff_path,
+                                     smv_path=self.smv_path,
+                                     mrc_path=self.mrc_path,
+                                     flatfield=self.flatfield,
+                                     maxsize=config.settings.cred_write_queue_size)
         image_buffer = []
 
         if self.ctrl.mode != 'diff':
@@ -294,7 +300,11 @@ class Experiment:
             else:
                 img, h = self.ctrl.get_image(self.exposure, header_keys=None)
                 # print(f"{i} Image!")
-                buffer.append((i, img, h))
+                try:
+                    buffer.put(i, img, h)
+                except Exception as e:
+                    print_and_log(f'Writing frames failed, stopping data collection: {e!r}', logger=self.logger)
+                    self.stopEvent.set()
 
             i += 1
 
@@ -326,6 +336,12 @@ class Experiment:
             print('Blanking beam')
             self.ctrl.beam.blank()
 
+        # re-raises the first error in the writer threads (after the beam has been blanked)
+        stats = buffer.close()
+        print_and_log(f'Wrote {stats["frames"]} frames, max queued: {stats["max_queued"]}/{stats["maxsize"]}, '
+                      f'data collection blocked {stats["blocked"]} times ({stats["blocked_time"]:.3f} s), '
+                      f'processing time: {1000 * stats["mean_process_time"]:.1f} ms/frame', logger=self.logger)
+
         # in case something went wrong starting data collection, return gracefully
         if i == 1:
             print_and_log('Data collection interrupted', logger=self.logger)
@@ -353,7 +369,7 @@ class Experiment:
         self.log_end_status()
 
         if self.nframes <= 3:
-            print_and_log(f'Not enough frames collected. Data will not be written (nframes={self.nframes})', logger=self.logger)
+            print_and_log(f'Not enough frames collected. Input files will not be written (nframes={self.nframes})', logger=self.logger)
             return False
 
         self.write_data(buffer)
@@ -374,14 +390,11 @@ class Experiment:
 
         return True
 
-    def write_data(self, buffer: list):
-        """Write diffraction data in the buffer.
-
-        The image buffer is passed as a list of tuples, where each tuple
-        contains the index (int), image data (2D numpy array),
-        metadata/header (dict).
+    def write_data(self, buffer: AcquisitionPipeline):
+        """Write the input files for the diffraction data in the buffer.
 
-        The buffer index must start at 1.
+        The frames have already been written by the `AcquisitionPipeline`
+        during data collection, only the SMV headers are updated.
         """
 
         img_conv = ImgConversion(buffer=buffer,
@@ -390,7 +403,7 @@ class Experiment:
                                  end_angle=self.end_angle,
                                  rotation_axis=self.rotation_axis,
                                  acquisition_time=self.acquisition_time,
-                                 flatfield=self.flatfield,
+                                 flatfield=None,  # applied by the pipeline
                                  pixelsize=self.pixelsize,
                                  physical_pixelsize=self.physical_pixelsize,
                                  wavelength=self.wavelength,
@@ -398,11 +411,9 @@ class Experiment:
                                  stretch_azimuth=self.stretch_azimuth,
                                  )
 
-        print('Writing data files...')
-        img_conv.threadpoolwriter(tiff_path=self.tiff_path,
-                                  mrc_path=self.mrc_path,
-                                  smv_path=self.smv_path,
-                                  workers=8)
+        if self.smv_path:
+            print('Updating SMV headers...')
+            img_conv.write_smv_headers(self.smv_path)
 
         print('Writing input files...')
         if self.write_dials:
@@ -11,7 +11,7 @@ from instamatic import config
 from instamatic.calibrate import CalibBeamShift, CalibDirectBeam
 from instamatic.formats import *
 from instamatic.processing.find_crystals import find_crystals, find_crystals_timepix
-from instamatic.processing.flatfield import apply_flatfield_correction, remove_deadpixels
+from instamatic.processing.flatfield import FlatfieldCorrector
 
 
 def make_grid_on_stage(startpoint, endpoint, padding=2.0):
@@ -196,6 +196,9 @@ class Experiment:
         self.image_spotsize = kwargs.get('image_spotsize', 4)
         # self.magnification   = kwargs["magnification"]
         self.image_threshold = kwargs.get('image_threshold', 100)
+        # write the frames to a single HDF5 stack per directory, instead of one file per frame
+        self.use_container = kwargs.get('use_container', False)
+        self.compression = kwargs.get('compression', None)
         # do not store brightness to self, as this is set later when calibrating the direct beam
         image_brightness = kwargs.get('diff_brightness', 38000)
 
@@ -205,7 +208,7 @@ class Experiment:
             self.ctrl.mode.set('mag1')
             self.ctrl.store('image')
             self.ctrl.brightness.set(image_brightness)
-            self.ctrl.tem.setSpotSize(self.image_spotsize)
+            self.ctrl.spotsize = self.image_spotsize
 
             self.calib_beamshift = CalibBeamShift.live(self.ctrl, outdir=self.calibdir)
 
@@ -227,7 +230,7 @@ class Experiment:
         except OSError:
             self.ctrl.mode.set('diff')
             self.ctrl.store('diffraction')
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+            self.ctrl.spotsize = self.diff_spotsize
 
             self.calib_directbeam = CalibDirectBeam.live(self.ctrl, outdir=self.calibdir)
 
@@ -247,8 +250,7 @@ class Experiment:
             self.flatfield = None
 
         if self.flatfield is not None:
-            self.flatfield, h_flatfield = read_tiff(self.flatfield)
-            self.deadpixels = h_flatfield['deadpixels']
+            self.flatfield = FlatfieldCorrector.from_file(self.flatfield)
 
         # self.sample_rotation_angles = ( -10, -5, 5, 10 )
         # self.sample_rotation_angles = (-5, 5)
@@ -286,7 +288,7 @@ class Experiment:
         self.ctrl.mode.set('diff')
         self.ctrl.brightness.set(self.diff_brightness)
         self.ctrl.difffocus.set(self.diff_difffocus)
-        self.ctrl.tem.setSpotSize(self.diff_spotsize)
+        self.ctrl.spotsize = self.diff_spotsize
         input('\nPress <ENTER> to get neutral diffraction shift')
         self.neutral_diffshift = np.array(self.ctrl.diffshift.get())
         self.log.info('DiffShift(x=%d, y=%d)', *self.neutral_diffshift)
@@ -296,7 +298,7 @@ class Experiment:
         self.ctrl.brightness.max()
         self.calib_beamshift.center(self.ctrl)
         self.neutral_beamshift = self.ctrl.beamshift.get()
-        self.ctrl.tem.setSpotSize(self.image_spotsize)
+        self.ctrl.spotsize = self.image_spotsize
 
     def image_mode(self, delay=0.2):
         """Switch to image mode (mag1), reset beamshift/diffshift, spread
@@ -430,12 +432,30 @@ class Experiment:
 
     def apply_corrections(self, img, h):
         if self.flatfield is not None:
-            img = remove_deadpixels(img, deadpixels=self.deadpixels)
+            img = self.flatfield(img)
             h['DeadPixelCorrection'] = True
-            img = apply_flatfield_correction(img, flatfield=self.flatfield)
             h['FlatfieldCorrection'] = True
         return img, h
 
+    def write_frame(self, outfile, img, h):
+        """Write `img` with header `h` to `outfile` (HDF5). If
+        `use_container` is set, the frame is appended to a single HDF5 stack
+        per directory instead (`images/images.h5`, `data/data.h5`), with the
+        original file name stored in the header."""
+        if not self.use_container:
+            write_hdf5(outfile, img, header=h)
+            return
+
+        drc = outfile.parent
+        if drc not in self.stacks:
+            self.stacks[drc] = HDF5Stack.create(drc / f'{drc.name}.h5',
+                                                shape=img.shape,
+                                                dtype=img.dtype,
+                                                compression=self.compression)
+
+        h['filename'] = outfile.name
+        self.stacks[drc].append(img, h)
+
     def run(self, ctrl=None, **kwargs):
         """Run serial electron diffraction experiment."""
 
@@ -465,79 +485,86 @@ class Experiment:
 
         input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
 
-        for i, d_pos in enumerate(self.loop_positions()):
+        self.stacks = {}
 
-            outfile = self.imagedir / f'image_{i:04d}'
+        try:
+            for i, d_pos in enumerate(self.loop_positions()):
 
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
+                outfile = self.imagedir / f'image_{i:04d}'
 
-            img, h = self.ctrl.get_image(exposure=self.image_exposure, binsize=self.image_binsize, header_keys=header_keys)
+                if self.change_spotsize:
+                    self.ctrl.spotsize = self.image_spotsize
 
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
+                img, h = self.ctrl.get_image(exposure=self.image_exposure, binsize=self.image_binsize, header_keys=header_keys)
 
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+                if self.change_spotsize:
+                    self.ctrl.spotsize = self.image_spotsize
 
-            im_mean = img.mean()
-            if im_mean < self.image_threshold:
-                # self.log.debug("Dark image detected (mean=%f)", im_mean)
-                continue
+                self.ctrl.spotsize = self.diff_spotsize
 
-            img, h = self.apply_corrections(img, h)
+                im_mean = img.mean()
+                if im_mean < self.image_threshold:
+                    # self.log.debug("Dark image detected (mean=%f)", im_mean)
+                    continue
 
-            crystal_positions = self.find_crystals(img, self.magnification, spread=self.crystal_spread) * self.image_binsize
-            crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
+                img, h = self.apply_corrections(img, h)
 
-            for d in (d_image, d_pos):
-                h.update(d)
-            h['exp_crystal_coords'] = crystal_coords
+                crystal_positions = self.find_crystals(img, self.magnification, spread=self.crystal_spread) * self.image_binsize
+                crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
 
-            write_hdf5(outfile, img, header=h)
+                for d in (d_image, d_pos):
+                    h.update(d)
+                h['exp_crystal_coords'] = crystal_coords
 
-            ncrystals = len(crystal_coords)
-            if ncrystals == 0:
-                continue
+                self.write_frame(outfile, img, h)
 
-            self.log.info('%d crystals found in %s', ncrystals, outfile)
+                ncrystals = len(crystal_coords)
+                if ncrystals == 0:
+                    continue
 
-            for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
-                outfile = self.datadir / f'image_{i:04d}_{k:04d}'
-                comment = f'Image {i} Crystal {k}'
-                img, h = self.ctrl.get_image(binsize=self.diff_binsize, exposure=self.diff_exposure, comment=comment, header_keys=header_keys)
-                img, h = self.apply_corrections(img, h)
+                self.log.info('%d crystals found in %s', ncrystals, outfile)
 
-                for d in (d_diff, d_pos, d_cryst):
-                    h.update(d)
+                for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
+                    outfile = self.datadir / f'image_{i:04d}_{k:04d}'
+                    comment = f'Image {i} Crystal {k}'
+                    img, h = self.ctrl.get_image(binsize=self.diff_binsize, exposure=self.diff_exposure, comment=comment, header_keys=header_keys)
+                    img, h = self.apply_corrections(img, h)
+
+                    for d in (d_diff, d_pos, d_cryst):
+                        h.update(d)
 
-                h['crystal_is_isolated'] = crystal_positions[k].isolated
-                h['crystal_clusters'] = crystal_positions[k].n_clusters
-                h['total_area_micrometer'] = crystal_positions[k].area_micrometer
-                h['total_area_pixel'] = crystal_positions[k].area_pixel
+                    h['crystal_is_isolated'] = crystal_positions[k].isolated
+                    h['crystal_clusters'] = crystal_positions[k].n_clusters
+                    h['total_area_micrometer'] = crystal_positions[k].area_micrometer
+                    h['total_area_pixel'] = crystal_positions[k].area_pixel
 
-                # img_processed = neural_network.preprocess(img.astype(float))
-                # quality = neural_network.predict(img_processed)
-                # h["crystal_quality"] = quality
+                    # img_processed = neural_network.preprocess(img.astype(float))
+                    # quality = neural_network.predict(img_processed)
+                    # h["crystal_quality"] = quality
 
-                write_hdf5(outfile, img, header=h)
+                    self.write_frame(outfile, img, h)
 
-                if self.sample_rotation_angles:
-                    for rotation_angle in self.sample_rotation_angles:
-                        self.log.debug('Rotation angle = %f', rotation_angle)
-                        self.ctrl.stage.a = rotation_angle
+                    if self.sample_rotation_angles:
+                        for rotation_angle in self.sample_rotation_angles:
+                            self.log.debug('Rotation angle = %f', rotation_angle)
+                            self.ctrl.stage.a = rotation_angle
 
-                        outfile = self.datadir / f'image_{i:04d}_{k:04d}_{rotation_angle}'
-                        img, h = self.ctrl.get_image(exposure=self.diff_exposure, binsize=self.diff_binsize, comment=comment, header_keys=header_keys)
-                        img, h = self.apply_corrections(img, h)
+                            outfile = self.datadir / f'image_{i:04d}_{k:04d}_{rotation_angle}'
+                            img, h = self.ctrl.get_image(exposure=self.diff_exposure, binsize=self.diff_binsize, comment=comment, header_keys=header_keys)
+                            img, h = self.apply_corrections(img, h)
 
-                        for d in (d_diff, d_pos, d_cryst):
-                            h.update(d)
+                            for d in (d_diff, d_pos, d_cryst):
+                                h.update(d)
 
-                        write_hdf5(outfile, img, header=h)
+                            self.write_frame(outfile, img, h)
 
-                    self.ctrl.stage.a = 0
+                        self.ctrl.stage.a = 0
 
-            self.image_mode()
+                self.image_mode()
+        finally:
+            # close the stacks also when the data collection is interrupted, so that the files stay readable
+            for stack in self.stacks.values():
+                stack.close()
 
         print('\n\nData collection finished.')
 
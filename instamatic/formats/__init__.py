@@ -1,3 +1,5 @@
+import concurrent.futures
+import glob
 import os
 import warnings
 from pathlib import Path
@@ -7,10 +9,14 @@ import numpy as np
 import tifffile
 import yaml
 
-from .adscimage import read_adsc, write_adsc
+from .adscimage import HeaderTemplate, read_adsc, update_adsc_header, write_adsc, write_adsc_raw, write_adsc_stack
 from .csvIO import read_csv, read_ycsv, write_csv, write_ycsv
+from .hdf5stack import HDF5Stack, is_hdf5_stack
+from .mrc import MrcStack
 from .mrc import read_image as read_mrc
 from .mrc import write_image as write_mrc
+from .tiffheader import TIFF_HEADER_TAG, decode_header, encode_header, load_yaml_header
+from .xdscbf import read as read_cbf
 from .xdscbf import write as write_cbf
 
 
@@ -32,7 +38,7 @@ def read_image(fname: str) -> (np.array, dict):
     return img, h
 
 
-def write_tiff(fname: str, data, header: dict = None):
+def write_tiff(fname: str, data, header: dict = None, header_format: str = 'yaml'):
     """Simple function to write a tiff file.
 
     fname: str,
@@ -41,17 +47,54 @@ def write_tiff(fname: str, data, header: dict = None):
         numpy array containing image data
     header: dict,
         dictionary containing the metadata that should be saved
-        key/value pairs are stored as yaml in the TIFF ImageDescription tag
+        key/value pairs are stored in the ImageDescription tag as yaml (by
+        default), see `header_format`
+    header_format: str,
+        encoding of the header, `yaml`, `json` or `msgpack`. The yaml header
+        is stored in the ImageDescription tag, as in older versions. `json`
+        and `msgpack` are faster, and are stored in a private TIFF tag
+        (`TIFF_HEADER_TAG`); tuples and arrays are always read back as lists,
+        and numpy scalars as python numbers. JSON headers are also stored in
+        the ImageDescription tag, so that they can be read by older versions
+        (as yaml). Headers that cannot be encoded as JSON/msgpack are stored
+        as yaml.
     """
+    description = ''
+    extratags = []
+
     if isinstance(header, dict):
-        header = yaml.dump(header)
-    if not header:
-        header = ''
+        try:
+            if header_format == 'yaml':
+                raise TypeError
+            encoded = encode_header(header, fmt=header_format)
+        except TypeError:
+            description = yaml.dump(header)
+        else:
+            extratags.append((TIFF_HEADER_TAG, 7, len(encoded), encoded, True))
+            if header_format == 'json':
+                description = encoded.decode()
+    elif header:
+        description = header
 
     fname = Path(fname).with_suffix('.tiff')
 
     with tifffile.TiffWriter(fname) as f:
-        f.save(data=data, software='instamatic', description=header)
+        f.save(data=data, software='instamatic', description=description, extratags=extratags)
+
+
+def _read_tiff_header(tiff, page) -> dict:
+    tag = page.tags.get(TIFF_HEADER_TAG)
+
+    if tag is not None:
+        header = decode_header(tag.value)
+    elif page.software == 'instamatic':
+        header = load_yaml_header(page.tags['ImageDescription'].value)
+    elif tiff.is_tvips:
+        header = tiff.tvips_metadata
+    else:
+        header = {}
+
+    return header
 
 
 def read_tiff(fname: str) -> (np.array, dict):
@@ -64,19 +107,52 @@ def read_tiff(fname: str) -> (np.array, dict):
         image: np.ndarray, header: dict
             a tuple of the image as numpy array and dictionary with all the tem parameters and image attributes
     """
-    tiff = tifffile.TiffFile(fname)
+    with tifffile.TiffFile(fname) as tiff:
+        page = tiff.pages[0]
+        img = page.asarray()
+        header = _read_tiff_header(tiff, page)
 
-    page = tiff.pages[0]
-    img = page.asarray()
+    return img, header
 
-    if page.software == 'instamatic':
-        header = yaml.load(page.tags['ImageDescription'].value, Loader=yaml.Loader)
-    elif tiff.is_tvips:
-        header = tiff.tvips_metadata
-    else:
-        header = {}
 
-    return img, header
+def read_tiff_header(fname: str) -> dict:
+    """Read only the header of a tiff file, see `read_tiff`."""
+    with tifffile.TiffFile(fname) as tiff:
+        return _read_tiff_header(tiff, tiff.pages[0])
+
+
+def read_tiff_stack(fnames, ioworkers: int = None) -> (np.array, list):
+    """Read a series of tiff files with the same shape.
+
+    fnames: str or list,
+        list of files, directory (all tiff files in it are read), or glob pattern
+    ioworkers: int,
+        number of threads to read the images (default: number of cpus * 5)
+
+    Returns:
+        stack: np.ndarray, headers: list
+            a tuple of the images as 3D numpy array (in the order of `fnames`,
+            or sorted by name) and a list with the header of every image
+    """
+    source = fnames
+
+    if isinstance(fnames, (str, Path)):
+        path = Path(fnames)
+        if path.is_dir():
+            fnames = sorted(list(path.glob('*.tif')) + list(path.glob('*.tiff')))
+        else:
+            fnames = sorted(Path(fn) for fn in glob.glob(str(fnames)))
+
+    fnames = list(fnames)
+    if not fnames:
+        raise OSError(f'No tiff files found: {source}')
+
+    stack = tifffile.TiffSequence(fnames, pattern=None).asarray(ioworkers=ioworkers)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ioworkers) as executor:
+        headers = list(executor.map(read_tiff_header, fnames))
+
+    return stack.reshape(len(fnames), *stack.shape[-2:]), headers
 
 
 def write_hdf5(fname: str, data, header: dict = None):
@@ -99,11 +175,13 @@ def write_hdf5(fname: str, data, header: dict = None):
     f.close()
 
 
-def read_hdf5(fname: str) -> (np.array, dict):
+def read_hdf5(fname: str, index: int = 0) -> (np.array, dict):
     """Simple function to read a hdf5 file written by Instamatic.
 
     fname: str,
         path or filename to image which should be opened
+    index: int,
+        frame to read if the file is a stack written by `HDF5Stack`
 
     Returns:
         image: np.ndarray, header: dict
@@ -112,10 +190,10 @@ def read_hdf5(fname: str) -> (np.array, dict):
     if not os.path.exists(fname):
         raise FileNotFoundError(f"No such file: '{fname}'")
 
-    f = h5py.File(fname, 'r')
-    return np.array(f['data']), dict(f['data'].attrs)
+    if is_hdf5_stack(fname):
+        with HDF5Stack(fname) as stack:
+            return stack.read(index)
 
+    with h5py.File(fname, 'r') as f:
+        return np.array(f['data']), dict(f['data'].attrs)
 
-def read_cbf(fname: str):
-    """CBF reader not implemented."""
-    raise NotImplementedError('CBF reader not implemented.')
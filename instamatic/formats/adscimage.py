@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 
 # from https://github.com/silx-kit/fabio/blob/master/fabio/adscimage.py
@@ -19,13 +21,8 @@ def swap_needed(header: dict) -> bool:
         return True
 
 
-def write_adsc(fname: str, data: np.array, header: dict = {}):
-    """Write adsc format."""
-    if 'SIZE1' not in header and 'SIZE2' not in header:
-        dim2, dim1 = data.shape
-        header['SIZE1'] = dim1
-        header['SIZE2'] = dim2
-
+def format_header(header: dict) -> bytes:
+    """Format the adsc header, padded to a multiple of 512 bytes."""
     out = b'{\n'
     for key in header:
         out += f'{key}={header[key]};\n'.encode()
@@ -38,6 +35,17 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
         pad = hsize - len(out) - 2
     out += b'}' + (pad + 1) * b'\x00'
     assert len(out) % 512 == 0, 'Header is not multiple of 512'
+    return out
+
+
+def write_adsc(fname: str, data: np.array, header: dict = {}):
+    """Write adsc format."""
+    if 'SIZE1' not in header and 'SIZE2' not in header:
+        dim2, dim1 = data.shape
+        header['SIZE1'] = dim1
+        header['SIZE2'] = dim2
+
+    out = format_header(header)
 
     # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
     dtype = np.uint16
@@ -50,6 +58,113 @@ def write_adsc(fname: str, data: np.array, header: dict = {}):
         outf.write(data.tobytes())
 
 
+class HeaderTemplate:
+    """Preformatted adsc header for a series of images that share most of
+    their header.
+
+    The header is formatted once, only the items listed in `fields` are
+    filled in for every image by `format`. The header has a fixed size
+    (HEADER_BYTES, default 512), which must be large enough to fit the
+    values.
+
+    Usage:
+        template = HeaderTemplate(header, fields=('DATE', 'OSC_START'))
+        template.write('00001.img', img, DATE='...', OSC_START='0.0000')
+    """
+
+    def __init__(self, header: dict, fields: tuple = ()):
+        super().__init__()
+
+        header = dict(header)
+        header.setdefault('HEADER_BYTES', 512)
+
+        self.header_bytes = int(header['HEADER_BYTES'])
+        self.fields = tuple(fields)
+
+        missing = [field for field in self.fields if field not in header]
+        if missing:
+            raise KeyError(f'Fields not in header: {missing}')
+
+        # static parts of the header, the values of `fields` go in between
+        self.parts = []
+        part = '{\n'
+        for key, value in header.items():
+            if key in self.fields:
+                self.parts.append((part + f'{key}=').encode())
+                part = ';\n'
+            else:
+                part += f'{key}={value};\n'
+        self.parts.append((part + '}').encode())
+
+    def format(self, **values) -> bytes:
+        """Return the header with the given values for `fields` filled in."""
+        out = [self.parts[0]]
+        for field, part in zip(self.fields, self.parts[1:]):
+            out.append(str(values[field]).encode())
+            out.append(part)
+        out = b''.join(out)
+
+        if len(out) > self.header_bytes:
+            raise ValueError(f'Header does not fit in {self.header_bytes} bytes')
+
+        return out.ljust(self.header_bytes, b'\x00')
+
+    def write(self, fname: str, data: np.array, **values):
+        """Write `data` with the header to `fname`, see `write_adsc_raw`."""
+        write_adsc_raw(fname, data, self.format(**values))
+
+
+def write_adsc_raw(fname: str, data: np.array, header: bytes):
+    """Write adsc format with a preformatted `header` (see `HeaderTemplate`).
+
+    The data are written as little endian unsigned short. The header and
+    data are written with a single system call where available.
+    """
+    if data.dtype != np.uint16:
+        data = np.round(data, 0).astype(np.uint16)
+    data = np.ascontiguousarray(data, dtype='<u2')
+
+    buffers = [memoryview(header), memoryview(data).cast('B')]
+
+    with open(fname, 'wb', buffering=0) as outf:
+        if hasattr(os, 'writev'):
+            written = os.writev(outf.fileno(), buffers)
+        else:
+            written = 0
+        # write what is left, e.g. after a partial write or without `writev` (Windows)
+        for buf in buffers:
+            if written >= len(buf):
+                written -= len(buf)
+                continue
+            outf.write(buf[written:])
+            written = 0
+
+
+def write_adsc_stack(fnames: list, stack, template: HeaderTemplate, values: list):
+    """Write all images in `stack` (3D array, or iterable of 2D arrays) to
+    `fnames` in adsc format. The headers are filled in from `template` with
+    the per-image `values` (list of dicts)."""
+    for fname, data, frame_values in zip(fnames, stack, values):
+        template.write(fname, data, **frame_values)
+
+
+def update_adsc_header(fname: str, header: dict):
+    """Replace the header of an existing adsc file in place, without
+    rewriting the image data.
+
+    The new header must have the same size (HEADER_BYTES) as the old
+    one.
+    """
+    out = format_header(header)
+
+    with open(fname, 'r+b') as f:
+        old = readheader(f)
+        if int(old['HEADER_BYTES']) != len(out):
+            raise ValueError(f'Header size does not match: {len(out)} != {old["HEADER_BYTES"]} ({fname})')
+        f.seek(0)
+        f.write(out)
+
+
 def readheader(infile):
     """Read an adsc header."""
     header = {}
@@ -0,0 +1,245 @@
+import numbers
+
+import h5py
+import numpy as np
+import yaml
+
+# NeXus-like layout of the stack
+DATA_PATH = 'entry/data/data'
+TABLE_PATH = 'entry/frames'
+
+# Supported compression filters, `lz4` and `bitshuffle` require `hdf5plugin`
+COMPRESSION = (None, 'gzip', 'lzf', 'lz4', 'bitshuffle')
+
+
+def _register_filters() -> None:
+    """Make the LZ4/bitshuffle filters available to h5py, if `hdf5plugin` is
+    installed."""
+    try:
+        import hdf5plugin  # noqa: F401
+    except ImportError:
+        pass
+
+
+def _compression_kwargs(compression: str = None, level: int = None) -> dict:
+    """Return the keyword arguments for `h5py.Group.create_dataset` to use
+    `compression`."""
+    if compression is None:
+        return {}
+    elif compression in ('gzip', 'lzf'):
+        kwargs = {'compression': compression}
+        if level is not None:
+            kwargs['compression_opts'] = level
+        return kwargs
+    elif compression in ('lz4', 'bitshuffle'):
+        try:
+            import hdf5plugin
+        except ImportError:
+            raise ImportError(f'Compression `{compression}` requires `hdf5plugin` (pip install hdf5plugin)') from None
+        if compression == 'lz4':
+            return dict(hdf5plugin.LZ4())
+        else:
+            return dict(hdf5plugin.Bitshuffle())
+    else:
+        raise ValueError(f'Invalid compression: {compression!r}, must be one of {COMPRESSION}')
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (numbers.Real, np.number))
+
+
+class HDF5Stack:
+    """Stack of 2D images with their headers in a single HDF5 file.
+
+    The frames are stored in a chunked 3D dataset (`entry/data/data`),
+    one chunk per frame, so that single frames can be read without
+    loading the rest of the stack. The headers are stored in a table
+    (`entry/frames`) with one row per frame, which holds the full header
+    as yaml (the same encoding as the default tiff header),
+    and a column for every numeric header item of the first frame (e.g.
+    `ImageGetTime`) for quick access through `column`. Metadata for the whole stack can be stored in
+    `attrs`.
+
+    The frames can optionally be compressed using `gzip`/`lzf`, or with
+    `lz4`/`bitshuffle` if `hdf5plugin` is installed.
+
+    Open an existing file with `HDF5Stack(filename)` (read-only), or
+    `HDF5Stack(filename, mode='r+')` to add frames. Create a new stack
+    with `HDF5Stack.create`.
+
+    Usage:
+        with HDF5Stack.create('data.h5', shape=(512, 512), dtype=np.uint16) as stack:
+            for img, h in images:
+                stack.append(img, h)
+
+        stack = HDF5Stack('data.h5')
+        img, h = stack.read(0)
+    """
+
+    def __init__(self, filename, mode: str = 'r'):
+        super().__init__()
+
+        if mode not in ('r', 'r+'):
+            raise ValueError(f'Invalid mode: {mode!r}, must be one of `r`, `r+`')
+
+        _register_filters()
+
+        self.filename = filename
+        self.mode = mode
+        self.file = h5py.File(filename, mode)
+
+        if DATA_PATH not in self.file:
+            self.file.close()
+            raise OSError(f'Not an instamatic HDF5 stack: {filename}')
+
+        self.data = self.file[DATA_PATH]
+        self.table = self.file.get(TABLE_PATH)
+
+    @classmethod
+    def create(cls,
+               filename,
+               shape: tuple,
+               dtype=np.uint16,
+               compression: str = None,
+               compression_opts: int = None,
+               ) -> 'HDF5Stack':
+        """Create a new empty stack for frames of `shape` (ny, nx) and
+        `dtype`, and open it for appending.
+
+        `compression` is one of `COMPRESSION`, `compression_opts` sets
+        the compression level for `gzip`.
+        """
+        kwargs = _compression_kwargs(compression, compression_opts)
+
+        with h5py.File(filename, 'w') as f:
+            f.attrs['software'] = 'instamatic'
+
+            entry = f.create_group('entry')
+            entry.attrs['NX_class'] = 'NXentry'
+
+            group = entry.create_group('data')
+            group.attrs['NX_class'] = 'NXdata'
+            group.attrs['signal'] = 'data'
+
+            group.create_dataset('data',
+                                 shape=(0, *shape),
+                                 maxshape=(None, *shape),
+                                 chunks=(1, *shape),
+                                 dtype=dtype,
+                                 **kwargs)
+
+        return cls(filename, mode='r+')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self.filename)!r}, shape={self.shape}, dtype={self.dtype})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.data[i]
+
+    @property
+    def shape(self) -> tuple:
+        return self.data.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.data.dtype
+
+    @property
+    def attrs(self):
+        """Metadata for the whole stack."""
+        return self.file['entry'].attrs
+
+    @property
+    def columns(self) -> list:
+        """Names of the header items that are stored as columns."""
+        if self.table is None:
+            return []
+        return [name for name in self.table.dtype.names if name != 'header']
+
+    def column(self, name: str) -> np.ndarray:
+        """Return header item `name` for all frames (NaN where missing)."""
+        return self.table[name]
+
+    def get_header(self, i: int) -> dict:
+        """Return the header of frame `i`."""
+        header = self.table[i]['header']
+        if isinstance(header, bytes):
+            header = header.decode()
+        return yaml.load(header, Loader=yaml.Loader) or {}
+
+    def read(self, i: int) -> (np.array, dict):
+        """Return the image and header of frame `i`."""
+        return self.data[i], self.get_header(i)
+
+    def _create_table(self, header: dict) -> None:
+        columns = [key for key, value in header.items() if _is_number(value)]
+        dtype = [('header', h5py.string_dtype())] + [(key, np.float64) for key in columns]
+        self.table = self.file.create_dataset(TABLE_PATH,
+                                              shape=(len(self),),
+                                              maxshape=(None,),
+                                              chunks=(256,),
+                                              dtype=dtype)
+
+    def append(self, img: np.ndarray, header=None) -> None:
+        """Append a frame with its `header`, or a stack of frames with a
+        list of headers, to the end of the file."""
+        if self.mode != 'r+':
+            raise OSError('Stack is opened read-only')
+
+        img = np.asarray(img)
+        frame_shape = self.shape[1:]
+        if img.shape[-2:] != frame_shape:
+            raise ValueError(f'Frame shape {img.shape[-2:]} does not match stack {frame_shape}')
+
+        frames = img.reshape(-1, *frame_shape)
+        if isinstance(header, (list, tuple)):
+            headers = list(header)
+        else:
+            headers = [header]
+        headers = [h or {} for h in headers]
+        if len(headers) != len(frames):
+            raise ValueError(f'Number of headers ({len(headers)}) does not match number of frames ({len(frames)})')
+
+        if self.table is None:
+            self._create_table(headers[0])
+
+        rows = np.zeros(len(frames), dtype=self.table.dtype)
+        for row, h in zip(rows, headers):
+            row['header'] = yaml.dump(h)
+            for key in self.columns:
+                value = h.get(key)
+                row[key] = value if _is_number(value) else np.nan
+
+        n = len(self)
+        self.data.resize(n + len(frames), axis=0)
+        self.data[n:] = frames
+        self.table.resize(n + len(frames), axis=0)
+        self.table[n:] = rows
+
+    def flush(self) -> None:
+        """Write pending data to disk."""
+        self.file.flush()
+
+    def close(self) -> None:
+        """Close the file."""
+        if self.file:
+            self.file.close()
+
+
+def is_hdf5_stack(fname) -> bool:
+    """Check whether `fname` was written by `HDF5Stack`."""
+    with h5py.File(fname, 'r') as f:
+        return DATA_PATH in f
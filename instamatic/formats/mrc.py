@@ -702,6 +702,219 @@ def write_image(filename, img, index=None, header=None, inplace=False):
         util.close(filename, f)
 
 
+def _create_stack_header(shape, dtype, nz=0):
+    """Create the header for a stack of `nz` images with `shape` (ny, nx)
+    and `dtype`, with the same defaults as `write_image`."""
+    ny, nx = shape
+
+    h = numpy.zeros(1, header_image_dtype)
+    util.update_header(h, mrc_defaults, ara2mrc)
+    h['nx'] = nx
+    h['ny'] = ny
+    h['nz'] = nz
+    h['mode'] = numpy2mrc[numpy.dtype(dtype).type]
+    h['mx'] = nx
+    h['my'] = ny
+    h['mz'] = nz
+    h['xlen'] = nx
+    h['ylen'] = ny
+    h['zlen'] = nz
+    h['alpha'] = 90
+    h['beta'] = 90
+    h['gamma'] = 90
+    h['mapc'] = 1
+    h['mapr'] = 2
+    h['maps'] = 3
+    h['map'] = 'MAP'
+    h['byteorder'] = byteorderint2[sys.byteorder]
+    h['nlabels'] = 1
+    h['label0'] = 'Created by Instamatic'
+    return h
+
+
+class MrcStack:
+    """Stack of 2D images in a single MRC file, accessed through a memory
+    map, so that large stacks do not have to be loaded into memory.
+
+    Frames can be accessed by index or slice (`stack[10]`,
+    `stack[10:20]`), or through the memory mapped array `stack.data` of
+    shape (nframes, ny, nx). Open an existing file with
+    `MrcStack(filename)` (read-only), or `MrcStack(filename, mode='r+')`
+    to modify frames and append new ones. Create a new stack with
+    `MrcStack.create`.
+
+    Frames added with `append` are written directly to the end of the
+    file. The header fields (frame count, min/max/mean) are only updated
+    by `flush` or `close`, and the memory map is extended when the new
+    frames are accessed. If frames are modified in place, the statistics
+    are recalculated from the whole stack on `flush`.
+
+    Usage:
+        with MrcStack.create('stack.mrc', shape=(512, 512), dtype=np.uint16) as stack:
+            for img in images:
+                stack.append(img)
+
+        stack = MrcStack('stack.mrc')
+        img = stack[0]
+    """
+
+    def __init__(self, filename, mode: str = 'r'):
+        super().__init__()
+
+        if mode not in ('r', 'r+'):
+            raise ValueError(f'Invalid mode: {mode!r}, must be one of `r`, `r+`')
+
+        self._setup(filename, mode, read_mrc_header(filename))
+
+    def _setup(self, filename, mode: str, h) -> None:
+        self.filename = filename
+        self.mode = mode
+
+        dtype = numpy.dtype(mrc2numpy[int(h['mode'][0])])
+        if h.dtype != header_image_dtype:
+            dtype = dtype.newbyteorder()
+
+        self.header = h
+        self.dtype = dtype
+        self.frame_shape = (int(h['ny'][0]), int(h['nx'][0]))
+        self.offset = 1024 + int(h['nsymbt'][0])
+
+        self._count = int(h['nz'][0])
+        self._data = None
+        self._file = None
+        self._stats_stale = False
+
+        # min/max/sum of the frames, updated on `append`
+        if self._count:
+            npixels = self._count * self.frame_shape[0] * self.frame_shape[1]
+            self._stats = [h['amin'][0], h['amax'][0], float(h['amean'][0]) * npixels]
+        else:
+            self._stats = None
+
+    @classmethod
+    def create(cls, filename, shape: tuple, dtype=numpy.uint16) -> 'MrcStack':
+        """Create a new empty stack for frames of `shape` (ny, nx) and
+        `dtype`, and open it for appending.
+
+        The data type is converted to the nearest type supported by
+        MRC.
+        """
+        dtype = numpy.dtype(mrc2numpy[numpy2mrc[numpy.dtype(dtype).type]])
+
+        h = _create_stack_header(shape, dtype)
+        with open(filename, 'wb') as f:
+            h.tofile(f)
+
+        # an empty stack does not pass the header checks in `read_mrc_header`
+        stack = cls.__new__(cls)
+        stack._setup(filename, 'r+', h)
+        return stack
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self.filename)!r}, shape={self.shape}, dtype={self.dtype})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        self.data[index] = value
+        # the statistics can no longer be updated incrementally
+        self._stats_stale = True
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.data[i]
+
+    @property
+    def shape(self) -> tuple:
+        return (self._count, *self.frame_shape)
+
+    @property
+    def data(self) -> numpy.ndarray:
+        """Memory mapped array with all frames in the stack."""
+        if self._data is None or len(self._data) != self._count:
+            if self._file:
+                self._file.flush()
+            if self._count == 0:
+                return numpy.empty(self.shape, dtype=self.dtype)
+            self._data = numpy.memmap(self.filename, dtype=self.dtype, mode=self.mode,
+                                      offset=self.offset, shape=self.shape)
+        return self._data
+
+    def append(self, img: numpy.ndarray) -> None:
+        """Append a frame, or a stack of frames, to the end of the file."""
+        if self.mode != 'r+':
+            raise OSError('Stack is opened read-only')
+
+        img = numpy.asarray(img)
+        if img.shape[-2:] != self.frame_shape:
+            raise ValueError(f'Frame shape {img.shape[-2:]} does not match stack {self.frame_shape}')
+
+        frames = img.reshape(-1, *self.frame_shape).astype(self.dtype, copy=False)
+
+        if self._file is None:
+            self._file = open(self.filename, 'r+b')
+
+        self._file.seek(self.offset + self._count * frames[0].nbytes)
+        frames.tofile(self._file)
+        self._count += len(frames)
+
+        amin, amax, total = frames.min(), frames.max(), frames.sum(dtype=numpy.float64)
+        if self._stats is None:
+            self._stats = [amin, amax, total]
+        else:
+            self._stats = [min(self._stats[0], amin), max(self._stats[1], amax), self._stats[2] + total]
+
+    def flush(self) -> None:
+        """Write pending data to disk, and update the frame count and
+        statistics in the header."""
+        if self._data is not None and self.mode == 'r+':
+            self._data.flush()
+
+        if self._stats_stale:
+            data = self.data
+            self._stats = [min(frame.min() for frame in data),
+                           max(frame.max() for frame in data),
+                           sum(frame.sum(dtype=numpy.float64) for frame in data)]
+            self._stats_stale = False
+            if self._file is None:
+                self._file = open(self.filename, 'r+b')
+
+        if self._file is None:
+            return
+
+        h = self.header
+        h['nz'] = self._count
+        h['mz'] = self._count
+        h['zlen'] = self._count
+        if self._stats is not None:
+            amin, amax, total = self._stats
+            h['amin'] = amin
+            h['amax'] = amax
+            h['amean'] = total / (self._count * self.frame_shape[0] * self.frame_shape[1])
+
+        self._file.seek(0)
+        h.tofile(self._file)
+        self._file.flush()
+
+    def close(self) -> None:
+        """Flush and close the file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._data = None
+
+
 if __name__ == '__main__':
     from pathlib import Path
 
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import yaml
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Private TIFF tag holding the instamatic header (JSON or msgpack)
+TIFF_HEADER_TAG = 65000
+
+HEADER_FORMATS = ('json', 'msgpack', 'yaml')
+
+# The C loader is much faster, but is not available in all builds of pyyaml
+YAML_LOADER = getattr(yaml, 'CLoader', yaml.Loader)
+
+
+def _to_builtin(obj):
+    """Convert numpy types in the header to python types for JSON/msgpack."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not serializable')
+
+
+def encode_header(header: dict, fmt: str = 'json') -> bytes:
+    """Encode `header` as JSON or msgpack.
+
+    Raises TypeError if the header contains items that cannot be
+    encoded.
+    """
+    if fmt == 'json':
+        return json.dumps(header, default=_to_builtin).encode()
+    elif fmt == 'msgpack':
+        if msgpack is None:
+            raise ImportError('Header format `msgpack` requires `msgpack` (pip install msgpack)')
+        return msgpack.dumps(header, default=_to_builtin)
+    else:
+        raise ValueError(f'Invalid header format: {fmt!r}, must be one of `json`, `msgpack`')
+
+
+def decode_header(data: bytes) -> dict:
+    """Decode a header written by `encode_header`, JSON is recognized by
+    the opening brace."""
+    if data[:1] == b'{':
+        return json.loads(data)
+    elif msgpack is None:
+        raise ImportError('Reading this header requires `msgpack` (pip install msgpack)')
+    return msgpack.loads(data)
+
+
+def load_yaml_header(description: str) -> dict:
+    """Load a yaml header from the description of an older TIFF file."""
+    return yaml.load(description, Loader=YAML_LOADER)
@@ -17,53 +17,126 @@ DATA_TYPES = {'signed 8-bit integer': 'int8',
 STARTER = b'\x0c\x1a\x04\xd5'
 
 
+# Escape sequences and value sizes for the exceptions in the byte offset algorithm
+# - 1 byte: int8 delta
+# - 3 bytes: 0x80 + int16 delta
+# - 7 bytes: 0x80 + 0x8000 + int32 delta
+# - 15 bytes: 0x80 + 0x8000 + 0x80000000 + int64 delta
+BYTE_OFFSET_ESCAPES = (
+    (b'\x80', '<i2'),
+    (b'\x80\x00\x80', '<i4'),
+    (b'\x80\x00\x80\x00\x00\x00\x80', '<i8'),
+)
+
+
 def compByteOffset(data):
     """Compress a dataset into a string using the byte_offet algorithm.
 
+    The layout of the output is calculated from the size of every delta
+    in one go, and the values are then written to a preallocated buffer,
+    so that there is no python loop over the pixels.
+
     :param data: ndarray
     :return: string/bytes with compressed data
 
     test = np.array([0,1,2,127,0,1,2,128,0,1,2,32767,0,1,2,32768,0,1,2,2147483647,0,1,2,2147483648,0,1,2,128,129,130,32767,32768,128,129,130,32768,2147483647,2147483648])
     """
     flat = np.ascontiguousarray(data.ravel(), np.int64)
-    delta = np.zeros_like(flat)
-    delta[0] = flat[0]
-    delta[1:] = flat[1:] - flat[:-1]
-    mask = abs(delta) > 127
-    exceptions = np.nonzero(mask)[0]
-    if np.little_endian:
-        byteswap = False
-    else:
-        byteswap = True
-    start = 0
-    binary_blob = b''
-    for stop in exceptions:
-        if stop - start > 0:
-            binary_blob += delta[start:stop].astype(np.int8).tobytes()
-        exc = delta[stop]
-        absexc = abs(exc)
-        if absexc > 2147483647:  # 2**31-1
-            binary_blob += b'\x80\x00\x80\x00\x00\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].byteswap().tobytes()
-            else:
-                binary_blob += delta[stop:stop + 1].tobytes()
-        elif absexc > 32767:  # 2**15-1
-            binary_blob += b'\x80\x00\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].astype(np.int32).byteswap().tobytes()
-            else:
-                binary_blob += delta[stop:stop + 1].astype(np.int32).tobytes()
-        else:  # >127
-            binary_blob += b'\x80'
-            if byteswap:
-                binary_blob += delta[stop:stop + 1].astype(np.int16).byteswap().tobytes()
-            else:
-                binary_blob += delta[stop:stop + 1].astype(np.int16).tobytes()
-        start = stop + 1
-    if start < delta.size:
-        binary_blob += delta[start:].astype(np.int8).tobytes()
-    return binary_blob
+    delta = np.empty_like(flat)
+    delta[:1] = flat[:1]
+    np.subtract(flat[1:], flat[:-1], out=delta[1:])
+
+    absdelta = np.abs(delta)
+
+    # number of bytes for every element
+    sizes = np.ones(delta.size, dtype=np.int64)
+    masks = (absdelta > 127, absdelta > 32767, absdelta > 2147483647)  # 2**7-1, 2**15-1, 2**31-1
+    for mask, (escape, dtype) in zip(masks, BYTE_OFFSET_ESCAPES):
+        sizes[mask] = len(escape) + np.dtype(dtype).itemsize
+
+    offsets = np.cumsum(sizes) - sizes
+    binary_blob = np.empty(offsets[-1] + sizes[-1] if delta.size else 0, dtype=np.uint8)
+
+    sel = sizes == 1
+    binary_blob[offsets[sel]] = delta[sel].astype(np.int8).view(np.uint8)
+
+    for escape, dtype in BYTE_OFFSET_ESCAPES:
+        sel = sizes == len(escape) + np.dtype(dtype).itemsize
+        if not sel.any():
+            continue
+        values = delta[sel].astype(dtype).view(np.uint8).reshape(-1, np.dtype(dtype).itemsize)
+        values = np.hstack((np.tile(np.frombuffer(escape, dtype=np.uint8), (len(values), 1)), values))
+        binary_blob[offsets[sel][:, np.newaxis] + np.arange(values.shape[1])] = values
+
+    return binary_blob.tobytes()
+
+
+def decByteOffset(stream, size: int = None, dtype='int32'):
+    """Decompress a string/bytes compressed with the byte_offset algorithm.
+
+    The positions of the escape sequences are resolved with array
+    operations, so that there is no python loop over the pixels.
+
+    :param stream: string/bytes with compressed data
+    :param size: number of elements expected
+    :param dtype: data type of the output
+    :return: 1D ndarray
+    """
+    raw = np.frombuffer(stream, dtype=np.uint8)
+    n = raw.size
+
+    # pad, so that values can be read past the end of the stream
+    buf = np.zeros(n + 15, dtype=np.uint8)
+    buf[:n] = raw
+
+    def read_at(positions, dtype):
+        width = np.dtype(dtype).itemsize
+        return buf[positions[:, np.newaxis] + np.arange(width)].copy().view(dtype).ravel()
+
+    # candidate escape bytes and the size of the element if they are one
+    candidates = np.flatnonzero(raw == 0x80)
+    sizes = np.full(candidates.size, 3, dtype=np.int64)
+    values = read_at(candidates + 1, '<i2').astype(np.int64)
+
+    sel = values == -32768
+    values32 = read_at(candidates[sel] + 3, '<i4').astype(np.int64)
+    sizes[sel] = 7
+    values[sel] = values32
+
+    sel64 = np.flatnonzero(sel)[values32 == -2147483648]
+    sizes[sel64] = 15
+    values[sel64] = read_at(candidates[sel64] + 7, '<i8')
+
+    # An 0x80 byte is only an escape if it is not part of the value of the preceding escape.
+    # The first candidate is always an escape, and every escape points to the next one. The
+    # chain is followed by pointer doubling, so that it takes log2(n) array operations.
+    ncand = candidates.size
+    jump = np.append(np.searchsorted(candidates, candidates + sizes), ncand)
+    chain = np.zeros(min(ncand, 1), dtype=np.int64)
+    while chain.size and chain[-1] != ncand:
+        chain = np.concatenate((chain, jump[chain]))
+        jump = jump[jump]
+
+    is_escape = np.zeros(ncand, dtype=bool)
+    is_escape[chain[chain < ncand]] = True
+
+    starts = candidates[is_escape]
+    lengths = sizes[is_escape]
+
+    # bytes that belong to the escaped elements, except their first byte
+    inside = np.zeros(n + 16, dtype=np.int64)
+    np.add.at(inside, starts + 1, 1)
+    np.add.at(inside, starts + lengths, -1)
+    inside = np.cumsum(inside[:n]) > 0
+
+    positions = np.flatnonzero(~inside)
+    delta = raw[positions].view(np.int8).astype(np.int64)
+    delta[np.searchsorted(positions, starts)] = values[is_escape]
+
+    if size is not None and delta.size != size:
+        raise ValueError(f'Number of decompressed elements does not match: {delta.size} != {size}')
+
+    return np.cumsum(delta).astype(dtype)
 
 
 def write(fname, data, header={}):
@@ -95,13 +168,13 @@ def write(fname, data, header={}):
                     b'Content-Type: application/octet-stream;',
                     b'     conversions="x-CBF_BYTE_OFFSET"',
                     b'Content-Transfer-Encoding: BINARY',
-                    np.string_('X-Binary-Size: %d' % (len(binary_blob))),
+                    b'X-Binary-Size: %d' % len(binary_blob),
                     b'X-Binary-ID: 1',
-                    np.string_('X-Binary-Element-Type: "%s"' % (dtype)),
+                    b'X-Binary-Element-Type: "%s"' % dtype.encode(),
                     b'X-Binary-Element-Byte-Order: LITTLE_ENDIAN',
-                    np.string_('X-Binary-Number-of-Elements: %d' % (dim1 * dim2)),
-                    np.string_('X-Binary-Size-Fastest-Dimension: %d' % dim1),
-                    np.string_('X-Binary-Size-Second-Dimension: %d' % dim2),
+                    b'X-Binary-Number-of-Elements: %d' % (dim1 * dim2),
+                    b'X-Binary-Size-Fastest-Dimension: %d' % dim1,
+                    b'X-Binary-Size-Second-Dimension: %d' % dim2,
                     b'X-Binary-Size-Padding: 1',
                     b'',
                     STARTER + binary_blob,
@@ -113,7 +186,42 @@ def write(fname, data, header={}):
         out_file.write(cbf)
 
 
+def read(fname):
+    """Read a CBF file with byte offset compression.
+
+    :param str fname: name of the file
+    :return: image as ndarray, and the MIME header of the binary section
+        as a dictionary
+    """
+    with open(fname, 'rb') as f:
+        raw = f.read()
+
+    start = raw.find(STARTER)
+    if start < 0:
+        raise OSError(f'No binary section found in CBF file: {fname}')
+
+    header = {}
+    for line in raw[:start].decode(errors='replace').splitlines():
+        if line.startswith('X-Binary-') and ':' in line:
+            key, value = line.split(':', 1)
+            header[key.strip()] = value.strip().strip('"')
+
+    if 'x-CBF_BYTE_OFFSET' not in raw[:start].decode(errors='replace'):
+        raise NotImplementedError(f'Only CBF files with byte offset compression are supported: {fname}')
+
+    size = int(header['X-Binary-Size'])
+    dim1 = int(header['X-Binary-Size-Fastest-Dimension'])
+    dim2 = int(header['X-Binary-Size-Second-Dimension'])
+    dtype = DATA_TYPES.get(header.get('X-Binary-Element-Type'), 'int32')
+
+    binary_blob = raw[start + len(STARTER): start + len(STARTER) + size]
+    data = decByteOffset(binary_blob, size=dim1 * dim2, dtype=dtype)
+
+    return data.reshape(dim2, dim1), header
+
+
 if __name__ == '__main__':
     arr = np.arange(128 * 128).reshape(128, 128)
     write('a.cbf', arr)
+    print('allclose:', np.allclose(arr, read('a.cbf')[0]))
     print('run `xdsviewer a.cbf`')
@@ -8,7 +8,8 @@ from pywinauto import Application
 
 from instamatic import config
 from instamatic.exceptions import TEMCommunicationError, exception_list
-from instamatic.server.serializer import dumper, loader
+from instamatic.server.serializer import goniotool_dumper as dumper
+from instamatic.server.serializer import goniotool_loader as loader
 
 GONIOTOOL_EXE = 'C:\\JEOL\\TOOL\\GonioTool.exe'
 DEFAULT_SPEED = 12
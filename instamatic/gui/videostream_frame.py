@@ -5,7 +5,7 @@ from tkinter import *
 from tkinter.ttk import *
 
 import numpy as np
-from PIL import Image, ImageEnhance, ImageTk
+from PIL import Image, ImageTk
 
 from instamatic.formats import read_tiff, write_tiff
 from instamatic.processing.flatfield import apply_flatfield_correction
@@ -39,6 +39,10 @@ class VideoStreamFrame(LabelFrame):
 
         self.resize_image = False
 
+        self.renderer = self.stream.start_renderer()
+        self.last_count = 0
+        self.frame = None
+
         self.last = time.perf_counter()
         self.nframes = 1
         self.update_frequency = 0.25
@@ -152,6 +156,8 @@ class VideoStreamFrame(LabelFrame):
             self.resize_image = self.var_resize_image.get()
         except BaseException:
             pass
+        else:
+            self.renderer.resize = (950, 950) if self.resize_image else None
 
     def update_auto_contrast(self, name, index, mode):
         # print name, index, mode
@@ -159,6 +165,8 @@ class VideoStreamFrame(LabelFrame):
             self.auto_contrast = self.var_auto_contrast.get()
         except BaseException:
             pass
+        else:
+            self.renderer.auto_contrast = self.auto_contrast
 
     def update_frametime(self, name, index, mode):
         # print name, index, mode
@@ -175,6 +183,8 @@ class VideoStreamFrame(LabelFrame):
             self.brightness = self.var_brightness.get()
         except BaseException:
             pass
+        else:
+            self.renderer.brightness = self.brightness
 
     def update_display_range(self, name, index, mode):
         try:
@@ -182,9 +192,13 @@ class VideoStreamFrame(LabelFrame):
             self.display_range = max(1, val)
         except BaseException:
             pass
+        else:
+            self.renderer.display_range = self.display_range
 
     def saveImage(self):
         """Dump the current frame to a file."""
+        with self.stream.lock:
+            self.frame = self.stream.frame
         self.q.put(('save_image', {'frame': self.frame}))
         self.triggerEvent.set()
 
@@ -203,38 +217,21 @@ class VideoStreamFrame(LabelFrame):
         self.after(500, self.on_frame)
 
     def on_frame(self, event=None):
-        self.stream.lock.acquire(True)
-        self.frame = frame = self.stream.frame
-        self.stream.lock.release()
-
-        if frame is not None:
-            # the display range in ImageTk is from 0 to 256
-            if self.auto_contrast:
-                frame = frame * (256.0 / (1 + np.percentile(frame[::4, ::4], 99.5)))  # use 128x128 array for faster calculation
-
-                image = Image.fromarray(frame)
-            elif self.display_range != self.display_range_default:
-                image = np.clip(frame, 0, self.display_range)
-                image = (256.0 / self.display_range) * image
-                image = Image.fromarray(image)
-            else:
-                image = Image.fromarray(frame)
-
-            if self.brightness != 1:
-                image = ImageEnhance.Brightness(image.convert('L')).enhance(self.brightness)
-                # Can also use ImageEnhance.Sharpness or ImageEnhance.Contrast if needed
+        """Show the latest frame from the renderer, frames are rendered in
+        the background (see `FrameRenderer`), so only new frames have to be
+        blitted here."""
+        image, count = self.renderer.latest()
 
-            if self.resize_image:
-                image = image.resize((950, 950))
+        if image is not None and count != self.last_count:
+            self.last_count = count
 
-            image = ImageTk.PhotoImage(image=image)
+            image = ImageTk.PhotoImage(image=Image.fromarray(image))
 
             self.panel.configure(image=image)
             # keep a reference to avoid premature garbage collection
             self.panel.image = image
 
-        self.update_frametimes()
-        # self.parent.update_idletasks()
+            self.update_frametimes()
 
         self.after(self.frame_delay, self.on_frame)
 
@@ -1,5 +1,186 @@
 import numpy as np
-from numpy.fft import fft2, ifft2
+from scipy import fft
+from scipy.signal import get_window
+
+
+class Registrar:
+    """Register images against a reference image by phase correlation.
+
+    The (real) Fourier transform of the reference is calculated once and
+    cached, so that many images can be registered against the same
+    reference. The transforms are done in `dtype` (float32 by default)
+    using `workers` threads (-1: all cores).
+
+    The shifts are equivalent to `skimage.registration.phase_cross_correlation`,
+    i.e. the shift required to register the moving image with the reference.
+
+    Parameters
+    ----------
+    reference : np.array
+        Reference image, can also be set later using `set_reference`
+    upsample_factor : int
+        Images are registered to within 1 / `upsample_factor` of a pixel,
+        by evaluating the cross correlation on an upsampled grid around
+        the peak (matrix-multiply DFT).
+    window : str or tuple
+        Window applied to both images (after subtracting the mean) before
+        the Fourier transform to suppress edge effects, e.g. `'hann'` (see
+        `scipy.signal.get_window`)
+    normalization : str
+        `'phase'` for phase correlation, or None for cross correlation
+    dtype : np.dtype
+        Floating point type used for the transforms
+    workers : int
+        Number of threads for `scipy.fft`
+
+    Usage:
+        registrar = Registrar(img_cent, upsample_factor=10)
+        shift = registrar.register(img)
+        shifts = registrar.register(stack)  # (N, 2)
+    """
+
+    def __init__(self,
+                 reference: np.ndarray = None,
+                 upsample_factor: int = 1,
+                 window=None,
+                 normalization: str = 'phase',
+                 dtype=np.float32,
+                 workers: int = -1,
+                 ):
+        super().__init__()
+
+        if normalization not in ('phase', None):
+            raise ValueError(f'Invalid normalization: {normalization!r}, must be `phase` or None')
+
+        self.upsample_factor = upsample_factor
+        self.window = window
+        self.normalization = normalization
+        self.dtype = np.dtype(dtype)
+        self.workers = workers
+
+        self.shape = None
+        self.reference = None
+        self._window = None
+
+        if reference is not None:
+            self.set_reference(reference)
+
+    def set_reference(self, reference: np.ndarray) -> None:
+        """Set the reference image and cache its spectrum."""
+        shape = reference.shape[-2:]
+        if shape != self.shape:
+            self.shape = shape
+            if self.window is not None:
+                w0 = get_window(self.window, shape[0])
+                w1 = get_window(self.window, shape[1])
+                self._window = np.outer(w0, w1).astype(self.dtype)
+        self.reference = self.spectrum(reference)
+
+    def spectrum(self, img: np.ndarray) -> np.ndarray:
+        """Real Fourier transform of the (windowed) image or stack of
+        images."""
+        img = np.asarray(img, dtype=self.dtype)
+        if self._window is not None:
+            # remove the mean, otherwise the window itself dominates the correlation
+            img = (img - img.mean(axis=(-2, -1), keepdims=True)) * self._window
+        return fft.rfft2(img, workers=self.workers)
+
+    def _cross_power(self, img: np.ndarray) -> np.ndarray:
+        if self.reference is None:
+            raise ValueError('No reference image, use `set_reference` first')
+        if img.shape[-2:] != self.shape:
+            raise ValueError(f'Image {img.shape[-2:]} and reference {self.shape} do not match shapes.')
+
+        product = self.reference * self.spectrum(img).conj()
+        if self.normalization == 'phase':
+            eps = np.finfo(self.dtype).eps
+            product /= np.maximum(np.abs(product), 100 * eps)
+        return product
+
+    def correlate(self, img: np.ndarray) -> np.ndarray:
+        """Return the (phase) cross correlation of the image or stack of
+        images with the reference."""
+        return fft.irfft2(self._cross_power(img), s=self.shape, workers=self.workers)
+
+    def _upsampled_correlation(self, product: np.ndarray, shifts: np.ndarray) -> tuple:
+        """Evaluate the cross correlation for the spectra in `product` (N,
+        n0, n1 // 2 + 1) on an upsampled grid around `shifts` (N, 2).
+        Returns the correlation (N, region, region) and the positions
+        along both axes (N, region).
+
+        Because the correlation is real, only the half spectrum of the
+        rfft is needed, with the columns that stand for two frequencies
+        counted twice.
+        """
+        n0, n1 = self.shape
+        up = self.upsample_factor
+        region = int(np.ceil(up * 1.5))
+        offset = np.fix(region / 2.0)
+
+        # positions to sample relative to the shift (pixels)
+        grid = (np.arange(region) - offset) / up
+        pos0 = shifts[:, 0, np.newaxis] + grid
+        pos1 = shifts[:, 1, np.newaxis] + grid
+
+        k0 = fft.fftfreq(n0, 1 / n0)
+        k1 = fft.rfftfreq(n1, 1 / n1)
+        weights = np.full(k1.size, 2.0)
+        weights[0] = 1.0
+        if n1 % 2 == 0:
+            weights[-1] = 1.0
+
+        kernel0 = np.exp(2j * np.pi * pos0[..., np.newaxis] * k0 / n0)  # (N, region, n0)
+        kernel1 = np.exp(2j * np.pi * pos1[..., np.newaxis] * k1 / n1) * weights  # (N, region, n1 // 2 + 1)
+
+        upsampled = kernel0 @ product @ kernel1.transpose(0, 2, 1)
+        return upsampled.real / (n0 * n1), pos0, pos1
+
+    def register(self, img: np.ndarray, return_peak: bool = False):
+        """Register the image or stack of images against the reference.
+
+        Parameters
+        ----------
+        img : np.array
+            Image (n0, n1) or stack of images (N, n0, n1)
+        return_peak : bool
+            Additionally return the height of the correlation peak, which
+            is a measure of the quality of the match (between 0 and 1 for
+            phase correlation).
+
+        Returns
+        -------
+        shift : np.array
+            Shift (2,) or shifts (N, 2) to register the image(s) with the reference
+        """
+        single = img.ndim == 2
+        product = self._cross_power(img[np.newaxis] if single else img)
+
+        correlation = fft.irfft2(product, s=self.shape, workers=self.workers)
+        flat = correlation.reshape(len(correlation), -1)
+        maxima = np.argmax(flat, axis=1)
+        peaks = flat[np.arange(len(flat)), maxima]
+
+        # peaks past the midpoint are negative shifts
+        shape = np.array(self.shape)
+        shifts = np.stack(np.unravel_index(maxima, self.shape), axis=1).astype(float)
+        shifts = np.where(shifts > shape // 2, shifts - shape, shifts)
+
+        if self.upsample_factor > 1:
+            upsampled, pos0, pos1 = self._upsampled_correlation(product.astype(np.complex128), shifts)
+            flat = upsampled.reshape(len(upsampled), -1)
+            maxima = np.argmax(flat, axis=1)
+            index = np.arange(len(flat))
+            peaks = flat[index, maxima]
+            i0, i1 = np.unravel_index(maxima, upsampled.shape[1:])
+            shifts = np.stack((pos0[index, i0], pos1[index, i1]), axis=1)
+
+        if single:
+            shifts, peaks = shifts[0], peaks[0]
+
+        if return_peak:
+            return shifts, peaks
+        else:
+            return shifts
 
 
 def translation(im0,
@@ -23,9 +204,7 @@ def translation(im0,
     shift: list
         Return the 2 coordinates defining the determined image shift
     """
-    f0 = fft2(im0)
-    f1 = fft2(im1)
-    ir = abs(ifft2((f0 * f1.conjugate()) / (abs(f0) * abs(f1))))
+    ir = abs(Registrar(im0).correlate(im1))
     shape = ir.shape
 
     if limit_shift:
@@ -2,44 +2,60 @@ import pickle
 from pathlib import Path
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 with open(Path(__file__).parent / 'weights-py3.p', 'rb') as p_file:
     weights = pickle.load(p_file)
 
 
 def conv_layer(in_layer, weight, offset):
-    first_layer = np.ones([(in_layer.shape[0] - 2) * (in_layer.shape[1] - 2), in_layer.shape[2], 3, 3])
-    q = 0
-    for n in range(in_layer.shape[0] - 2):
-        for p in range(in_layer.shape[1] - 2):
-            first_layer[q] = np.transpose(in_layer[n:n + 3, p:p + 3], [2, 0, 1])
-            q += 1
-    convoluted = np.tensordot(first_layer, weight, axes=(((2, 3, 1), (0, 1, 2))))
-    convoluted_reshaped = convoluted.reshape([in_layer.shape[0] - 2, in_layer.shape[1] - 2, 64])
-    convoluted_reshaped += offset
+    """3x3 convolution ('valid') of `in_layer` (H, W, C) or a batch of layers
+    (N, H, W, C) with `weight` (3, 3, C, K).
 
-    return convoluted_reshaped
+    If the im2col matrix is not larger than the output (C * 3 * 3 <= K),
+    it is taken as a strided view of the input and multiplied in one go.
+    Otherwise, the products for each of the 9 kernel positions are
+    accumulated on shifted views of the input, so that the memory use
+    stays proportional to the output.
+    """
+    batch = in_layer[np.newaxis] if in_layer.ndim == 3 else in_layer
+    n, h, w, channels = batch.shape
+    kh, kw, _, kernels = weight.shape
+    out_h, out_w = h - kh + 1, w - kw + 1
+
+    if channels * kh * kw <= kernels:
+        cols = sliding_window_view(batch, (kh, kw), axis=(1, 2))  # (N, out_h, out_w, C, kh, kw)
+        convoluted = np.tensordot(cols, weight, axes=((4, 5, 3), (0, 1, 2)))
+        convoluted += offset
+    else:
+        convoluted = np.empty((n, out_h, out_w, kernels), dtype=np.result_type(batch, weight))
+        convoluted[...] = offset
+        for i in range(kh):
+            for j in range(kw):
+                convoluted += batch[:, i:i + out_h, j:j + out_w] @ weight[i, j]
+
+    return convoluted if in_layer.ndim == 4 else convoluted[0]
 
 
 def relu(convoluted):
-    convoluted[convoluted < 0] = 0
-    return convoluted
+    return np.maximum(convoluted, 0, out=convoluted)
 
 
 def max_pooling(convoluted):
-    pooled = np.ones((convoluted.shape[0] // 2, convoluted.shape[1] // 2, convoluted.shape[2]))
-    for n in range(convoluted.shape[0] // 2):
-        for p in range(convoluted.shape[1] // 2):
-            pooled[n, p] = np.amax(convoluted[n * 2:n * 2 + 2, p * 2:p * 2 + 2], axis=(0, 1))
-    return pooled
+    """2x2 max pooling of (H, W, C) or (N, H, W, C), odd rows/columns are
+    dropped."""
+    *n, h, w, c = convoluted.shape
+    h2, w2 = h // 2, w // 2
+    cells = convoluted[..., :h2 * 2, :w2 * 2, :].reshape(*n, h2, 2, w2, 2, c)
+    return cells.max(axis=(-4, -2))
 
 
 def logistic(x):
     return 1 / (1 + np.exp(-x))
 
 
-def predict(image, weights=weights):
-    convoluted1 = relu(conv_layer(image, weights[0], weights[1]))
+def _predict_batch(images, weights):
+    convoluted1 = relu(conv_layer(images, weights[0], weights[1]))
     pooled1 = max_pooling(convoluted1)
     convoluted2 = relu(conv_layer(pooled1, weights[2], weights[3]))
     pooled2 = max_pooling(convoluted2)
@@ -48,8 +64,26 @@ def predict(image, weights=weights):
     convoluted4 = relu(conv_layer(pooled3, weights[6], weights[7]))
     pooled4 = max_pooling(convoluted4)
     convoluted5 = relu(conv_layer(pooled4, weights[8], weights[9]))
-    flattened = convoluted5.reshape((1, 1600))
+    flattened = convoluted5.reshape((len(images), 1600))
     dense1 = relu(np.tensordot(flattened, weights[10], axes=(1, 0)) + weights[11])
     dense2 = relu(np.tensordot(dense1, weights[12], axes=(1, 0)) + weights[13])
     dense3 = np.tensordot(dense2, weights[14], axes=(1, 0)) + weights[15]
-    return logistic(dense3)[0][0]
+    return logistic(dense3)[:, 0]
+
+
+def predict(image, weights=weights, batch_size: int = 64, dtype=np.float32):
+    """Predict the quality of a preprocessed diffraction pattern (150, 150,
+    1), see `preprocess`.
+
+    If a stack of patterns (N, 150, 150, 1) is given, they are evaluated
+    in batches of `batch_size`, and an array with the N predictions is
+    returned.
+    """
+    weights = [np.asarray(w, dtype=dtype) for w in weights]
+    images = np.asarray(image, dtype=dtype)
+
+    if images.ndim == 3:
+        return _predict_batch(images[np.newaxis], weights)[0]
+
+    predictions = [_predict_batch(images[i:i + batch_size], weights) for i in range(0, len(images), batch_size)]
+    return np.concatenate(predictions) if predictions else np.empty(0, dtype=dtype)
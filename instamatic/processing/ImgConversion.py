@@ -7,18 +7,36 @@ from math import cos
 import numpy as np
 
 from instamatic import config
-from instamatic.formats import read_tiff, write_adsc, write_mrc, write_tiff
-from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.formats import (
+    HDF5Stack,
+    HeaderTemplate,
+    read_tiff,
+    update_adsc_header,
+    write_adsc_stack,
+    write_mrc,
+    write_tiff,
+)
+from instamatic.processing.acquisition_pipeline import AcquisitionPipeline
+from instamatic.processing.flatfield import FlatfieldCorrector
+from instamatic.processing.frame_source import FrameSource
+from instamatic.processing.frame_writer import (
+    ProcessPoolWriter,
+    write_mrc_frame,
+    write_smv_frame,
+    write_tiff_frame,
+)
 from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
 from instamatic.tools import (
-    find_beam_center,
-    find_beam_center_with_beamstop,
+    find_beam_centers,
     find_subranges,
     to_xds_untrusted_area,
 )
 
 logger = logging.getLogger(__name__)
 
+# SMV header items that change from frame to frame
+SMV_FRAME_FIELDS = ('DATE', 'TIME', 'PHI', 'OSC_START')
+
 
 def rotation_axis_to_xyz(rotation_axis, invert=False, setting='xds'):
     """Convert rotation axis angle to XYZ vector compatible with 'xds', or
@@ -107,6 +125,12 @@ class ImgConversion:
     The image buffer is passed as a list of tuples, where each tuple
     contains the index (int), image data (2D numpy array),
     metadata/header (dict). The buffer index must start at 1.
+
+    Alternatively, an `AcquisitionPipeline` can be passed as the buffer,
+    in which case the data have already been corrected and written, and
+    are read back from disk when needed, or a `FrameSource` to read the
+    frames from files or a stack (memmap, HDF5) one at a time, so that
+    large data sets do not have to fit in memory.
     """
 
     def __init__(self,
@@ -123,20 +147,9 @@ class ImgConversion:
             flatfield, h = read_tiff(flatfield)
         self.flatfield = flatfield
 
-        self.headers = {}
-        self.data = {}
-
         self.smv_subdrc = 'data'
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
-
-            self.headers[i] = h
-
-            if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
-            else:
-                self.data[i] = img
+        self.load_buffer(buffer)
 
         self.untrusted_areas = []
 
@@ -144,7 +157,6 @@ class ImgConversion:
         self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
         self.missing_range = self.observed_range ^ self.complete_range
 
-        self.data_shape = img.shape
         try:
             self.pixelsize = config.calibration['diff']['pixelsize'][camera_length]  # px / Angstrom
         except KeyError:
@@ -229,16 +241,67 @@ class ImgConversion:
             if not all(hasattr(self, attr) for attr in stretch_attrs):
                 raise AttributeError(f'`{self.__class__.__name__}` is missing stretch attrs `{stretch_attrs[0]}/{stretch_attrs[1]}`')
 
+    def load_buffer(self, buffer) -> None:
+        """Read the headers and data from the image buffer, and apply the
+        flatfield correction.
+
+        If `buffer` is an `AcquisitionPipeline`, the frames have already
+        been processed and are read from disk only when accessed. If
+        `buffer` is a `FrameSource`, the frames are read (and corrected)
+        only when accessed.
+        """
+        self.headers = {}
+        self.data = {}
+        self.beam_centers = {}
+
+        if isinstance(buffer, AcquisitionPipeline):
+            self.headers = buffer.headers
+            self.data = buffer.frames
+            self.beam_centers = buffer.beam_centers
+            self.data_shape = buffer.data_shape
+            return
+
+        if isinstance(buffer, FrameSource):
+            self.headers = buffer.headers
+            self.data = buffer.with_flatfield(self.flatfield)
+            self.data_shape = self.data.frame_shape
+            return
+
+        corrector = FlatfieldCorrector(self.flatfield) if self.flatfield is not None else None
+
+        while len(buffer) != 0:
+            i, img, h = buffer.pop(0)
+
+            self.headers[i] = h
+
+            if corrector is not None:
+                self.data[i] = corrector(img)
+            else:
+                self.data[i] = img
+
+        self.data_shape = img.shape
+
+    def get_mean_image(self) -> np.ndarray:
+        """Return the mean of all frames, the frames are read one at a
+        time."""
+        total = np.zeros(self.data_shape, dtype=np.float64)
+        for i in self.observed_range:
+            total += self.data[i]
+        return total / len(self.observed_range)
+
     def get_beam_centers(self, invert_x: bool = False, invert_y: bool = False) -> (float, float):
         """Obtain beam centers from the diffraction data Returns a tuple with
         the median beam center and its standard deviation."""
         shape_x, shape_y = self.data_shape
+
+        # beam centers that were not determined while collecting the data are found for all frames at once
+        todo = [i for i in self.headers if i not in self.beam_centers]
+        found = find_beam_centers((self.data[i] for i in todo), sigma=10, use_beamstop=self.use_beamstop, z=99)
+        self.beam_centers.update(zip(todo, map(tuple, found)))
+
         centers = []
         for i, h in self.headers.items():
-            if self.use_beamstop:
-                cx, cy = find_beam_center_with_beamstop(self.data[i], z=99)
-            else:
-                cx, cy = find_beam_center(self.data[i], sigma=10)
+            cx, cy = self.beam_centers[i]
 
             if invert_x:
                 cx = shape_x - cx
@@ -312,10 +375,14 @@ class ImgConversion:
         print('\033[k', 'Writing SMV files......', end='\r')
 
         path = path / self.smv_subdrc
-        path.mkdir(exist_ok=True)
+        path.mkdir(exist_ok=True, parents=True)
 
-        for i in self.observed_range:
-            self.write_smv(path, i)
+        observed_range = sorted(self.observed_range)
+
+        write_adsc_stack(fnames=[path / f'{i:05d}.img' for i in observed_range],
+                         stack=(np.ushort(self.data[i]) for i in observed_range),
+                         template=self.get_smv_template(),
+                         values=[self.get_smv_frame_values(i) for i in observed_range])
 
         logger.debug(f'SMV files saved in folder: {path}')
 
@@ -330,6 +397,34 @@ class ImgConversion:
 
         logger.debug(f'MRC files created in folder: {path}')
 
+    def hdf5_writer(self, path: str, name: str = 'data.h5', compression: str = None) -> str:
+        """Write all data with their headers to a single HDF5 stack `name` in
+        `path`, see `HDF5Stack`. The frames are stored as 16-bit integers
+        (same as TIFF), and the experimental parameters as attributes of the
+        stack. Missing frames are left out.
+
+        Returns the path to the stack.
+        """
+        path.mkdir(exist_ok=True, parents=True)
+
+        fn = path / name
+        with HDF5Stack.create(fn, shape=self.data_shape, dtype=np.uint16, compression=compression) as stack:
+            stack.attrs.update({
+                'osc_angle': self.osc_angle,
+                'start_angle': self.start_angle,
+                'rotation_axis': self.rotation_axis,
+                'wavelength': self.wavelength,
+                'distance': self.distance,
+                'physical_pixelsize': self.physical_pixelsize,
+                'beam_center': self.mean_beam_center,
+            })
+            for i in sorted(self.observed_range):
+                img = np.round(self.data[i], 0).astype(np.uint16)
+                stack.append(img, {**self.headers[i], 'frame': i})
+
+        logger.debug(f'HDF5 stack created: {fn}')
+        return fn
+
     def threadpoolwriter(self, tiff_path: str = None, smv_path: str = None, mrc_path: str = None, workers: int = 8) -> None:
         """Efficiently write all data to the specified formats using a
         threadpool.
@@ -344,6 +439,7 @@ class ImgConversion:
         if write_smv:
             smv_path = smv_path / self.smv_subdrc
             smv_path.mkdir(exist_ok=True, parents=True)
+            smv_template = self.get_smv_template()
             logger.debug(f'SMV files saved in folder: {smv_path}')
 
         if write_tiff:
@@ -364,11 +460,61 @@ class ImgConversion:
                 if write_mrc:
                     futures.append(executor.submit(self.write_mrc, mrc_path, i))
                 if write_smv:
-                    futures.append(executor.submit(self.write_smv, smv_path, i))
+                    futures.append(executor.submit(self.write_smv, smv_path, i, smv_template))
 
             for future in futures:
                 ret = future.result()
 
+    def processpoolwriter(self, tiff_path: str = None, smv_path: str = None, mrc_path: str = None, workers: int = None) -> None:
+        """Write all data to the specified formats using a pool of `workers`
+        processes (default: number of cpus), see `ProcessPoolWriter`.
+
+        If a path is given, write data in the corresponding format, i.e.
+        if `tiff_path` is specified TIFF files are written to that path.
+        """
+        if smv_path is not None:
+            smv_path = smv_path / self.smv_subdrc
+
+        paths = {'tiff': tiff_path, 'smv': smv_path, 'mrc': mrc_path}
+        paths = {fmt: path for fmt, path in paths.items() if path is not None}
+
+        for fmt, path in paths.items():
+            path.mkdir(exist_ok=True, parents=True)
+            logger.debug(f'{fmt.upper()} files saved in folder: {path}')
+
+        if not paths:
+            return
+
+        extensions = {'tiff': 'tiff', 'smv': 'img', 'mrc': 'mrc'}
+
+        if 'smv' in paths:
+            smv_template = self.get_smv_template()
+
+        writer = None
+
+        try:
+            for i in sorted(self.observed_range):
+                img = self.data[i]
+
+                if writer is None:
+                    writer = ProcessPoolWriter(shape=img.shape, dtype=img.dtype, workers=workers)
+
+                jobs = []
+                for fmt, path in paths.items():
+                    fn = path / f'{i:05d}.{extensions[fmt]}'
+                    if fmt == 'tiff':
+                        header = self.headers[i]
+                    elif fmt == 'smv':
+                        header = smv_template.format(**self.get_smv_frame_values(i))
+                    else:
+                        header = None
+                    jobs.append((fmt, fn, header))
+
+                writer.submit(img, jobs)
+        finally:
+            if writer is not None:
+                writer.close()
+
     def to_dials(self, smv_path: str) -> None:
         """Convert the buffer to output compatible with DIALS.
 
@@ -409,39 +555,75 @@ class ImgConversion:
 
         Returns the path to the written image.
         """
-        img = self.data[i]
-        h = self.headers[i]
-
-        # PETS reads only 16bit unsignt integer TIFF
-        img = np.round(img, 0).astype(np.uint16)
-
         fn = path / f'{i:05d}.tiff'
-        write_tiff(fn, img, header=h)
+        write_tiff_frame(fn, self.data[i], header=self.headers[i])
         return fn
 
-    def write_smv(self, path: str, i: int) -> str:
+    def write_smv(self, path: str, i: int, template: HeaderTemplate = None) -> str:
         """Write the image+header with sequence number `i` to the directory
-        `path` in SMV format.
+        `path` in SMV format. Pass the `template` from `get_smv_template`
+        when writing many frames, so that the header is not formatted from
+        scratch every time.
 
         Returns the path to the written image.
         """
-        img = self.data[i]
-        h = self.headers[i]
+        if template is None:
+            template = self.get_smv_template()
+        fn = path / f'{i:05d}.img'
+        write_smv_frame(fn, self.data[i], header=template.format(**self.get_smv_frame_values(i)))
+        return fn
 
-        img = np.ushort(img)
-        shape_x, shape_y = img.shape
+    def write_smv_headers(self, path: str) -> None:
+        """Update the headers of the SMV files in `path` in place, i.e. for
+        files written by `AcquisitionPipeline` before the rotation range and
+        beam center were known."""
+        path = path / self.smv_subdrc
 
-        phi = self.start_angle + self.osc_angle * (i - 1)
+        for i in self.observed_range:
+            update_adsc_header(path / f'{i:05d}.img', self.get_smv_header(i))
 
-        # TODO: Dials reads the beam_center from the first image and uses that for the whole range
-        # For now, use the average beam center and consider it stationary, remove this line later
-        mean_beam_center = self.mean_beam_center
+        logger.debug(f'SMV headers updated in folder: {path}')
+
+    def get_smv_header(self, i: int) -> dict:
+        """Return the SMV header for the image with sequence number `i`."""
+        header = self.get_smv_static_header()
+        header.update(self.get_smv_frame_values(i))
+        return header
+
+    def get_smv_template(self) -> HeaderTemplate:
+        """Return the SMV header template for this data set, the values for
+        `SMV_FRAME_FIELDS` are filled in per frame (see
+        `get_smv_frame_values`)."""
+        return HeaderTemplate(self.get_smv_static_header(), fields=SMV_FRAME_FIELDS)
+
+    def get_smv_frame_values(self, i: int) -> dict:
+        """Return the values of the SMV header items that change per frame
+        for the image with sequence number `i`."""
+        h = self.headers[i]
+
+        phi = self.start_angle + self.osc_angle * (i - 1)
 
         try:
             date = str(datetime.fromtimestamp(h['ImageGetTime']))
         except BaseException:
             date = '0'
 
+        return {
+            'DATE': date,
+            'TIME': str(h['ImageExposureTime']),
+            'PHI': f'{phi:.4f}',
+            'OSC_START': f'{phi:.4f}',
+        }
+
+    def get_smv_static_header(self) -> dict:
+        """Return the SMV header items that are the same for all frames,
+        `SMV_FRAME_FIELDS` are set to `None`."""
+        shape_x, shape_y = self.data_shape
+
+        # TODO: Dials reads the beam_center from the first image and uses that for the whole range
+        # For now, use the average beam center and consider it stationary, remove this line later
+        mean_beam_center = self.mean_beam_center
+
         header = collections.OrderedDict()
         header['HEADER_BYTES'] = 512
         header['DIM'] = 2
@@ -456,12 +638,12 @@ class ImgConversion:
         header['CREV'] = 1
         header['BEAMLINE'] = self.name      # special ID for DIALS
         header['DETECTOR_SN'] = 901         # special ID for DIALS
-        header['DATE'] = date
-        header['TIME'] = str(h['ImageExposureTime'])
+        header['DATE'] = None
+        header['TIME'] = None
         header['DISTANCE'] = f'{self.distance:.4f}'
         header['TWOTHETA'] = 0.00
-        header['PHI'] = '{phi:.4f}'
-        header['OSC_START'] = f'{phi:.4f}'
+        header['PHI'] = None
+        header['OSC_START'] = None
         header['OSC_RANGE'] = f'{self.osc_angle:.4f}'
         header['WAVELENGTH'] = f'{self.wavelength:.4f}'
         # reverse XY coordinates for XDS
@@ -469,9 +651,7 @@ class ImgConversion:
         header['BEAM_CENTER_Y'] = f'{mean_beam_center[0]:.4f}'
         header['DENZO_X_BEAM'] = f'{mean_beam_center[0]*self.physical_pixelsize:.4f}'
         header['DENZO_Y_BEAM'] = f'{mean_beam_center[1]*self.physical_pixelsize:.4f}'
-        fn = path / f'{i:05d}.img'
-        write_adsc(fn, img, header=header)
-        return fn
+        return header
 
     def write_mrc(self, path: str, i: int) -> str:
         """Write the image+header with sequence number `i` to the directory
@@ -479,25 +659,8 @@ class ImgConversion:
 
         Returns the path to the written image.
         """
-        img = self.data[i]
-
         fn = path / f'{i:05d}.mrc'
-
-        # for RED these need to be as integers
-        dtype = np.uint16
-        if False:
-            # Use maximum range available in data type for extra precision when converting from FLOAT to INT
-            dynamic_range = 11900  # a little bit higher just in case
-            maxval = np.iinfo(dtype).max
-            img = (img / dynamic_range) * maxval
-
-        img = np.round(img, 0).astype(dtype)
-
-        # flip up/down because RED reads images from the bottom left corner
-        img = np.flipud(img)
-
-        write_mrc(fn, img)
-
+        write_mrc_frame(fn, self.data[i])
         return fn
 
     def write_ed3d(self, path: str) -> None:
@@ -1,3 +1,3 @@
 """General purpose processing goes here."""
-from .flatfield import apply_flatfield_correction
+from .flatfield import FlatfieldCorrector, apply_flatfield_correction
 from .stretch_correction import apply_stretch_correction
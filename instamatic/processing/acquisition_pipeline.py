@@ -0,0 +1,239 @@
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from instamatic.formats import read_image, write_adsc, write_mrc, write_tiff
+from instamatic.processing.flatfield import FlatfieldCorrector
+from instamatic.processing.frame_source import FrameSource
+from instamatic.tools import find_beam_centers
+
+logger = logging.getLogger(__name__)
+
+# Provisional SMV header, the final header is written by `ImgConversion.write_smv_headers`
+# once the rotation range and the mean beam center are known.
+SMV_HEADER_BYTES = 512
+
+_STOP = object()
+
+
+def read_frame(fn) -> np.ndarray:
+    """Read a frame written by `AcquisitionPipeline`."""
+    img, h = read_image(fn)
+    if fn.suffix == '.mrc':
+        # MRC files are stored upside down for RED
+        img = np.flipud(img)
+    return img
+
+
+class AcquisitionPipeline:
+    """Process and write frames in the background while the data are being
+    collected.
+
+    Frames are passed in with `put` and placed on a queue, from which
+    `workers` threads take them to apply the flatfield correction, find
+    the beam center, and write them to the TIFF/SMV/MRC directories that
+    are specified. The queue holds at most `maxsize` frames, when it is
+    full `put` blocks until a frame has been written (backpressure), so
+    that the memory use stays bounded. The time spent waiting is
+    recorded, see `get_statistics`.
+
+    After `close`, the pipeline can be passed as the buffer to
+    `ImgConversion`.
+    """
+
+    def __init__(self,
+                 tiff_path: str = None,
+                 smv_path: str = None,
+                 mrc_path: str = None,
+                 flatfield: str = None,
+                 use_beamstop: bool = False,
+                 maxsize: int = 32,
+                 workers: int = 2,
+                 ):
+        super().__init__()
+
+        if flatfield is not None:
+            flatfield = FlatfieldCorrector.from_file(flatfield, deadpixels=False)
+        self.flatfield = flatfield
+
+        self.use_beamstop = use_beamstop
+        self.smv_subdrc = 'data'
+
+        self.tiff_path = Path(tiff_path) if tiff_path else None
+        self.mrc_path = Path(mrc_path) if mrc_path else None
+        self.smv_path = Path(smv_path) / self.smv_subdrc if smv_path else None
+
+        for path in (self.tiff_path, self.mrc_path, self.smv_path):
+            if path:
+                path.mkdir(exist_ok=True, parents=True)
+
+        self.headers = {}
+        self.beam_centers = {}
+        self.data_shape = None
+        self.fns = {}
+
+        self.maxsize = maxsize
+        self.q = queue.Queue(maxsize=maxsize)
+
+        self._lock = threading.Lock()
+        self._exception = None
+        self._closed = False
+
+        self._nframes = 0
+        self._max_queued = 0
+        self._blocked = 0
+        self._blocked_time = 0.0
+        self._process_time = 0.0
+        self._max_process_time = 0.0
+        self._t_start = time.perf_counter()
+        self._t_end = None
+
+        self.workers = [threading.Thread(target=self._worker, name=f'AcquisitionPipeline-{n}', daemon=True)
+                        for n in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def __len__(self):
+        return len(self.headers)
+
+    def put(self, i: int, img: np.ndarray, h: dict):
+        """Add frame `i` with image `img` and header `h` to the queue.
+
+        Blocks if the queue is full. Raises the first exception that
+        occurred in the workers, so that a failure is reported during
+        data collection.
+        """
+        if self._closed:
+            raise RuntimeError('Cannot add frames to a closed pipeline')
+        if self._exception:
+            raise self._exception
+
+        item = (i, img, h)
+
+        try:
+            self.q.put_nowait(item)
+        except queue.Full:
+            t0 = time.perf_counter()
+            self.q.put(item)
+            with self._lock:
+                self._blocked += 1
+                self._blocked_time += time.perf_counter() - t0
+
+        with self._lock:
+            self._max_queued = max(self._max_queued, self.q.qsize())
+
+    def close(self) -> dict:
+        """Wait for all frames in the queue to be written, and stop the
+        workers.
+
+        Returns the statistics, see `get_statistics`. Raises the first
+        exception that occurred in the workers.
+        """
+        if not self._closed:
+            self._closed = True
+            for worker in self.workers:
+                self.q.put(_STOP)
+            for worker in self.workers:
+                worker.join()
+            self._t_end = time.perf_counter()
+
+        if self._exception:
+            raise self._exception
+
+        return self.get_statistics()
+
+    def get_statistics(self) -> dict:
+        """Return the number of frames processed, the maximum number of
+        frames queued, how often (and how long in total, in seconds) the
+        acquisition was blocked by a full queue, and the mean/max processing
+        time per frame."""
+        with self._lock:
+            t_end = self._t_end or time.perf_counter()
+            return {
+                'frames': self._nframes,
+                'maxsize': self.maxsize,
+                'max_queued': self._max_queued,
+                'blocked': self._blocked,
+                'blocked_time': self._blocked_time,
+                'mean_process_time': self._process_time / max(self._nframes, 1),
+                'max_process_time': self._max_process_time,
+                'elapsed': t_end - self._t_start,
+            }
+
+    @property
+    def frames(self) -> FrameSource:
+        """Mapping of the frame number to the processed image (read from
+        disk)."""
+        return FrameSource(self.fns, headers=self.headers, reader=read_frame)
+
+    def _worker(self):
+        while True:
+            item = self.q.get()
+            if item is _STOP:
+                break
+
+            t0 = time.perf_counter()
+
+            try:
+                self.process_frame(*item)
+            except Exception as e:
+                logger.exception(e)
+                with self._lock:
+                    if not self._exception:
+                        self._exception = e
+                continue
+
+            dt = time.perf_counter() - t0
+
+            with self._lock:
+                self._nframes += 1
+                self._process_time += dt
+                self._max_process_time = max(self._max_process_time, dt)
+
+    def process_frame(self, i: int, img: np.ndarray, h: dict):
+        """Apply the corrections to frame `i`, and write it to disk."""
+        if self.flatfield is not None:
+            img = self.flatfield(img)
+
+        # same as `ImgConversion.get_beam_centers`
+        (cx, cy), = find_beam_centers([img], sigma=10, use_beamstop=self.use_beamstop, z=99)
+
+        h['beam_center'] = (cx, cy)
+
+        fns = []
+
+        # same conversions as in `frame_writer`, the rounded image is shared between TIFF and MRC
+        if self.smv_path:
+            fn = self.smv_path / f'{i:05d}.img'
+            header = {
+                'HEADER_BYTES': SMV_HEADER_BYTES,
+                'DIM': 2,
+                'BYTE_ORDER': 'little_endian',
+                'TYPE': 'unsigned_short',
+            }
+            write_adsc(fn, np.ushort(img), header=header)
+            fns.append(fn)
+
+        if self.tiff_path or self.mrc_path:
+            img_uint16 = np.round(img, 0).astype(np.uint16)
+
+        if self.tiff_path:
+            fn = self.tiff_path / f'{i:05d}.tiff'
+            write_tiff(fn, img_uint16, header=h)
+            fns.append(fn)
+
+        if self.mrc_path:
+            fn = self.mrc_path / f'{i:05d}.mrc'
+            write_mrc(fn, np.flipud(img_uint16))
+            fns.append(fn)
+
+        with self._lock:
+            self.headers[i] = h
+            self.beam_centers[i] = (cx, cy)
+            self.data_shape = img.shape
+            if fns:
+                self.fns[i] = fns[0]
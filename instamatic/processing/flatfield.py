@@ -20,13 +20,38 @@ def apply_corrections(img, deadpixels=None):
     return img
 
 
+def get_deadpixel_neighbours(deadpixels, shape: tuple, d: int = 1) -> tuple:
+    """Get the indices of the dead pixels, and the indices and weights of
+    their neighbours within `d` pixels for the interpolation.
+
+    Neighbours outside the image or that are dead pixels themselves get
+    a weight of 0, the other neighbours are averaged.
+
+    Returns (rows, cols), (neighbour_rows, neighbour_cols), weights
+    """
+    deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+    shape = np.array(shape[-2:])
+
+    offsets = np.array([(di, dj) for di in range(-d, d + 1) for dj in range(-d, d + 1) if di or dj])
+    neighbours = deadpixels[:, np.newaxis, :] + offsets  # (n, k, 2)
+
+    valid = np.all((neighbours >= 0) & (neighbours < shape), axis=-1)
+    neighbours = np.clip(neighbours, 0, shape - 1)
+
+    is_dead = np.zeros(shape, dtype=bool)
+    is_dead[deadpixels[:, 0], deadpixels[:, 1]] = True
+    valid &= ~is_dead[neighbours[..., 0], neighbours[..., 1]]
+
+    weights = valid / np.maximum(valid.sum(axis=1, keepdims=True), 1)
+
+    return (deadpixels[:, 0], deadpixels[:, 1]), (neighbours[..., 0], neighbours[..., 1]), weights
+
+
 def remove_deadpixels(img, deadpixels, d=1):
     """Remove dead pixels from the images by replacing them with the average of
-    neighbouring pixels."""
-    d = 1
-    for (i, j) in deadpixels:
-        neighbours = img[i - d:i + d + 1, j - d:j + d + 1].flatten()
-        img[i, j] = np.mean(neighbours)
+    neighbouring pixels (excluding other dead pixels)."""
+    index, neighbours, weights = get_deadpixel_neighbours(deadpixels, img.shape, d=d)
+    img[index] = np.sum(img[neighbours] * weights, axis=-1)
     return img
 
 
@@ -74,6 +99,106 @@ def apply_flatfield_correction(img, flatfield, darkfield=None):
     return ret
 
 
+class FlatfieldCorrector:
+    """Apply the dead pixel, darkfield, and flatfield corrections to images.
+
+    The gain map and the indices and weights to interpolate the dead
+    pixels are calculated once, so that they can be applied efficiently
+    to many images with `correct` (single frames) or `correct_stack`
+    (3D arrays). The images are converted to `dtype`, unless `inplace`
+    is set and they are already floating point.
+
+    See `apply_flatfield_correction` and `remove_deadpixels`.
+
+    Usage:
+        corrector = FlatfieldCorrector.from_file('flatfield.tiff')
+        img = corrector(img)
+    """
+
+    def __init__(self, flatfield: np.ndarray, darkfield: np.ndarray = None, deadpixels=None, dtype=np.float64):
+        super().__init__()
+
+        flatfield = np.asarray(flatfield, dtype=np.float64)
+        if darkfield is not None:
+            flatfield = flatfield - darkfield
+            darkfield = np.asarray(darkfield, dtype=dtype)
+
+        # avoid dividing by zero for dead pixels in the flatfield
+        gain = np.divide(np.mean(flatfield), flatfield, out=np.ones_like(flatfield), where=flatfield != 0)
+
+        self.shape = flatfield.shape
+        self.dtype = np.dtype(dtype)
+        self.gain = gain.astype(self.dtype)
+        self.darkfield = darkfield
+
+        if deadpixels is not None and len(deadpixels):
+            self.deadpixels = get_deadpixel_neighbours(deadpixels, self.shape)
+        else:
+            self.deadpixels = None
+
+    @classmethod
+    def from_file(cls, flatfield: str, darkfield: str = None, deadpixels: bool = True, **kwargs) -> 'FlatfieldCorrector':
+        """Read the flatfield (and darkfield) from tiff files, the dead
+        pixels are taken from the flatfield header if `deadpixels` is
+        set."""
+        flatfield, h = read_tiff(flatfield)
+        if darkfield is not None:
+            darkfield, _ = read_tiff(darkfield)
+        deadpixels = h.get('deadpixels') if deadpixels else None
+        return cls(flatfield, darkfield=darkfield, deadpixels=deadpixels, **kwargs)
+
+    def __call__(self, img: np.ndarray) -> np.ndarray:
+        return self.correct(img)
+
+    def _as_float(self, arr: np.ndarray, inplace: bool = False) -> np.ndarray:
+        if inplace and arr.dtype.kind == 'f':
+            return arr
+        return np.array(arr, dtype=self.dtype)
+
+    def remove_deadpixels(self, img: np.ndarray) -> np.ndarray:
+        """Replace the dead pixels in `img` (single image or stack) in place
+        by the average of their neighbours."""
+        if self.deadpixels is not None:
+            index, neighbours, weights = self.deadpixels
+            index = (Ellipsis, *index)
+            neighbours = (Ellipsis, *neighbours)
+            img[index] = np.sum(img[neighbours] * weights, axis=-1)
+        return img
+
+    def apply_gain(self, img: np.ndarray, inplace: bool = False) -> np.ndarray:
+        """Apply the darkfield and flatfield corrections to `img` (single
+        image or stack)."""
+        img = self._as_float(img, inplace=inplace)
+        if self.darkfield is not None:
+            img -= self.darkfield
+        img *= self.gain
+        return img
+
+    def correct(self, img: np.ndarray, inplace: bool = False) -> np.ndarray:
+        """Apply all corrections to a single image.
+
+        The image is returned unchanged (with a warning) if its shape
+        does not match the flatfield.
+        """
+        if img.shape != self.shape:
+            msg = f'Flatfield not applied: image {img.shape} and flatfield {self.shape} do not match shapes.'
+            warnings.warn(msg)
+            return img
+
+        img = self._as_float(img, inplace=inplace)
+        img = self.remove_deadpixels(img)
+        return self.apply_gain(img, inplace=True)
+
+    def correct_stack(self, stack: np.ndarray, inplace: bool = False) -> np.ndarray:
+        """Apply all corrections to a stack of images (3D array)."""
+        if stack.shape[1:] != self.shape:
+            raise ValueError(f'Stack {stack.shape[1:]} and flatfield {self.shape} do not match shapes.')
+
+        stack = self._as_float(stack, inplace=inplace)
+        stack = self.remove_deadpixels(stack)
+        return self.apply_gain(stack, inplace=True)
+
+
 def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfield=True, drc='.', **kwargs):
     """Routine to collect flatfield correction files.
 
@@ -201,17 +326,11 @@ This will apply the flatfield correction (`-f`) and optionally the darkfield cor
         exit()
 
     if options.flatfield:
-        flatfield, h = read_tiff(options.flatfield)
-        deadpixels = h['deadpixels']
+        corrector = FlatfieldCorrector.from_file(options.flatfield, darkfield=options.darkfield)
     else:
         print('No flatfield file specified')
         exit()
 
-    if options.darkfield:
-        darkfield, h = read_tiff(options.darkfield)
-    else:
-        darkfield = np.zeros_like(flatfield)
-
     if len(args) == 1:
         fobj = args[0]
         if not os.path.exists(fobj):
@@ -223,8 +342,9 @@ This will apply the flatfield correction (`-f`) and optionally the darkfield cor
     for f in args:
         img, h = read_tiff(f)
 
-        img = apply_corrections(img, deadpixels=deadpixels)
-        img = apply_flatfield_correction(img, flatfield, darkfield=darkfield)
+        img = corrector.remove_deadpixels(img)
+        img = apply_center_pixel_correction(img)
+        img = corrector.apply_gain(img)
 
         name = Path(f).name
         fout = drc / name
@@ -0,0 +1,122 @@
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+from instamatic.formats import read_image, read_tiff_header
+from instamatic.processing.flatfield import FlatfieldCorrector
+
+
+def _read_image_data(fn):
+    img, h = read_image(fn)
+    return img
+
+
+class FrameSource(MutableMapping):
+    """Mapping of the frame number to the image, where the images are only
+    read when they are accessed, so that a data set does not have to fit in
+    memory. Can be passed as the buffer to `ImgConversion`.
+
+    `frames` can be:
+        - a dict of the frame number to a file name
+        - a list of file names, numbered from `start`
+        - an array-like stack of images (e.g. `np.memmap`, h5py dataset,
+          `MrcStack`, `HDF5Stack`), numbered from `start`
+
+    Files are read with `reader(fn) -> img` (default: `read_image`).
+    `headers` is a dict of the frame number to the header (default: empty
+    headers). If `flatfield` (image or `FlatfieldCorrector`) is given, the
+    flatfield correction is applied to every frame when it is read.
+
+    Frames that are assigned (e.g. empty frames for DIALS) are kept in
+    memory.
+    """
+
+    def __init__(self,
+                 frames,
+                 headers: dict = None,
+                 start: int = 1,
+                 reader=None,
+                 flatfield: np.ndarray = None,
+                 ):
+        super().__init__()
+
+        if isinstance(frames, Mapping):
+            self.fns = dict(frames)
+            self.stack = None
+        elif isinstance(frames, (list, tuple)):
+            self.fns = dict(enumerate(frames, start))
+            self.stack = None
+        else:
+            self.fns = None
+            self.stack = frames
+
+        self.start = start
+        self.reader = reader or _read_image_data
+        if flatfield is not None and not isinstance(flatfield, FlatfieldCorrector):
+            flatfield = FlatfieldCorrector(flatfield)
+        self.flatfield = flatfield
+
+        if headers is None:
+            headers = {i: {} for i in self._keys()}
+        self.headers = headers
+
+        self._extra = {}
+
+    @classmethod
+    def from_tiff(cls, fns, start: int = 1, **kwargs) -> 'FrameSource':
+        """Make a frame source from a list of tiff files, the headers are
+        read from the files (without reading the image data)."""
+        fns = list(fns)
+        headers = {i: read_tiff_header(fn) for i, fn in enumerate(fns, start)}
+        return cls(fns, headers=headers, start=start, **kwargs)
+
+    def with_flatfield(self, flatfield: np.ndarray) -> 'FrameSource':
+        """Return a copy of the frame source that applies the flatfield
+        correction to the frames when they are read."""
+        frames = self.fns if self.stack is None else self.stack
+        new = self.__class__(frames, headers=self.headers, start=self.start, reader=self.reader, flatfield=flatfield)
+        new._extra = self._extra
+        return new
+
+    def _keys(self):
+        if self.stack is None:
+            return self.fns.keys()
+        else:
+            return range(self.start, self.start + len(self.stack))
+
+    @property
+    def frame_shape(self) -> tuple:
+        """Shape of a single frame."""
+        if self.stack is not None:
+            return tuple(self.stack.shape[1:])
+        return self[next(iter(self))].shape
+
+    def __getitem__(self, i):
+        if i in self._extra:
+            return self._extra[i]
+
+        if self.stack is None:
+            img = self.reader(self.fns[i])
+        elif i in self._keys():
+            img = np.asarray(self.stack[i - self.start])
+        else:
+            raise KeyError(i)
+
+        if self.flatfield is not None:
+            img = self.flatfield(img)
+
+        return img
+
+    def __setitem__(self, i, img):
+        self._extra[i] = img
+
+    def __delitem__(self, i):
+        del self._extra[i]
+
+    def __iter__(self):
+        keys = self._keys()
+        yield from keys
+        yield from (i for i in self._extra if i not in keys)
+
+    def __len__(self):
+        return len(set(self._keys()) | set(self._extra))
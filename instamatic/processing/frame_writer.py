@@ -0,0 +1,158 @@
+import concurrent.futures
+import os
+
+import numpy as np
+
+from instamatic.formats import write_adsc, write_adsc_raw, write_mrc, write_tiff
+
+# Default limits for `ProcessPoolWriter`, the number of worker processes,
+# and the size of the shared memory ring buffer
+MAX_WORKERS = 8
+SHARED_MEMORY_BUDGET = 2**28  # bytes
+
+
+def write_tiff_frame(fn: str, img: np.ndarray, header: dict = None) -> None:
+    """Write `img` as TIFF, with `header` stored as metadata."""
+    # PETS reads only 16bit unsignt integer TIFF
+    img = np.round(img, 0).astype(np.uint16)
+    write_tiff(fn, img, header=header)
+
+
+def write_smv_frame(fn: str, img: np.ndarray, header: dict = None) -> None:
+    """Write `img` in SMV format, `header` is the SMV header, either as a
+    dict or preformatted (see `HeaderTemplate`)."""
+    img = np.ushort(img)
+    if isinstance(header, bytes):
+        write_adsc_raw(fn, img, header)
+    else:
+        write_adsc(fn, img, header=header)
+
+
+def encode_mrc_frame(img: np.ndarray) -> np.ndarray:
+    """Convert `img` to the layout used in the MRC files for RED."""
+    # for RED these need to be as integers
+    img = np.round(img, 0).astype(np.uint16)
+    # flip up/down because RED reads images from the bottom left corner
+    return np.flipud(img)
+
+
+def write_mrc_frame(fn: str, img: np.ndarray, header: dict = None) -> None:
+    """Write `img` in MRC format for RED, `header` is ignored."""
+    write_mrc(fn, encode_mrc_frame(img))
+
+
+# Functions to write a single frame, keyed by format
+FRAME_WRITERS = {
+    'tiff': write_tiff_frame,
+    'smv': write_smv_frame,
+    'mrc': write_mrc_frame,
+}
+
+# Ring buffers the worker processes are attached to, keyed by name
+_rings = {}
+
+
+def _write_from_shared_memory(info: dict, slot: int, jobs: list) -> int:
+    """Write the frame in `slot` of the ring buffer described by `info`
+    (runs in the worker process).
+
+    `jobs` is a list of `(fmt, fn, header)`.
+    """
+    from instamatic.server.shm_ring import SharedMemoryRing
+
+    name = info['name']
+    if name not in _rings:
+        _rings[name] = SharedMemoryRing.attach(**info)
+
+    img = _rings[name].frames[slot]
+
+    for fmt, fn, header in jobs:
+        FRAME_WRITERS[fmt](fn, img, header)
+
+    return len(jobs)
+
+
+class ProcessPoolWriter:
+    """Write frames to disk using a pool of `workers` processes.
+
+    Converting and writing the frames is mostly GIL-bound (rounding,
+    dtype conversion, header formatting), so threads do not help much.
+    Each frame is copied once to a ring buffer in shared memory with
+    `nslots` slots, and the workers read it from there, so that the
+    image data do not have to be pickled. Only the file names and
+    headers are sent to the workers. `submit` blocks when all slots are
+    in use.
+
+    All frames must have the same `shape` and `dtype`. By default, there
+    are at most `MAX_WORKERS` workers, and `2 * workers` slots, limited
+    so that the ring takes at most `SHARED_MEMORY_BUDGET` bytes (but at
+    least 2 slots).
+
+    Usage:
+        with ProcessPoolWriter(shape=img.shape, dtype=img.dtype) as writer:
+            writer.submit(img, [('tiff', '00001.tiff', header), ('mrc', '00001.mrc', None)])
+    """
+
+    def __init__(self, shape: tuple, dtype: str, workers: int = None, nslots: int = None):
+        super().__init__()
+
+        from instamatic.server.shm_ring import SharedMemoryRing
+
+        if not workers:
+            workers = min(os.cpu_count() or 1, MAX_WORKERS)
+        if not nslots:
+            frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            nslots = max(2, min(2 * workers, SHARED_MEMORY_BUDGET // max(frame_bytes, 1)))
+
+        self.ring = SharedMemoryRing(shape=shape, dtype=dtype, nslots=nslots)
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+        self.pending = {}
+        self.nframes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, img: np.ndarray, jobs: list) -> None:
+        """Write `img` in the background.
+
+        `jobs` is a list of `(fmt, fn, header)`, where `fmt` is one
+        of the keys of `FRAME_WRITERS`.
+        """
+        while True:
+            self._collect(block=False)
+            info = self.ring.put(img)
+            if info is not None:
+                break
+            self._collect(block=True)
+
+        future = self.pool.submit(_write_from_shared_memory, self.ring.info(), info['slot'], jobs)
+        self.pending[future] = (info['slot'], info['seq'])
+
+    def _collect(self, block: bool = False) -> None:
+        """Hand back the slots of the frames that have been written.
+
+        If `block` is set, wait for at least one frame to finish.
+        """
+        if block and self.pending:
+            concurrent.futures.wait(self.pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for future in [future for future in self.pending if future.done()]:
+            slot, seq = self.pending.pop(future)
+            self.ring.release(slot, seq)
+            future.result()  # raise any error from the worker
+            self.nframes += 1
+
+    def close(self) -> None:
+        """Wait for all frames to be written, and clean up the workers and
+        shared memory."""
+        try:
+            while self.pending:
+                self._collect(block=True)
+        finally:
+            self.pool.shutdown(wait=True)
+            self.ring.close()
+            self.ring.unlink()
@@ -12,12 +12,13 @@ from instamatic import config
 from instamatic.camera import Camera
 from instamatic.utils import high_precision_timers
 
+from .framing import array_header, recv_msg, send_array, send_msg, set_nodelay
 from .serializer import dumper, loader
 
 high_precision_timers.enable()
 
 if config.settings.cam_use_shared_memory:
-    from multiprocessing import shared_memory
+    from .shm_ring import SharedMemoryRing
 
 condition = threading.Condition()
 box = []
@@ -53,34 +54,56 @@ class CamServer(threading.Thread):
 
         self.verbose = False
 
-        self.buffers = {}
+        self.rings = {}
 
         self.use_shared_memory = config.settings.cam_use_shared_memory
+        self.shared_memory_slots = config.settings.cam_shared_memory_slots
         print('Use shared memory:', self.use_shared_memory)
 
     def setup_shared_buffer(self, arr):
-        """Set up shared memory buffer.
+        """Set up shared memory ring buffer.
 
-        Make a buffer for each binsize, and store the buffers to a dict.
+        Make a ring buffer for each image shape/dtype (binsize), and
+        store the buffers to a dict.
         """
-        self.shmem = shared_memory.SharedMemory(create=True, size=arr.nbytes)
-        buffer = np.ndarray(arr.shape, dtype=arr.dtype, buffer=self.shmem.buf)
-        self.buffers[arr.shape] = buffer
+        ring = SharedMemoryRing(arr.shape, arr.dtype, nslots=self.shared_memory_slots)
+        self.rings[arr.shape, arr.dtype] = ring
         if self.verbose:
-            print(f'Created new buffer: `{self.shmem.name}` | {arr.shape} ({arr.dtype})')
+            print(f'Created new buffer: {ring}')
 
-    def copy_data_to_shared_buffer(self, arr):
-        """Copy numpy image array to shared memory."""
-        if arr.shape not in self.buffers:
+    def copy_data_to_shared_buffer(self, arr, owner=None):
+        """Copy numpy image array to a free slot in shared memory.
+
+        Returns the info needed by the client to find the frame, or None
+        if all slots are held by clients.
+        """
+        if (arr.shape, arr.dtype) not in self.rings:
             self.setup_shared_buffer(arr)
 
-        buffer = self.buffers[arr.shape]
-        buffer[:] = arr[:]  # copy data to buffer
+        ring = self.rings[arr.shape, arr.dtype]
+        return ring.put(arr, owner=owner)
+
+    def release_shared_buffers(self, release=(), client_id=None):
+        """Hand back slots to the ring buffers.
+
+        `release` is a list of `(name, slot, seq)` returned by the
+        client for frames it no longer uses. If `client_id` is given,
+        all slots held by that client are released.
+        """
+        rings = {ring.name: ring for ring in self.rings.values()}
+        for name, slot, seq in release:
+            if name in rings:
+                rings[name].release(slot, seq)
+
+        if client_id is not None:
+            for ring in self.rings.values():
+                ring.release_owner(client_id)
 
     def run(self):
         """Start server thread."""
         self.cam = Camera(name=self._name, use_server=False)
         self.cam.get_attrs = self.get_attrs
+        self.cam.release_shared_buffers = self.release_shared_buffers
 
         print(f'Initialized camera: {self.cam.interface}')
 
@@ -94,6 +117,9 @@ class CamServer(threading.Thread):
                 args = cmd.get('args', ())
                 kwargs = cmd.get('kwargs', {})
 
+                if cmd.get('release'):
+                    self.release_shared_buffers(cmd['release'])
+
                 try:
                     ret = self.evaluate(attr_name, args, kwargs)
                     status = 200
@@ -104,14 +130,15 @@ class CamServer(threading.Thread):
                     ret = (e.__class__.__name__, e.args)
                     status = 500
                 else:
-                    if self.use_shared_memory:
-                        if attr_name == 'getImage':
-                            self.copy_data_to_shared_buffer(ret)
-                            ret = {
-                                'shape': ret.shape,
-                                'dtype': str(ret.dtype),
-                                'name': self.shmem.name,
-                            }
+                    # the client may opt out of shared memory, e.g. for remote connections
+                    use_shared_memory = self.use_shared_memory and cmd.get('shared_memory', True)
+                    if attr_name == 'getImage' and use_shared_memory:
+                        info = self.copy_data_to_shared_buffer(ret, owner=cmd.get('client_id'))
+                        if info:
+                            ret = info
+                        elif self.log:
+                            # all slots in use, fall back to sending the image over the socket
+                            self.log.warning('Shared memory buffer full, sending image over socket')
 
                 box.append((status, ret))
                 condition.notify()
@@ -145,25 +172,44 @@ class CamServer(threading.Thread):
 def handle(conn, q):
     """Handle incoming connection, put command on the Queue `q`, which is then
     handled by TEMServer."""
-    with conn:
-        while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
-                break
+    set_nodelay(conn)
 
-            data = loader(data)
+    client_id = id(conn)
 
-            if data == 'exit':
-                break
+    try:
+        with conn:
+            while True:
+                data = recv_msg(conn)
+                if not data:
+                    break
 
-            if data == 'kill':
-                break
+                data = loader(data)
 
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.sendall(dumper(response))
+                if data == 'exit':
+                    break
+
+                if data == 'kill':
+                    break
+
+                data['client_id'] = client_id
+
+                with condition:
+                    q.put(data)
+                    condition.wait()
+                    status, ret = box.pop()
+
+                if status == 200 and data['attr_name'] == 'getImage' and isinstance(ret, np.ndarray):
+                    # send the header in-band, followed by the raw image buffer
+                    send_msg(conn, dumper((status, array_header(ret))))
+                    send_array(conn, ret)
+                else:
+                    send_msg(conn, dumper((status, ret)))
+    finally:
+        # hand back any shared memory slots the client did not release
+        with condition:
+            q.put({'attr_name': 'release_shared_buffers', 'kwargs': {'client_id': client_id}})
+            condition.wait()
+            box.pop()
 
 
 def main():
@@ -176,13 +222,15 @@ This program initializes a connection to the camera as defined in the config. Th
 
 The host and port are defined in `config/settings.yaml`.
 
-The data sent over the socket is a pickled dictionary with the following elements:
+Every message sent over the socket is prefixed by its length (8 bytes, unsigned, big-endian). The data sent over the socket is a pickled dictionary with the following elements:
 
 - `attr_name`: Name of the function to call or attribute to return (str)
 - `args`: (Optional) List of arguments for the function (list)
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
+- `shared_memory`: (Optional) Set to False to receive images over the socket instead of shared memory (bool)
+- `release`: (Optional) List of shared memory slots `(name, slot, seq)` the client has finished with (list)
 
-The response is returned as a pickle object.
+The response is returned as a pickled tuple `(status, data)`. Image data are not pickled, instead `data` contains the shape and dtype of the array, and the raw image buffer follows as a separate length-prefixed message. With shared memory, images are written to a ring buffer of `cam_shared_memory_slots` frames, and `data` contains the name of the buffer and the slot/sequence number of the frame. A slot is not overwritten until the client releases it.
 """
 
     parser = argparse.ArgumentParser(
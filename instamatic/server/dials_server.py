@@ -1,24 +1,16 @@
-import ast
 import datetime
 import logging
 import subprocess as sp
-import sys
-import threading
 from pathlib import Path
-from socket import *
 
 from instamatic import config
+from instamatic.server.job_scheduler import JobScheduler, serve
 
-try:
-    EXE = Path(sys.argv[1])
-except BaseException:
-    EXE = Path(config.settings.dials_script)
-
+EXE = Path(config.settings.dials_script)
 CWD = EXE.parent
 
 HOST = config.settings.indexing_server_host
 PORT = config.settings.indexing_server_port
-BUFF = 1024
 
 
 def run_dials_indexing(data):
@@ -30,7 +22,7 @@ def run_dials_indexing(data):
     cmd = [str(EXE), path]
     date = datetime.datetime.now().strftime('%Y-%m-%d')
     fn = config.locations['logs'] / f'Dials_indexing_{date}.log'
-    unitcelloutput = []
+    unitcelloutput = b''
 
     p = sp.Popen(cmd, cwd=CWD, stdout=sp.PIPE)
     for line in p.stdout:
@@ -48,47 +40,17 @@ def run_dials_indexing(data):
             print(f'Indexing result written to dials indexing log file; path: {path}')
 
     p.wait()
-    unitcelloutput = []
     now = datetime.datetime.now().strftime('%H:%M:%S.%f')
     print(f'{now} | DIALS indexing has finished')
 
-
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-
-        if not data:
-            break
-
-        print(f'{now} | {data}')
-        if data == 'close':
-            print(f'{now} | Closing connection')
-            break
-
-        elif data == 'kill':
-            print(f'{now} | Killing server')
-            ret = 1
-            break
-
-        else:
-            conn.send(b'OK')
-            data = ast.literal_eval(data)
-            run_dials_indexing(data)
-
-    conn.send(b'Connection closed')
-    conn.close()
-    print('Connection closed')
-
-    return ret
+    return unitcelloutput.decode('utf-8').strip()
 
 
 def main():
     import argparse
 
+    global EXE, CWD
+
     description = f"""
 Starts a simple server to send indexing jobs to. Runs `{EXE}` for every job sent to it. Opens a socket on port {HOST}:{PORT}.
 
@@ -98,14 +60,31 @@ The data sent to the server is a dict containing the following elements:
 - `rotrange`: Total rotation range in degrees (float)
 - `nframes`: Number of data frames (int)
 - `osc`: Oscillation range in degrees (float)
+
+The jobs are queued and run by a pool of workers, the server replies with the job ID straight away.
+Use the `status`/`wait`/`jobs` commands to query the jobs (see `instamatic.server.job_scheduler`).
 """
 
     parser = argparse.ArgumentParser(
         description=description,
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
+    parser.add_argument('exe',
+                        type=str, nargs='?', metavar='EXE',
+                        help="""Indexing script to run (default: `dials_script` in `settings.yaml`)""")
+
+    parser.add_argument('-w', '--workers',
+                        action='store', type=int, dest='workers',
+                        help="""Number of indexing jobs to run in parallel (default: 2)""")
+
+    parser.set_defaults(workers=2)
+
     options = parser.parse_args()
 
+    if options.exe:
+        EXE = Path(options.exe)
+        CWD = EXE.parent
+
     date = datetime.datetime.now().strftime('%Y-%m-%d')
     logfile = config.locations['logs'] / f'instamatic_indexing_server_{date}.log'
     logging.basicConfig(format='%(asctime)s | %(module)s:%(lineno)s | %(levelname)s | %(message)s',
@@ -114,21 +93,15 @@ The data sent to the server is a dict containing the following elements:
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    s = socket(AF_INET, SOCK_STREAM)
-    s.bind((HOST, PORT))
-    s.listen(5)
+    database = config.locations['logs'] / 'instamatic_indexing_jobs_dials.sqlite'
+    scheduler = JobScheduler(run_dials_indexing, workers=options.workers, database=database)
 
-    log.info(f'Indexing server (DIALS) listening on {HOST}:{PORT}')
+    log.info(f'Indexing server (DIALS) listening on {HOST}:{PORT} ({options.workers} workers)')
     log.info(f'Running command: {EXE}')
-    print(f'Indexing server (DIALS) listening on {HOST}:{PORT}')
+    print(f'Indexing server (DIALS) listening on {HOST}:{PORT} ({options.workers} workers)')
     print(f'Running command: {EXE}')
 
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+    serve(scheduler, HOST, PORT)
 
 
 if __name__ == '__main__':
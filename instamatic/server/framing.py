@@ -0,0 +1,199 @@
+import socket
+import struct
+
+import numpy as np
+
+# Every message is prefixed with its length as an unsigned 64-bit int (network order)
+PREFIX = struct.Struct('!Q')
+
+# Below this size, the prefix and payload are joined and sent in one call
+SMALL_MESSAGE = 65536
+
+
+def set_nodelay(sock: socket.socket):
+    """Disable Nagle's algorithm, so that small request/response messages are
+    not held back waiting for an ACK."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+def recv_into_exactly(sock: socket.socket, buffer) -> None:
+    """Fill `buffer` (any writable object supporting the buffer protocol)
+    completely with data from `sock`."""
+    view = memoryview(buffer).cast('B')
+    size = len(view)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:], size - pos)
+        if n == 0:
+            raise ConnectionError(f'Connection closed after {pos} of {size} bytes')
+        pos += n
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    """Receive exactly `size` bytes from `sock`."""
+    buffer = bytearray(size)
+    recv_into_exactly(sock, buffer)
+    return buffer
+
+
+def _nbytes(data) -> int:
+    return memoryview(data).nbytes
+
+
+def send_msg(sock: socket.socket, data) -> None:
+    """Send `data` as a single length-prefixed message.
+
+    `data` can also be a list of buffers, which are sent one after the
+    other as a single message, so they do not have to be joined first.
+    """
+    if isinstance(data, (list, tuple)):
+        parts = data
+    else:
+        parts = (data,)
+
+    size = sum(_nbytes(part) for part in parts)
+    prefix = PREFIX.pack(size)
+
+    if size < SMALL_MESSAGE:
+        sock.sendall(b''.join((prefix, *parts)))
+    else:
+        sock.sendall(prefix)
+        for part in parts:
+            sock.sendall(part)
+
+
+def recv_msg(sock: socket.socket) -> bytearray:
+    """Receive a single length-prefixed message.
+
+    Returns an empty bytes object if the connection was closed cleanly
+    before a new message started. The message is returned as a
+    bytearray, so that it can be used as a buffer without copying.
+    """
+    prefix = bytearray(PREFIX.size)
+    view = memoryview(prefix)
+
+    n = sock.recv_into(view)
+    if n == 0:
+        return b''
+    if n < PREFIX.size:
+        recv_into_exactly(sock, view[n:])
+
+    size, = PREFIX.unpack(prefix)
+    return recv_exactly(sock, size)
+
+
+def array_header(arr: np.ndarray) -> dict:
+    """Describe `arr` so that the receiving side can preallocate it."""
+    return {
+        'shape': tuple(arr.shape),
+        'dtype': str(arr.dtype),
+    }
+
+
+def send_array(sock: socket.socket, arr: np.ndarray) -> None:
+    """Send the raw data buffer of `arr` as a length-prefixed message.
+
+    The array header (shape/dtype) must be communicated separately, see
+    `array_header`. No copy is made for C-contiguous arrays.
+    """
+    arr = np.ascontiguousarray(arr)
+    sock.sendall(PREFIX.pack(arr.nbytes))
+    if arr.nbytes:
+        sock.sendall(memoryview(arr.reshape(-1)).cast('B'))
+
+
+def recv_array(sock: socket.socket, shape: tuple, dtype: str, out: np.ndarray = None) -> np.ndarray:
+    """Receive a raw array buffer sent by `send_array` directly into a
+    preallocated array of the given `shape` and `dtype`.
+
+    If `out` is given, the data are written into it (it must be
+    C-contiguous and match shape/dtype).
+    """
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != tuple(shape) or out.dtype != np.dtype(dtype) or not out.flags.c_contiguous:
+        raise ValueError(f'Output buffer does not match {shape} ({dtype})')
+
+    size, = PREFIX.unpack(recv_exactly(sock, PREFIX.size))
+    if size != out.nbytes:
+        raise ConnectionError(f'Expected {out.nbytes} bytes for array {shape} ({dtype}), got {size}')
+
+    if size:
+        recv_into_exactly(sock, out.reshape(-1))
+
+    return out
+
+
+# asyncio versions, these operate on non-blocking sockets through the event loop
+
+
+async def async_recv_into_exactly(loop, sock: socket.socket, buffer) -> None:
+    """Fill `buffer` completely with data from `sock` (asyncio)."""
+    view = memoryview(buffer).cast('B')
+    size = len(view)
+    pos = 0
+    while pos < size:
+        n = await loop.sock_recv_into(sock, view[pos:])
+        if n == 0:
+            raise ConnectionError(f'Connection closed after {pos} of {size} bytes')
+        pos += n
+
+
+async def async_send_msg(loop, sock: socket.socket, data) -> None:
+    """Send `data` (or a list of buffers) as a single length-prefixed
+    message (asyncio)."""
+    if isinstance(data, (list, tuple)):
+        parts = data
+    else:
+        parts = (data,)
+
+    size = sum(_nbytes(part) for part in parts)
+    prefix = PREFIX.pack(size)
+
+    if size < SMALL_MESSAGE:
+        await loop.sock_sendall(sock, b''.join((prefix, *parts)))
+    else:
+        await loop.sock_sendall(sock, prefix)
+        for part in parts:
+            await loop.sock_sendall(sock, part)
+
+
+async def async_recv_msg(loop, sock: socket.socket) -> bytearray:
+    """Receive a single length-prefixed message (asyncio).
+
+    Returns an empty bytes object if the connection was closed cleanly
+    before a new message started.
+    """
+    prefix = bytearray(PREFIX.size)
+    view = memoryview(prefix)
+
+    n = await loop.sock_recv_into(sock, view)
+    if n == 0:
+        return b''
+    if n < PREFIX.size:
+        await async_recv_into_exactly(loop, sock, view[n:])
+
+    size, = PREFIX.unpack(prefix)
+    buffer = bytearray(size)
+    await async_recv_into_exactly(loop, sock, buffer)
+    return buffer
+
+
+async def async_recv_array(loop, sock: socket.socket, shape: tuple, dtype: str) -> np.ndarray:
+    """Receive a raw array buffer sent by `send_array` directly into a newly
+    allocated array (asyncio)."""
+    out = np.empty(shape, dtype=dtype)
+
+    prefix = bytearray(PREFIX.size)
+    await async_recv_into_exactly(loop, sock, prefix)
+    size, = PREFIX.unpack(prefix)
+    if size != out.nbytes:
+        raise ConnectionError(f'Expected {out.nbytes} bytes for array {shape} ({dtype}), got {size}')
+
+    if size:
+        await async_recv_into_exactly(loop, sock, out.reshape(-1))
+
+    return out
@@ -9,7 +9,8 @@ import traceback
 from instamatic import config
 from instamatic.goniotool import GonioToolWrapper
 
-from .serializer import dumper, loader
+from .serializer import goniotool_dumper as dumper
+from .serializer import goniotool_loader as loader
 
 barrier = threading.Barrier(2, timeout=60)
 
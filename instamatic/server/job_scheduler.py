@@ -0,0 +1,301 @@
+import ast
+import datetime
+import itertools
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from socket import *
+
+BUFF = 1024
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+FINISHED = (DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    result TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+"""
+
+COLUMNS = ('id', 'priority', 'status', 'data', 'result', 'submitted', 'started', 'finished')
+
+log = logging.getLogger(__name__)
+
+
+class JobScheduler:
+    """Run jobs in a bounded pool of worker threads, in order of priority.
+
+    Every job is passed to `func(data)`, which is expected to run the
+    heavy lifting in a subprocess (e.g. XDS or DIALS), so that `workers`
+    jobs run in parallel. The jobs are stored in a SQLite `database`, so
+    that the queue survives a restart of the server: jobs that were
+    queued or running are queued again when the scheduler starts.
+
+    Jobs with a higher `priority` are run first, jobs with the same
+    priority in the order they were submitted.
+
+    Usage:
+        scheduler = JobScheduler(run_xds_indexing, workers=4, database='jobs.sqlite')
+        job_id = scheduler.submit('path/to/data', priority=1)
+        scheduler.get(job_id)['status']
+    """
+
+    def __init__(self, func, workers: int = 2, database: str = ':memory:'):
+        super().__init__()
+
+        self.func = func
+        self.nworkers = workers
+
+        self._db = sqlite3.connect(str(database), check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+        self._lock = threading.RLock()
+        self._finished = threading.Condition(self._lock)
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+
+        self._restore()
+
+        self._workers = [threading.Thread(target=self._worker, name=f'JobWorker-{i}', daemon=True) for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _execute(self, query: str, args: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._db.execute(query, args)
+            self._db.commit()
+        return cursor
+
+    def _restore(self) -> None:
+        """Queue the jobs that were not finished when the scheduler was last
+        stopped."""
+        rows = self._execute('SELECT id, priority FROM jobs WHERE status IN (?, ?) ORDER BY id', (QUEUED, RUNNING)).fetchall()
+        self._execute('UPDATE jobs SET status = ?, started = NULL WHERE status = ?', (QUEUED, RUNNING))
+        for job_id, priority in rows:
+            self._queue.put((-priority, next(self._counter), job_id))
+        if rows:
+            log.info('Restored %d unfinished jobs', len(rows))
+
+    def submit(self, data, priority: int = 0) -> int:
+        """Queue a job and return its ID, returns immediately.
+
+        `data` must be JSON serializable.
+        """
+        cursor = self._execute('INSERT INTO jobs (priority, status, data, submitted) VALUES (?, ?, ?, ?)',
+                               (priority, QUEUED, json.dumps(data), time.time()))
+        job_id = cursor.lastrowid
+        self._queue.put((-priority, next(self._counter), job_id))
+        log.info('Job %d submitted (priority %d): %s', job_id, priority, data)
+        return job_id
+
+    @staticmethod
+    def _to_dict(row) -> dict:
+        job = dict(zip(COLUMNS, row))
+        job['data'] = json.loads(job['data'])
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    def get(self, job_id: int) -> dict:
+        """Return the job as a dict (status, data, result, timestamps), or
+        None if it does not exist."""
+        row = self._execute(f'SELECT {", ".join(COLUMNS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def jobs(self, status: str = None) -> list:
+        """Return all jobs, or only the jobs with the given `status`."""
+        if status is None:
+            rows = self._execute(f'SELECT {", ".join(COLUMNS)} FROM jobs ORDER BY id').fetchall()
+        else:
+            rows = self._execute(f'SELECT {", ".join(COLUMNS)} FROM jobs WHERE status = ? ORDER BY id', (status,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def wait(self, job_id: int, timeout: float = None) -> dict:
+        """Wait until the job has finished, and return it."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._finished:
+            while True:
+                job = self.get(job_id)
+                if job is None or job['status'] in FINISHED:
+                    return job
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._finished.wait(timeout=remaining)
+
+    def _worker(self) -> None:
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                break
+
+            job = self.get(job_id)
+            self._execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?', (RUNNING, time.time(), job_id))
+            log.info('Job %d started', job_id)
+
+            try:
+                result = self.func(job['data'])
+                status = DONE
+            except Exception as e:
+                log.exception('Job %d failed', job_id)
+                result = f'{e.__class__.__name__}: {e}'
+                status = FAILED
+
+            with self._finished:
+                self._execute('UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ?',
+                              (status, json.dumps(result, default=str), time.time(), job_id))
+                self._finished.notify_all()
+            log.info('Job %d %s', job_id, status)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers after their current job, queued jobs are kept in
+        the database."""
+        for _ in self._workers:
+            self._queue.put((float('-inf'), next(self._counter), None))
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            with self._lock:
+                self._db.close()
+
+
+def parse_payload(data: str):
+    """Parse the job data sent by a client: a dict/list (JSON or python
+    literal), or else the plain string (e.g. a path)."""
+    try:
+        return json.loads(data)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(data)
+    except (ValueError, SyntaxError):
+        return data
+
+
+def handle_request(scheduler: JobScheduler, request: dict) -> dict:
+    """Handle a command sent as a JSON dict with a `command` key:
+
+    - `submit`: queue `data` with `priority` (default: 0), returns `job_id`
+    - `status`/`result`: return the job with `job_id`
+    - `wait`: wait for the job with `job_id` to finish (max `timeout` s)
+    - `jobs`: list all jobs (optionally with `status`)
+    """
+    command = request.get('command')
+
+    if command == 'submit':
+        job_id = scheduler.submit(request['data'], priority=request.get('priority', 0))
+        return {'job_id': job_id}
+    elif command in ('status', 'result'):
+        job = scheduler.get(request['job_id'])
+        return job if job else {'error': f'No such job: {request["job_id"]}'}
+    elif command == 'wait':
+        job = scheduler.wait(request['job_id'], timeout=request.get('timeout'))
+        return job if job else {'error': f'No such job: {request["job_id"]}'}
+    elif command == 'jobs':
+        return {'jobs': scheduler.jobs(status=request.get('status'))}
+    else:
+        return {'error': f'Unknown command: {command!r}'}
+
+
+def handle(conn, scheduler: JobScheduler):
+    """Handle incoming connection.
+
+    Commands are sent as JSON dicts (see `handle_request`), and answered
+    with a JSON dict. Anything else is submitted as a job with the
+    default priority, and answered with `OK, job <id> submitted`.
+    """
+    ret = 0
+
+    while True:
+        data = conn.recv(BUFF).decode()
+        now = datetime.datetime.now().strftime('%H:%M:%S.%f')
+
+        if not data:
+            break
+
+        print(f'{now} | {data}')
+        if data == 'close':
+            print(f'{now} | Closing connection')
+            break
+
+        elif data == 'kill':
+            print(f'{now} | Killing server')
+            ret = 1
+            break
+
+        payload = parse_payload(data)
+
+        if isinstance(payload, dict) and 'command' in payload:
+            try:
+                reply = handle_request(scheduler, payload)
+            except KeyError as e:
+                reply = {'error': f'Missing key: {e}'}
+            conn.send(json.dumps(reply, default=str).encode())
+        else:
+            job_id = scheduler.submit(payload)
+            conn.send(f'OK, job {job_id} submitted'.encode())
+
+    conn.send(b'Connection closed')
+    conn.close()
+    print('Connection closed')
+
+    return ret
+
+
+def serve(scheduler: JobScheduler, host: str, port: int) -> None:
+    """Listen on `host`:`port`, and handle every connection in a
+    thread."""
+    s = socket(AF_INET, SOCK_STREAM)
+    s.bind((host, port))
+    s.listen(5)
+
+    with s:
+        while True:
+            conn, addr = s.accept()
+            log.info('Connected by %s', addr)
+            print('Connected by', addr)
+            threading.Thread(target=handle, args=(conn, scheduler)).start()
+
+
+def send_request(request: dict, host: str, port: int) -> dict:
+    """Send a command to a job server, and return the reply.
+
+    Raises ConnectionError if the server closes the connection before
+    the reply is complete.
+    """
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.connect((host, port))
+        s.send(json.dumps(request).encode())
+
+        # the reply is sent in one go, but may arrive in parts
+        reply = b''
+        while True:
+            data = s.recv(BUFF)
+            if not data:
+                raise ConnectionError(f'Job server at {host}:{port} closed the connection before replying')
+            reply += data
+            try:
+                reply = json.loads(reply)
+            except ValueError:
+                continue
+            else:
+                break
+
+        s.send(b'close')
+    return reply
@@ -1,6 +1,8 @@
 import json
 import pickle
+import struct
 
+import numpy as np
 import yaml
 
 from instamatic.config import settings
@@ -12,6 +14,11 @@ PROTOCOL = settings.tem_communication_protocol
 # - json:    320 µs ± 55.8 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
 # - msgpack: 512 µs ± 27.2 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
 # - yaml:   4.43 ms ± 13.7 µs per loop (mean ± std. dev. of 7 runs, 1000 loops each)
+#
+# Run `python scripts/benchmark_serializer.py` to time each protocol for different payloads
+
+# msgpack ext type code for numpy arrays
+NDARRAY_EXT = 1
 
 
 def json_loader(data):
@@ -38,11 +45,42 @@ def pickle_dumper(data):
     return pickle.dumps(data)
 
 
+def pickle5_loader(data):
+    """Load data written by `pickle5_dumper`, the arrays are reconstructed
+    as views on `data` without copying."""
+    view = memoryview(data)
+    n, = struct.unpack_from('!I', view)
+    sizes = struct.unpack_from(f'!{n + 1}Q', view, 4)
+
+    offset = 4 + 8 * (n + 1)
+    parts = []
+    for size in sizes:
+        parts.append(view[offset:offset + size])
+        offset += size
+
+    payload, buffers = parts[0], parts[1:]
+    return pickle.loads(payload, buffers=buffers)
+
+
+def pickle5_dumper(data):
+    """Pickle with protocol 5, with the data of numpy arrays stored out-of-
+    band. Returns a list of buffers (header, pickle stream, and the raw
+    array buffers), which can be sent using `framing.send_msg` without
+    joining them."""
+    buffers = []
+    payload = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    raw = [buffer.raw() for buffer in buffers]
+
+    header = struct.pack(f'!I{len(raw) + 1}Q', len(raw), len(payload), *(r.nbytes for r in raw))
+    return [header, payload, *raw]
+
+
 try:
     import msgpack
 except ImportError:
-    if PROTOCOL == 'msgpack':
+    if PROTOCOL in ('msgpack', 'msgpack_numpy'):
         raise
+    msgpack = None
 else:
     def msgpack_loader(data):
         return msgpack.loads(data)
@@ -50,18 +88,107 @@ else:
     def msgpack_dumper(data):
         return msgpack.dumps(data)
 
-
-if PROTOCOL == 'json':
-    loader = json_loader
-    dumper = json_dumper
-elif PROTOCOL == 'pickle':
-    loader = pickle_loader
-    dumper = pickle_dumper
-elif PROTOCOL == 'yaml':
-    loader = yaml_loader
-    dumper = yaml_dumper
-elif PROTOCOL == 'msgpack':
-    loader = msgpack_loader
-    dumper = msgpack_dumper
-else:
-    raise ValueError(f'No such protocol: `{PROTOCOL}`')
+    def _encode_ndarray(obj):
+        if isinstance(obj, np.ndarray):
+            obj = np.ascontiguousarray(obj)
+            header = msgpack.dumps((obj.dtype.str, obj.shape))
+            return msgpack.ExtType(NDARRAY_EXT, header + obj.tobytes())
+        elif isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f'Cannot serialize object of type {type(obj)}')
+
+    def _decode_ext(code, data):
+        if code == NDARRAY_EXT:
+            unpacker = msgpack.Unpacker()
+            unpacker.feed(data)
+            dtype, shape = unpacker.unpack()
+            offset = unpacker.tell()
+            return np.frombuffer(memoryview(data)[offset:], dtype=dtype).reshape(shape)
+        return msgpack.ExtType(code, data)
+
+    def msgpack_numpy_loader(data):
+        """Load msgpack data, arrays are returned as (read-only) views on the
+        received data."""
+        return msgpack.loads(data, ext_hook=_decode_ext)
+
+    def msgpack_numpy_dumper(data):
+        """Dump to msgpack, numpy arrays are stored as an ext type (dtype,
+        shape, raw data).
+
+        This is not zero-copy: msgpack requires the ext data as `bytes`,
+        and packs everything into its own buffer, so the array data are
+        copied while dumping. Use `pickle5` to send arrays without copying.
+        """
+        return msgpack.dumps(data, default=_encode_ndarray)
+
+
+# Available protocols: name -> (loader, dumper)
+PROTOCOLS = {
+    'pickle': (pickle_loader, pickle_dumper),
+    'json': (json_loader, json_dumper),
+    'yaml': (yaml_loader, yaml_dumper),
+}
+
+if pickle.HIGHEST_PROTOCOL >= 5:
+    PROTOCOLS['pickle5'] = (pickle5_loader, pickle5_dumper)
+
+if msgpack:
+    PROTOCOLS['msgpack'] = (msgpack_loader, msgpack_dumper)
+    PROTOCOLS['msgpack_numpy'] = (msgpack_numpy_loader, msgpack_numpy_dumper)
+
+
+def get_serializer(protocol: str) -> tuple:
+    """Return the `(loader, dumper)` for `protocol`."""
+    try:
+        return PROTOCOLS[protocol]
+    except KeyError:
+        raise ValueError(f'No such protocol: `{protocol}`') from None
+
+
+def negotiate(offered: list) -> str:
+    """Pick the first protocol from `offered` that is available."""
+    for protocol in offered:
+        if protocol in PROTOCOLS:
+            return protocol
+    raise ValueError(f'None of the protocols are available: {offered}')
+
+
+def handshake(offered: list = None) -> bytes:
+    """Message to open a connection, offering `offered` protocols (in order
+    of preference).
+
+    The handshake is always json encoded.
+    """
+    if not offered:
+        offered = [PROTOCOL] + [protocol for protocol in ('pickle', 'json') if protocol != PROTOCOL]
+    offered = [protocol for protocol in offered if protocol in PROTOCOLS]
+    return json_dumper({'protocols': offered})
+
+
+def parse_handshake(data) -> list:
+    """Return the offered protocols if `data` is a handshake message, else
+    None."""
+    try:
+        dct = json_loader(data)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if isinstance(dct, dict) and 'protocols' in dct:
+        return dct['protocols']
+    return None
+
+
+def parse_handshake_reply(data) -> str:
+    """Return the protocol selected by the server in reply to `handshake`."""
+    dct = json_loader(data)
+    if 'error' in dct:
+        raise ValueError(dct['error'])
+    return dct['protocol']
+
+
+loader, dumper = get_serializer(PROTOCOL)
+
+# The goniotool link sends every message with a single `send`, so it is
+# limited to the protocols that dump to a single bytes object
+GONIOTOOL_PROTOCOLS = ('pickle', 'json', 'yaml', 'msgpack')
+
+goniotool_loader, goniotool_dumper = get_serializer(PROTOCOL if PROTOCOL in GONIOTOOL_PROTOCOLS else 'pickle')
@@ -0,0 +1,125 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedMemoryRing:
+    """Ring buffer of `nslots` images of the same shape/dtype in a single
+    shared memory block.
+
+    The server writes each new frame to a free slot with `put`, which
+    tags it with an increasing sequence number and marks it as owned by
+    the requesting client. The slot is not reused until the client hands
+    it back with `release`, so a client can hold on to several frames
+    without them being overwritten by the next acquisition.
+
+    Clients connect to an existing ring using `SharedMemoryRing.attach`.
+    """
+
+    def __init__(self, shape: tuple, dtype: str, nslots: int = 8, name: str = None):
+        super().__init__()
+
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.nslots = nslots
+
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize * nslots
+
+        if name:
+            self.shm = shared_memory.SharedMemory(name=name)
+        else:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+
+        self.frames = np.ndarray((nslots, *self.shape), dtype=self.dtype, buffer=self.shm.buf)
+
+        # only used on the server side
+        self._seq = 0
+        self._next = 0
+        self._slot_seq = [None] * nslots
+        self._slot_owner = [None] * nslots
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(name={self.name!r}, shape={self.shape}, dtype={self.dtype}, nslots={self.nslots})'
+
+    @classmethod
+    def attach(cls, name: str, shape: tuple, dtype: str, nslots: int, **kwargs):
+        """Attach to an existing ring buffer created by the server."""
+        return cls(shape=shape, dtype=dtype, nslots=nslots, name=name)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def n_free(self) -> int:
+        """Number of slots available for writing."""
+        return self._slot_seq.count(None)
+
+    def info(self) -> dict:
+        """Description of the ring buffer for clients to attach to it."""
+        return {
+            'name': self.name,
+            'shape': self.shape,
+            'dtype': str(self.dtype),
+            'nslots': self.nslots,
+        }
+
+    def put(self, arr: np.ndarray, owner=None) -> dict:
+        """Copy `arr` to the next free slot.
+
+        Returns the info dict with the `slot` and `seq` of the frame, or
+        None if all slots are still held by clients.
+        """
+        for i in range(self.nslots):
+            slot = (self._next + i) % self.nslots
+            if self._slot_seq[slot] is None:
+                break
+        else:
+            return None
+
+        self.frames[slot] = arr
+
+        self._seq += 1
+        self._slot_seq[slot] = self._seq
+        self._slot_owner[slot] = owner
+        self._next = (slot + 1) % self.nslots
+
+        info = self.info()
+        info['slot'] = slot
+        info['seq'] = self._seq
+        return info
+
+    def release(self, slot: int, seq: int) -> bool:
+        """Hand slot `slot` back to the server.
+
+        The sequence number must match, so that stale releases cannot
+        free a slot that has been handed out again.
+        """
+        if self._slot_seq[slot] != seq:
+            return False
+        self._slot_seq[slot] = None
+        self._slot_owner[slot] = None
+        return True
+
+    def release_owner(self, owner) -> int:
+        """Release all slots held by `owner`, i.e. after the client
+        disconnected.
+
+        Returns the number of slots released.
+        """
+        n = 0
+        for slot in range(self.nslots):
+            if self._slot_seq[slot] is not None and self._slot_owner[slot] == owner:
+                self._slot_seq[slot] = None
+                self._slot_owner[slot] = None
+                n += 1
+        return n
+
+    def close(self):
+        """Release the numpy view and close the shared memory block."""
+        self.frames = None
+        self.shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block (server side)."""
+        self.shm.unlink()
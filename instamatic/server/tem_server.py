@@ -5,20 +5,93 @@ import pickle
 import queue
 import socket
 import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 from instamatic import config
 from instamatic.TEMController import Microscope
 
-from .serializer import dumper, loader
-
-condition = threading.Condition()
-box = []
+from .framing import recv_msg, send_msg, set_nodelay
+from .serializer import dumper, get_serializer, json_dumper, loader, negotiate, parse_handshake
 
 HOST = config.settings.tem_server_host
 PORT = config.settings.tem_server_port
 BUFSIZE = 1024
 
+# Number of threads that evaluate read-only commands concurrently
+N_WORKERS = 4
+
+# Commands with these prefixes do not change the state of the microscope
+READ_ONLY_PREFIXES = ('get', 'is')
+
+# Microscope interfaces that talk to the microscope through COM
+COM_INTERFACES = ('jeol', 'fei', 'fei_simu')
+
+
+def is_read_only(func_name: str) -> bool:
+    """Check whether `func_name` only reads from the microscope."""
+    return func_name.startswith(READ_ONLY_PREFIXES)
+
+
+class ClientConnection:
+    """Wraps the socket connection to a single client.
+
+    Responses are sent back tagged with the id of the request, so that
+    they can be matched up on the client side, regardless of the order
+    in which they complete. The serializer is negotiated per connection,
+    see `negotiate_protocol`.
+    """
+
+    def __init__(self, conn, log=None):
+        super().__init__()
+
+        self.conn = conn
+        self.log = log
+        self.lock = threading.Lock()
+
+        self.loader = loader
+        self.dumper = dumper
+
+    def negotiate_protocol(self, offered: list):
+        """Select the first protocol from `offered` that the server supports,
+        and send the choice back to the client."""
+        try:
+            protocol = negotiate(offered)
+        except ValueError as e:
+            send_msg(self.conn, json_dumper({'error': str(e)}))
+            raise
+
+        self.loader, self.dumper = get_serializer(protocol)
+        send_msg(self.conn, json_dumper({'protocol': protocol}))
+
+        if self.log:
+            self.log.info('Using protocol: %s', protocol)
+
+    def reply(self, request_id, status: int, data, duration: float):
+        """Send the response for request `request_id` to the client."""
+        response = {
+            'id': request_id,
+            'status': status,
+            'data': data,
+            'duration': duration,
+        }
+
+        try:
+            message = self.dumper(response)
+        except Exception as e:
+            response['status'] = 500
+            response['data'] = (e.__class__.__name__, (f'Cannot serialize response: {e}',))
+            message = self.dumper(response)
+
+        with self.lock:
+            try:
+                send_msg(self.conn, message)
+            except OSError:
+                # client has disconnected
+                if self.log:
+                    self.log.warning('Could not send response for request %s, connection closed', request_id)
+
 
 class TemServer(threading.Thread):
     """TEM communcation server.
@@ -28,9 +101,15 @@ class TemServer(threading.Thread):
     microscope. Start the server using `TemServer.run` which will wait
     for items to appear on `q` and execute them on the specified
     microscope instance.
+
+    Commands that change the state of the microscope are executed one
+    at a time in the order they arrive on `q`. Read-only commands
+    (`get*`/`is*`) are evaluated on a pool of `nworkers` threads, so
+    that they do not have to wait for a long running command, such as
+    a stage movement, to finish.
     """
 
-    def __init__(self, log=None, q=None, name=None):
+    def __init__(self, log=None, q=None, name=None, nworkers: int = N_WORKERS):
         super().__init__()
 
         self.log = log
@@ -41,35 +120,107 @@ class TemServer(threading.Thread):
 
         self.verbose = False
 
+        self.ready = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=nworkers, thread_name_prefix='TemServerWorker', initializer=self._init_worker)
+
+        self.statistics = {}
+        self._statistics_lock = threading.Lock()
+
+    def _init_worker(self):
+        """Initialize COM on the worker threads, the microscope objects are
+        created in the multithreaded apartment, so the workers must join
+        it before they can call the COM interface."""
+        self.ready.wait()
+        if config.settings.simulate or config.microscope.interface not in COM_INTERFACES:
+            return
+
+        import comtypes
+        try:
+            comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+        except OSError:
+            comtypes.CoInitialize()
+
     def run(self):
         """Start the server thread."""
         self.tem = Microscope(name=self._name, use_server=False)
+        self.tem.get_call_statistics = self.get_call_statistics
         print(f'Initialized connection to microscope: {self.tem.name}')
 
+        self.ready.set()
+
         while True:
+            cmd, client, received = self.q.get()
+            self.execute(cmd, client, received)
+
+    def submit(self, cmd: dict, client: ClientConnection):
+        """Schedule command `cmd` from `client` for evaluation.
+
+        Read-only commands are evaluated concurrently, unless the client
+        sets `ordered`, in which case they are queued behind the
+        state-changing commands. A batch is evaluated concurrently only
+        if all commands in it are read-only.
+        """
+        received = time.perf_counter()
+
+        if 'batch' in cmd:
+            read_only = all(is_read_only(item['func_name']) for item in cmd['batch'])
+        else:
+            read_only = is_read_only(cmd['func_name'])
+
+        if read_only and not cmd.get('ordered', False):
+            self.pool.submit(self.execute, cmd, client, received)
+        else:
+            self.q.put((cmd, client, received))
+
+    def execute(self, cmd: dict, client: ClientConnection, received: float):
+        """Evaluate `cmd` (or each command in a batch) and send the response
+        back to `client`."""
+        self.ready.wait()
+
+        t0 = time.perf_counter()
+
+        if 'batch' in cmd:
+            # the results are returned as a list of (status, data)
+            ret = [self.evaluate_cmd(item, wait=t0 - received) for item in cmd['batch']]
+            status = 200
+        else:
+            status, ret = self.evaluate_cmd(cmd, wait=t0 - received)
+
+        t1 = time.perf_counter()
+
+        client.reply(cmd.get('id'), status, ret, duration=t1 - t0)
+
+    def evaluate_cmd(self, cmd: dict, wait: float = 0.0) -> tuple:
+        """Evaluate a single command, and return the status and the return
+        value (or the error)."""
+        func_name = cmd['func_name']
+        args = cmd.get('args', ())
+        kwargs = cmd.get('kwargs', {})
+
+        t0 = time.perf_counter()
+
+        try:
+            ret = self.evaluate(func_name, args, kwargs)
+            status = 200
+        except Exception as e:
+            traceback.print_exc()
+            if self.log:
+                self.log.exception(e)
+            ret = (e.__class__.__name__, e.args)
+            status = 500
+
+        t1 = time.perf_counter()
+
+        self.update_statistics(func_name, wait=wait, duration=t1 - t0)
+
+        if self.log:
+            self.log.debug('%s %s: %.1f ms (waited %.1f ms)', status, func_name, 1000 * (t1 - t0), 1000 * wait)
+
+        if self.verbose:
             now = datetime.datetime.now().strftime('%H:%M:%S.%f')
+            print(f'{now} | {status} {func_name}: {ret} ({1000 * (t1 - t0):.1f} ms)')
 
-            cmd = self.q.get()
-
-            with condition:
-                func_name = cmd['func_name']
-                args = cmd.get('args', ())
-                kwargs = cmd.get('kwargs', {})
-
-                try:
-                    ret = self.evaluate(func_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = (e.__class__.__name__, e.args)
-                    status = 500
-
-                box.append((status, ret))
-                condition.notify()
-                if self.verbose:
-                    print(f'{now} | {status} {func_name}: {ret}')
+        return status, ret
 
     def evaluate(self, func_name: str, args: list, kwargs: dict):
         """Evaluate the function `func_name` on `self.tem` and call it with
@@ -79,17 +230,56 @@ class TemServer(threading.Thread):
         ret = f(*args, **kwargs)
         return ret
 
+    def update_statistics(self, func_name: str, wait: float, duration: float):
+        """Keep track of the number of calls, and the time spent waiting and
+        evaluating for each function."""
+        with self._statistics_lock:
+            stats = self.statistics.setdefault(func_name, {'calls': 0, 'wait': 0.0, 'duration': 0.0, 'max_duration': 0.0})
+            stats['calls'] += 1
+            stats['wait'] += wait
+            stats['duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+
+    def get_call_statistics(self) -> dict:
+        """Return the number of calls, mean waiting time and mean/max
+        evaluation time (in seconds) for each function called on the
+        server."""
+        with self._statistics_lock:
+            return {
+                func_name: {
+                    'calls': stats['calls'],
+                    'mean_wait': stats['wait'] / stats['calls'],
+                    'mean_duration': stats['duration'] / stats['calls'],
+                    'max_duration': stats['max_duration'],
+                }
+                for func_name, stats in self.statistics.items()
+            }
+
+
+def handle(conn, server):
+    """Handle incoming connection, pass commands on to `server`, which sends
+    the responses back as they come in."""
+    set_nodelay(conn)
+
+    client = ClientConnection(conn, log=server.log)
 
-def handle(conn, q):
-    """Handle incoming connection, put command on the Queue `q`, which is then
-    handled by TEMServer."""
     with conn:
+        first = True
+
         while True:
-            data = conn.recv(BUFSIZE)
+            data = recv_msg(conn)
             if not data:
                 break
 
-            data = loader(data)
+            if first:
+                # the client may open with a handshake to select the protocol
+                first = False
+                offered = parse_handshake(data)
+                if offered is not None:
+                    client.negotiate_protocol(offered)
+                    continue
+
+            data = client.loader(data)
 
             if data == 'exit':
                 break
@@ -97,11 +287,7 @@ def handle(conn, q):
             if data == 'kill':
                 break
 
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.send(dumper(response))
+            server.submit(data, client)
 
 
 def main():
@@ -120,13 +306,19 @@ This program initializes a connection to the TEM as defined in the config. On so
 
 The host and port are defined in `config/settings.yaml`.
 
-The data sent over the socket is a serialized dictionary with the following elements:
+Every message sent over the socket is prefixed by its length (8 bytes, unsigned, big-endian). The client may open the connection with a json encoded handshake `{"protocols": [...]}`, listing the serialization protocols it supports in order of preference, the server replies with `{"protocol": ...}`. Otherwise, the protocol defined in the settings is used. The data sent over the socket is a serialized dictionary with the following elements:
 
 - `func_name`: Name of the function to call (str)
 - `args`: (Optional) List of arguments for the function (list)
 - `kwargs`: (Optiona) Dictionary of keyword arguments for the function (dict)
+- `id`: (Optional) Request id, which is returned with the response
+- `ordered`: (Optional) Evaluate a read-only command in order with the state-changing commands (bool)
+
+Instead of `func_name`/`args`/`kwargs`, a request may contain `batch`, a list of commands (dicts with `func_name`/`args`/`kwargs`), which are evaluated in order. The `data` returned is then a list of `(status, data)` for each command.
+
+The response is returned as a serialized dictionary with the elements `id`, `status` (200 or 500), `data` (the return value or the error), and `duration` (evaluation time in seconds).
 
-The response is returned as a serialized object.
+Multiple clients can connect at the same time. Commands that change the state of the microscope are executed one at a time. Read-only commands (`get*`/`is*`) are executed concurrently, e.g. the stage position can be read while the stage is moving. Responses may therefore arrive in a different order than the requests were sent, and should be matched using the request id.
 """
 
     parser = argparse.ArgumentParser(
@@ -165,7 +357,7 @@ The response is returned as a serialized object.
             conn, addr = s.accept()
             log.info('Connected by %s', addr)
             print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn, q)).start()
+            threading.Thread(target=handle, args=(conn, tem_reader)).start()
 
 
 if __name__ == '__main__':
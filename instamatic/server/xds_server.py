@@ -3,13 +3,12 @@ import logging
 import subprocess as sp
 import threading
 from pathlib import Path
-from socket import *
 
 from instamatic import config
+from instamatic.server.job_scheduler import JobScheduler, serve
 
 HOST = config.settings.indexing_server_host
 PORT = config.settings.indexing_server_port
-BUFF = 1024
 
 rlock = threading.RLock()
 
@@ -59,37 +58,11 @@ def run_xds_indexing(path):
     return msg
 
 
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        now = datetime.datetime.now().strftime('%H:%M:%S.%f')
-
-        if not data:
-            break
-
-        print(f'{now} | {data}')
-        if data == 'close':
-            print(f'{now} | Closing connection')
-            break
-
-        elif data == 'kill':
-            print(f'{now} | Killing server')
-            ret = 1
-            break
-
-        else:
-            conn.send(b'OK')
-            msg = run_xds_indexing(data)
-            conn.send(msg.encode())
-
-    conn.send(b'Connection closed')
-    conn.close()
-    print('Connection closed')
-
-    return ret
+def run_job(data):
+    """Run an indexing job, `data` is the data path, or a dict with the
+    data path under `path`."""
+    path = data['path'] if isinstance(data, dict) else data
+    return run_xds_indexing(path)
 
 
 def main():
@@ -99,12 +72,20 @@ def main():
 Starts a simple XDS server to send indexing jobs to. Runs XDS for every job sent to it. Opens a socket on port {HOST}:{PORT}.
 
 The data sent to the server as a bytes string containing the data path (must contain `cRED_log.txt`).
+The jobs are queued and run by a pool of workers, the server replies with the job ID straight away.
+Use the `status`/`wait`/`jobs` commands to query the jobs (see `instamatic.server.job_scheduler`).
 """
 
     parser = argparse.ArgumentParser(
         description=description,
         formatter_class=argparse.RawDescriptionHelpFormatter)
 
+    parser.add_argument('-w', '--workers',
+                        action='store', type=int, dest='workers',
+                        help="""Number of indexing jobs to run in parallel (default: 2)""")
+
+    parser.set_defaults(workers=2)
+
     options = parser.parse_args()
 
     date = datetime.datetime.now().strftime('%Y-%m-%d')
@@ -115,19 +96,13 @@ The data sent to the server as a bytes string containing the data path (must con
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    s = socket(AF_INET, SOCK_STREAM)
-    s.bind((HOST, PORT))
-    s.listen(5)
+    database = config.locations['logs'] / 'instamatic_indexing_jobs_xds.sqlite'
+    scheduler = JobScheduler(run_job, workers=options.workers, database=database)
 
-    log.info(f'Indexing server (XDS) listening on {HOST}:{PORT}')
-    print(f'Indexing server (XDS) listening on {HOST}:{PORT}')
+    log.info(f'Indexing server (XDS) listening on {HOST}:{PORT} ({options.workers} workers)')
+    print(f'Indexing server (XDS) listening on {HOST}:{PORT} ({options.workers} workers)')
 
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+    serve(scheduler, HOST, PORT)
 
 
 if __name__ == '__main__':
@@ -183,6 +183,120 @@ def find_beam_center_with_beamstop(img, z: int = None, method='thresh', plot=Fal
     return np.array((dx, dy))
 
 
+def find_peak_max_stack(arr: np.ndarray, sigma: int) -> np.ndarray:
+    """Find the position of the peak maximum along the last axis for every
+    1D pattern in `arr` at once.
+
+    The patterns are smoothed using a gaussian filter with standard
+    deviation `sigma`, and the position of the maximum is refined to
+    subpixel precision by fitting a parabola through the largest value
+    and its two neighbours.
+    """
+    y = ndimage.gaussian_filter1d(np.asarray(arr, dtype=float), sigma, axis=-1)
+    n = y.shape[-1]
+
+    c = np.argmax(y, axis=-1)
+    # use the maximum itself for the neighbours of peaks at the edges
+    y0 = np.take_along_axis(y, np.clip(c - 1, 0, n - 1)[..., None], axis=-1)[..., 0]
+    y1 = np.take_along_axis(y, c[..., None], axis=-1)[..., 0]
+    y2 = np.take_along_axis(y, np.clip(c + 1, 0, n - 1)[..., None], axis=-1)[..., 0]
+
+    denom = y0 - 2 * y1 + y2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denom < 0, 0.5 * (y0 - y2) / denom, 0.0)
+
+    return c + offset
+
+
+def find_beam_centers(stack, sigma: int = 30, use_beamstop: bool = False, z: int = 99, chunk_bytes: int = 2**27) -> np.ndarray:
+    """Find the center of the primary beam for every image in `stack`, a 3D
+    array or an iterable of 2D images with the same shape.
+
+    The images are processed in chunks, that are sized so that a chunk
+    of float64 copies takes at most `chunk_bytes` (at least one image per
+    chunk). Without a beam stop, the projections along X/Y are smoothed
+    and the peak positions are determined for all images at once (see
+    `find_peak_max_stack`). With `use_beamstop`, the center of the
+    bounding box of the largest blob above the `z` percentile is taken,
+    as in `find_beam_center_with_beamstop`. Images without any blob
+    (e.g. a blank frame) fall back to the peak positions.
+
+    Returns an array of shape (n, 2) with the beam centers.
+    """
+    from itertools import chain, islice
+
+    it = iter(stack)
+    try:
+        first = np.asarray(next(it))
+    except StopIteration:
+        return np.empty((0, 2))
+
+    it = chain([first], it)
+    chunksize = max(1, chunk_bytes // (first.size * np.dtype(np.float64).itemsize))
+    centers = []
+
+    while True:
+        chunk = list(islice(it, chunksize))
+        if not chunk:
+            break
+
+        chunk = np.stack(chunk)
+
+        if use_beamstop:
+            found = _find_beam_centers_with_beamstop(chunk, z=z)
+            missing = np.isnan(found[:, 0])
+            if missing.any():
+                found[missing] = _find_beam_centers_from_peaks(chunk[missing], sigma=sigma)
+            centers.append(found)
+        else:
+            centers.append(_find_beam_centers_from_peaks(chunk, sigma=sigma))
+
+    return np.vstack(centers)
+
+
+def _find_beam_centers_from_peaks(stack: np.ndarray, sigma: int = 30) -> np.ndarray:
+    """Vectorized version of `find_beam_center` for a 3D stack of
+    images."""
+    xx = np.sum(stack, axis=2)
+    yy = np.sum(stack, axis=1)
+    return np.stack([find_peak_max_stack(xx, sigma), find_peak_max_stack(yy, sigma)], axis=1)
+
+
+def _find_beam_centers_with_beamstop(stack: np.ndarray, z: int = 99) -> np.ndarray:
+    """Vectorized version of `find_beam_center_with_beamstop` (method
+    `thresh`) for a 3D stack of images.
+
+    The centers of images without any blob above the threshold are NaN.
+    """
+    thresh = np.percentile(stack.reshape(len(stack), -1), z, axis=1)
+    seg = stack > thresh[:, None, None]
+
+    # connect pixels within each image, but not across images
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1)
+    labeled, nlabels = ndimage.label(seg, structure=structure)
+
+    centers = np.full((len(stack), 2), np.nan)
+    if nlabels == 0:
+        return centers
+
+    areas = np.bincount(labeled.ravel(), minlength=nlabels + 1)[1:]
+    slices = ndimage.find_objects(labeled)
+
+    frame = np.array([sl[0].start for sl in slices])
+    bbox = np.array([(sl[1].start, sl[1].stop, sl[2].start, sl[2].stop) for sl in slices], dtype=float)
+
+    # largest blob in every frame, ties are resolved by the lowest label as with a stable sort
+    order = np.lexsort((np.arange(nlabels), -areas, frame))
+    first = np.unique(frame[order], return_index=True)[1]
+    largest = order[first]
+
+    centers[frame[largest], 0] = (bbox[largest, 0] + bbox[largest, 1]) / 2
+    centers[frame[largest], 1] = (bbox[largest, 2] + bbox[largest, 3]) / 2
+
+    return centers
+
+
 def printer(data) -> None:
     """Print things to stdout on one line dynamically."""
     sys.stdout.write('\r\x1b[K' + data.__str__())
@@ -1,10 +1,25 @@
+import argparse
+import ast
 import os
 import shutil
-import sys
+import sqlite3
 import time
+from concurrent.futures import ProcessPoolExecutor
 from math import cos, radians
 from pathlib import Path
 
+# Default cache file for `main --cache`
+CACHE_FILE = 'xds_parser_cache.sqlite'
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    data TEXT
+)
+"""
+
 
 def volume(cell):
     """Returns volume for the general case from cell parameters."""
@@ -21,20 +36,22 @@ class xds_parser:
     """Parser for XDS output files to obtain the lattice parameters, space
     group, and integration criteria."""
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, d: dict = None):
         super().__init__()
         self.ios_threshold = 0.8
 
         self.filename = Path(filename).resolve()
-        self.d = self.parse()
+        self.d = self.parse() if d is None else d
 
     def parse(self):
+        with open(self.filename) as f:
+            return self._parse(f)
+
+    def _parse(self, f):
         ios_threshold = self.ios_threshold
 
         fn = self.filename
 
-        f = open(fn)
-
         in_block = False
         block = []
 
@@ -249,26 +266,106 @@ def parse_fns(fns):
     return new_fns
 
 
-def main():
-    fns = sys.argv[1:]
+def _parse_file(fn):
+    """Parse `fn`, returns the dict with the results, or None if the file
+    could not be parsed (runs in the worker processes of `harvest`)."""
+    try:
+        return xds_parser(fn).d
+    except (UnboundLocalError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def _dump_result(d: dict) -> str:
+    """Encode a parsed result for the cache as a python literal."""
+    return repr({**d, 'fn': str(d['fn'])})
+
+
+def _load_result(data: str) -> dict:
+    """Decode a result from the cache, raises ValueError for entries that
+    cannot be read (e.g. written by an older version)."""
+    try:
+        d = ast.literal_eval(data)
+    except (SyntaxError, TypeError) as e:
+        raise ValueError(f'Invalid cache entry: {e}') from e
+    if not isinstance(d, dict):
+        raise ValueError('Invalid cache entry')
+    d['fn'] = Path(d['fn'])
+    return d
+
+
+def harvest(fns, cache: str = None, processes: int = None) -> list:
+    """Parse the `CORRECT.LP` files in `fns` (see `parse_fns`) in a pool of
+    `processes` worker processes, and return the `xds_parser` instances of
+    the files that could be parsed, in the same order.
+
+    If `cache` is given, the results are stored in a SQLite database
+    under the path, modification time, and size of every file, and only
+    new or changed files are parsed again the next time.
+    """
+    fns = [Path(fn).resolve() for fn in fns]
+    stats = {fn: os.stat(fn) for fn in fns}
+
+    results = {}
+
+    db = None
+    if cache:
+        db = sqlite3.connect(str(cache))
+        db.execute(CACHE_SCHEMA)
+        for path, mtime, size, data in db.execute('SELECT path, mtime, size, data FROM results'):
+            fn = Path(path)
+            stat = stats.get(fn)
+            if stat and stat.st_mtime_ns == mtime and stat.st_size == size:
+                try:
+                    results[fn] = _load_result(data) if data is not None else None
+                except ValueError:
+                    # parse the file again
+                    continue
 
-    if not fns:
-        fns = [Path('.')]
+    todo = [fn for fn in fns if fn not in results]
+
+    processes = processes or os.cpu_count()
+    if len(todo) > 1 and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            chunksize = max(1, len(todo) // (4 * processes))
+            parsed = list(executor.map(_parse_file, todo, chunksize=chunksize))
     else:
-        fns = [Path(fn) for fn in fns]
+        parsed = [_parse_file(fn) for fn in todo]
+
+    results.update(zip(todo, parsed))
+
+    if db is not None:
+        rows = [(str(fn), stats[fn].st_mtime_ns, stats[fn].st_size, _dump_result(d) if d is not None else None)
+                for fn, d in zip(todo, parsed)]
+        with db:
+            db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows)
+        db.close()
+
+    return [xds_parser(fn, d=results[fn]) for fn in fns if results[fn]]
+
+
+def main():
+    description = """Harvest the unit cells and integration statistics from the XDS output (CORRECT.LP) in the given files or directories (searched recursively)."""
+
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('args',
+                        type=str, nargs='*', metavar='FILE',
+                        help='CORRECT.LP files or directories (default: current directory)')
+
+    parser.add_argument('-c', '--cache',
+                        action='store', type=str, nargs='?', const=CACHE_FILE, metavar='FILE', dest='cache',
+                        help=f'Keep the parsed results in a SQLite database, so that only new or changed files are parsed the next time (default file: {CACHE_FILE})')
+
+    parser.set_defaults(cache=None)
+    options = parser.parse_args()
+
+    fns = [Path(fn) for fn in options.args] or [Path('.')]
 
     fns = parse_fns(fns)
     print(f'Found {len(fns)} files matching CORRECT.LP\n')
 
-    xdsall = []
-    for fn in fns:
-        try:
-            p = xds_parser(fn)
-        except UnboundLocalError:
-            continue
-        else:
-            if p.d:
-                xdsall.append(p)
+    xdsall = harvest(fns, cache=options.cache)
 
     for i, p in enumerate(xdsall):
         print(p.cell_info(sequence=i))
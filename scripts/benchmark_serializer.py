@@ -0,0 +1,127 @@
+import socket
+import threading
+import time
+
+import numpy as np
+
+from instamatic.server.framing import recv_msg, send_msg
+from instamatic.server.serializer import PROTOCOLS
+
+
+def make_payloads() -> dict:
+    """Typical messages sent to/from the TEM server."""
+    stage = {'id': 1, 'status': 200, 'data': (1234.5, -2345.6, 12.3, 20.0, 0.0), 'duration': 0.001}
+
+    header = {
+        'id': 2, 'status': 200, 'duration': 0.001, 'data': {
+            'FunctionMode': 'mag1',
+            'GunShift': (0, 0),
+            'GunTilt': (0, 0),
+            'BeamShift': (12345, 23456),
+            'BeamTilt': (0, 0),
+            'ImageShift1': (0, 0),
+            'ImageShift2': (0, 0),
+            'DiffShift': (0, 0),
+            'StagePosition': (1234.5, -2345.6, 12.3, 20.0, 0.0),
+            'Magnification': 2500,
+            'DiffFocus': 12345,
+            'Brightness': 34567,
+            'SpotSize': 3,
+        }}
+
+    return {
+        'stage': stage,
+        'header': header,
+        'image 512x512 (uint16)': {'id': 3, 'status': 200, 'data': np.random.randint(0, 2**16, (512, 512), dtype=np.uint16)},
+        'image 2048x2048 (uint16)': {'id': 4, 'status': 200, 'data': np.random.randint(0, 2**16, (2048, 2048), dtype=np.uint16)},
+    }
+
+
+def timeit(func, *args, number: int = None, min_time: float = 0.2) -> float:
+    """Return the mean time per call in seconds."""
+    if number is None:
+        number = 1
+        while True:
+            t0 = time.perf_counter()
+            for _ in range(number):
+                func(*args)
+            dt = time.perf_counter() - t0
+            if dt > min_time:
+                return dt / number
+            number *= 2
+
+    t0 = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return (time.perf_counter() - t0) / number
+
+
+def roundtrip(payload, loader, dumper, number: int = 20) -> float:
+    """Time sending `payload` back and forth over a local socket pair."""
+    a, b = socket.socketpair()
+
+    def echo():
+        for _ in range(number):
+            send_msg(b, dumper(loader(recv_msg(b))))
+
+    t = threading.Thread(target=echo)
+    t.start()
+
+    t0 = time.perf_counter()
+    for _ in range(number):
+        send_msg(a, dumper(payload))
+        loader(recv_msg(a))
+    dt = time.perf_counter() - t0
+
+    t.join()
+    a.close()
+    b.close()
+
+    return dt / number
+
+
+def main():
+    import argparse
+
+    description = """Time the serialization protocols available to the TEM server for typical payloads (stage position, image header, images). Protocols that cannot encode numpy arrays are skipped for the images."""
+
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-r', '--roundtrip', action='store_true', dest='roundtrip',
+                        help='Also time a round trip over a local socket pair.')
+
+    parser.set_defaults(roundtrip=False)
+    options = parser.parse_args()
+
+    payloads = make_payloads()
+
+    print(f'{"payload":26s} {"protocol":14s} {"size":>10s} {"dumps":>10s} {"loads":>10s}' + (f' {"roundtrip":>10s}' if options.roundtrip else ''))
+
+    for name, payload in payloads.items():
+        for protocol, (loader, dumper) in PROTOCOLS.items():
+            try:
+                data = dumper(payload)
+                ret = loader(b''.join(data) if isinstance(data, list) else data)
+            except Exception:
+                continue
+
+            if isinstance(payload['data'], np.ndarray) and not isinstance(ret['data'], np.ndarray):
+                continue
+
+            size = sum(memoryview(d).nbytes for d in data) if isinstance(data, list) else len(data)
+            if isinstance(data, list):
+                data = b''.join(data)
+
+            t_dumps = timeit(dumper, payload)
+            t_loads = timeit(loader, data)
+
+            line = f'{name:26s} {protocol:14s} {size:10d} {1e6 * t_dumps:8.1f}µs {1e6 * t_loads:8.1f}µs'
+            if options.roundtrip:
+                line += f' {1e6 * roundtrip(payload, loader, dumper):8.1f}µs'
+            print(line)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+class Frames:
+    """Minimal stand-in for `ImgConversion` with `n` random frames of the
+    given `shape`."""
+
+    def __init__(self, n: int, shape: tuple):
+        from instamatic.processing.ImgConversion import ImgConversion
+
+        rng = np.random.default_rng()
+        img = rng.random(shape) * 1000
+
+        self.data = {i: img for i in range(1, n + 1)}
+        self.headers = {i: {'ImageGetTime': time.time(), 'ImageExposureTime': 0.1, 'beam_center': (shape[0] / 2, shape[1] / 2)} for i in self.data}
+        self.observed_range = set(self.data)
+        self.data_shape = shape
+
+        self.smv_subdrc = 'data'
+        self.name = 'benchmark'
+        self.start_angle = 0.0
+        self.osc_angle = 0.5
+        self.distance = 500.0
+        self.wavelength = 0.0251
+        self.physical_pixelsize = 0.055
+        self.mean_beam_center = (shape[0] / 2, shape[1] / 2)
+
+        for attr in ('write_tiff', 'write_smv', 'write_mrc', 'smv_writer', 'get_smv_template', 'get_smv_static_header',
+                     'get_smv_frame_values', 'threadpoolwriter', 'processpoolwriter'):
+            setattr(self, attr, getattr(ImgConversion, attr).__get__(self))
+
+
+def run(frames: Frames, writer: str, workers: int) -> float:
+    """Write all frames to TIFF/SMV/MRC using `writer`, returns the time
+    taken in seconds."""
+    with tempfile.TemporaryDirectory() as drc:
+        drc = Path(drc)
+        paths = {'tiff_path': drc / 'tiff', 'smv_path': drc / 'SMV', 'mrc_path': drc / 'RED'}
+
+        t0 = time.perf_counter()
+        getattr(frames, writer)(workers=workers, **paths)
+        return time.perf_counter() - t0
+
+
+def main():
+    import argparse
+    import os
+
+    description = """Compare the throughput of the thread pool and process pool writers in `ImgConversion`, writing every frame to TIFF, SMV, and MRC."""
+
+    parser = argparse.ArgumentParser(description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-n', '--nframes', action='store', type=int, dest='nframes',
+                        help='Number of frames to write (default: %(default)s).')
+
+    parser.add_argument('-s', '--shapes', action='store', type=int, nargs='+', dest='shapes',
+                        help='Image sizes to test (default: %(default)s).')
+
+    parser.add_argument('-w', '--workers', action='store', type=int, dest='workers',
+                        help='Number of workers (default: number of cpus).')
+
+    parser.set_defaults(nframes=1000, shapes=[512, 2048], workers=os.cpu_count())
+    options = parser.parse_args()
+
+    print(f'{options.nframes} frames, {options.workers} workers')
+    print(f'{"shape":>12s} {"writer":>18s} {"time":>9s} {"frames/s":>9s} {"MB/s":>9s}')
+
+    for size in options.shapes:
+        shape = (size, size)
+        frames = Frames(options.nframes, shape)
+        nbytes = options.nframes * size * size * 2 * 3  # uint16, 3 formats
+
+        for writer in ('threadpoolwriter', 'processpoolwriter'):
+            dt = run(frames, writer, options.workers)
+            print(f'{str(shape):>12s} {writer:>18s} {dt:8.2f}s {options.nframes / dt:9.1f} {nbytes / dt / 1e6:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -79,7 +79,38 @@ def find_isolated_crystals(fns, min_separation=1.5, boundary=0.5, plot=False):
     return isolated
 
 
-def main(file_pattern):
+def get_learning_row(fn, h, prediction):
+    """Get the row for `learning.csv`, or None if the prediction is too
+    low."""
+    frame = int(str(fn)[-12:-8])
+    number = int(str(fn)[-7:-3])
+
+    if prediction < 0.5:
+        # print fn, "prediction too low", prediction
+        return None
+
+    try:
+        size = h['total_area_micrometer'] / h['crystal_clusters']  # micrometer^2
+    except KeyError:
+        # old data formats don't have this information
+        size = 0.0
+
+    try:
+        dx, dy = h['exp_hole_offset']
+        cx, cy = h['exp_hole_center']
+    except KeyError:
+        dx, dy = h['exp_scan_offset']
+        cx, cy = h['exp_scan_center']
+
+    prediction = round(prediction, 4)
+    size = round(size, 4)
+    x = int(cx + dx)
+    y = int(cy + dy)
+
+    return (fn.absolute(), frame, number, prediction, size, x, y)
+
+
+def main(file_pattern, batch_size=64):
     image_fns = glob.glob(file_pattern)
     print(len(image_fns), 'Images')
 
@@ -87,38 +118,18 @@ def main(file_pattern):
     print(len(diff_fns), 'Patterns from isolated crystals')
 
     lst = []
-    for fn in tqdm(diff_fns):
-        img, h = read_hdf5(fn)
-
-        frame = int(str(fn)[-12:-8])
-        number = int(str(fn)[-7:-3])
-
-        img_processed = neural_network.preprocess(img.astype(float))
-        prediction = neural_network.predict(img_processed)
-
-        if prediction < 0.5:
-            # print fn, "prediction too low", prediction
-            continue
-
-        try:
-            size = h['total_area_micrometer'] / h['crystal_clusters']  # micrometer^2
-        except KeyError:
-            # old data formats don't have this information
-            size = 0.0
-
-        try:
-            dx, dy = h['exp_hole_offset']
-            cx, cy = h['exp_hole_center']
-        except KeyError:
-            dx, dy = h['exp_scan_offset']
-            cx, cy = h['exp_scan_center']
-
-        prediction = round(prediction, 4)
-        size = round(size, 4)
-        x = int(cx + dx)
-        y = int(cy + dy)
-
-        lst.append((fn.absolute(), frame, number, prediction, size, x, y))
+    for i in tqdm(range(0, len(diff_fns), batch_size)):
+        fns = diff_fns[i:i + batch_size]
+        imgs, hs = zip(*(read_hdf5(fn) for fn in fns))
+
+        # score the patterns in one go, this is much faster than one at a time
+        imgs_processed = np.stack([neural_network.preprocess(img.astype(float)) for img in imgs])
+        predictions = neural_network.predict(imgs_processed, batch_size=batch_size)
+
+        for fn, h, prediction in zip(fns, hs, predictions):
+            row = get_learning_row(fn, h, float(prediction))
+            if row is not None:
+                lst.append(row)
 
     with open('learning.csv', 'w', newline='') as csvfile:
         # writer = csv.DictWriter(csvfile, fieldnames=["filename", "frame", "number", "quality", "size", "xpos", "ypos"])
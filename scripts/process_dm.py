@@ -19,6 +19,9 @@ from instamatic.processing.ImgConversionDM import ImgConversionDM as ImgConversi
 #
 # If the first argument is given as `all`, the script will look for
 # all `cred_log.txt` files in the subdirectories, and iterate over those.
+#
+# Add `--processes` to write the frames with a pool of processes instead
+# of threads, which is only faster on machines with many cores.
 
 
 def relativistic_wavelength(voltage: float = 200):
@@ -36,7 +39,7 @@ def relativistic_wavelength(voltage: float = 200):
     return round(wl * 1e10, 6)  # m -> Angstrom
 
 
-def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV'):
+def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV', processes=False):
     credlog = Path(credlog)
     drc = credlog.parent
 
@@ -147,10 +150,15 @@ def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV'):
         tiff_drc_name = tiff_path
         tiff_path = drc / tiff_path
 
-    img_conv.threadpoolwriter(tiff_path=tiff_path,
-                              mrc_path=mrc_path,
-                              smv_path=smv_path,
-                              workers=8)
+    if processes:
+        img_conv.processpoolwriter(tiff_path=tiff_path,
+                                   mrc_path=mrc_path,
+                                   smv_path=smv_path)
+    else:
+        img_conv.threadpoolwriter(tiff_path=tiff_path,
+                                  mrc_path=mrc_path,
+                                  smv_path=smv_path,
+                                  workers=8)
 
     if mrc_path:
         img_conv.write_ed3d(mrc_path)
@@ -163,8 +171,16 @@ def img_convert(credlog, tiff_path='tiff2', mrc_path='RED', smv_path='SMV'):
 
 
 def main():
+    args = sys.argv[1:]
+
+    # write the frames with a pool of processes instead of threads,
+    # only faster with many cores
+    processes = '--processes' in args
+    if processes:
+        args.remove('--processes')
+
     try:
-        credlog = sys.argv[1]
+        credlog = args[0]
     except IndexError:
         credlog = 'cRED_log.txt'
 
@@ -173,10 +189,10 @@ def main():
 
         for fn in fns:
             print(fn)
-            img_convert(fn)
+            img_convert(fn, processes=processes)
 
     else:
-        img_convert(credlog)
+        img_convert(credlog, processes=processes)
 
 
 if __name__ == '__main__':
@@ -70,7 +70,7 @@ def center_images(img_conv, plot=True):
         plt.show()
 
 
-def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'):
+def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed', processes=False):
     credlog = Path(credlog)
     drc = credlog.parent
     image_fns = list(drc.glob('tiff/*.tiff'))
@@ -165,10 +165,15 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
     if tiff_path:
         smv_path = drc / tiff_path
 
-    img_conv.threadpoolwriter(tiff_path=tiff_path,
-                              mrc_path=mrc_path,
-                              smv_path=smv_path,
-                              workers=8)
+    if processes:
+        img_conv.processpoolwriter(tiff_path=tiff_path,
+                                   mrc_path=mrc_path,
+                                   smv_path=smv_path)
+    else:
+        img_conv.threadpoolwriter(tiff_path=tiff_path,
+                                  mrc_path=mrc_path,
+                                  smv_path=smv_path,
+                                  workers=8)
 
     if mrc_path:
         img_conv.write_ed3d(mrc_path)
@@ -179,8 +184,16 @@ def reprocess(credlog, tiff_path=None, mrc_path=None, smv_path='SMV_reprocessed'
 
 
 def main():
+    args = sys.argv[1:]
+
+    # write the frames with a pool of processes instead of threads,
+    # only faster with many cores
+    processes = '--processes' in args
+    if processes:
+        args.remove('--processes')
+
     try:
-        credlog = sys.argv[1]
+        credlog = args[0]
     except IndexError:
         credlog = 'cRED_log.txt'
 
@@ -189,10 +202,10 @@ def main():
 
         for fn in fns:
             print(fn)
-            reprocess(fn)
+            reprocess(fn, processes=processes)
 
     else:
-        reprocess(credlog)
+        reprocess(credlog, processes=processes)
 
 
 if __name__ == '__main__':
@@ -18,6 +18,7 @@ from pathlib import Path
 import numpy as np
 import tifffile
 
+from instamatic.processing.frame_source import FrameSource
 from instamatic.processing.ImgConversionTVIPS import ImgConversionTVIPS as ImgConversion
 from instamatic.tools import get_acquisition_time
 from instamatic.tools import relativistic_wavelength
@@ -28,7 +29,26 @@ def extract_image_number(s):
     return int(p.stem.split('_')[-1])
 
 
-def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_path='SMV'):
+def read_tvips_frame(fn) -> np.ndarray:
+    """Read a TVIPS frame, and convert it to 16-bit unsigned integer."""
+    img = tifffile.imread(fn)
+
+    if img.dtype.type is np.int16:
+        if img.min() >= 0 and img.max() < 2**16:
+            img = img.astype(np.uint16)
+
+    assert img.dtype.type is np.uint16, f'Image ({fn.stem}) dtype is {img.dtype} (must be np.uint16)'
+
+    return img
+
+
+def read_tvips_metadata(fn) -> dict:
+    """Read the TVIPS metadata, without reading the image data."""
+    with tifffile.TiffFile(fn) as tiff:
+        return tiff.tvips_metadata
+
+
+def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_path='SMV', processes=False):
     credlog = Path(credlog)
     drc = credlog.parent
 
@@ -47,8 +67,7 @@ def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_p
     else:
         print(nframes)
 
-    ims = [tifffile.TiffFile(fn) for fn in image_fns]
-    hs = [im.tvips_metadata for im in ims]
+    hs = [read_tvips_metadata(fn) for fn in image_fns]
 
     ts = [h['Time'] for h in hs]  # sort by timestamps
 
@@ -146,27 +165,9 @@ def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_p
     assert pixelsize_x_tvips == pixelsize_y_tvips, 'Pixelsize is different in X / Y direction'
     assert physical_pixelsize_x_tvips == physical_pixelsize_y_tvips, 'Physical pixelsize is different in X / Y direction'
 
-    buffer = []
-
-    print()
-    print('Reading data')
-    for i, fn in enumerate(image_fns):
-        j = i + 1  # j must be 1-indexed
-
-        im = ims[i]
-        h = hs[i]
-
-        img = im.asarray()
-
-        if img.dtype.type is np.int16:
-            if img.min() >= 0 and img.max() < 2**16:
-                img = img.astype(np.uint16)
-
-        assert img.dtype.type is np.uint16, f'Image (#{i}:{fn.stem}) dtype is {img.dtype} (must be np.uint16)'
-
-        h = {'ImageGetTime': timestamp, 'ImageExposureTime': exposure_time}
-
-        buffer.append((j, img, h))
+    # the frames are read one at a time when they are needed (j must be 1-indexed)
+    headers = {j: {'ImageGetTime': timestamp, 'ImageExposureTime': exposure_time} for j in range(1, nframes + 1)}
+    buffer = FrameSource(list(image_fns), headers=headers, start=1, reader=read_tvips_frame)
 
     print('Setting up image conversion')
     img_conv = ImgConversion(buffer=buffer,
@@ -183,8 +184,7 @@ def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_p
     if beamstop:
         from instamatic.utils.beamstop import find_beamstop_rect
         print('Finding beam stop')
-        stack_mean = np.mean(tuple(img_conv.data.values()), axis=0)
-        img_conv.mean_beam_center
+        stack_mean = img_conv.get_mean_image()
         beamstop_rect = find_beamstop_rect(stack_mean, img_conv.mean_beam_center, pad=1, savefig=True, drc=drc)
         img_conv.add_beamstop(beamstop_rect)
 
@@ -199,10 +199,15 @@ def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_p
         pets_path = drc / pets_path
 
     print('Writing data')
-    img_conv.threadpoolwriter(tiff_path=tiff_path,
-                              mrc_path=mrc_path,
-                              smv_path=smv_path,
-                              workers=8)
+    if processes:
+        img_conv.processpoolwriter(tiff_path=tiff_path,
+                                   mrc_path=mrc_path,
+                                   smv_path=smv_path)
+    else:
+        img_conv.threadpoolwriter(tiff_path=tiff_path,
+                                  mrc_path=mrc_path,
+                                  smv_path=smv_path,
+                                  workers=8)
 
     print('Writing input files')
     if mrc_path:
@@ -224,8 +229,16 @@ def img_convert(credlog, tiff_path=None, pets_path='PETS', mrc_path='RED', smv_p
 
 
 def main():
+    args = sys.argv[1:]
+
+    # write the frames with a pool of processes instead of threads,
+    # only faster with many cores
+    processes = '--processes' in args
+    if processes:
+        args.remove('--processes')
+
     try:
-        credlog = sys.argv[1]
+        credlog = args[0]
     except IndexError:
         credlog = 'cRED_log.txt'
 
@@ -234,10 +247,10 @@ def main():
 
         for fn in fns:
             print(fn)
-            img_convert(fn)
+            img_convert(fn, processes=processes)
 
     else:
-        img_convert(credlog)
+        img_convert(credlog, processes=processes)
 
 
 if __name__ == '__main__':
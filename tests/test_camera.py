@@ -1,3 +1,6 @@
+import pytest
+
+
 def test_get_image(ctrl):
     bin1 = 1
     bin2 = 2
@@ -22,3 +25,167 @@ def test_functions(ctrl):
     dims = ctrl.cam.getImageDimensions()
     assert isinstance(dims, tuple)
     assert len(dims) == 2
+
+
+def test_frame_renderer():
+    import time
+
+    import numpy as np
+
+    from instamatic.camera.frame_ring import FrameRing
+    from instamatic.camera.renderer import FrameRenderer
+
+    frame = np.random.randint(0, 1000, size=(2048, 2048)).astype(np.uint16)
+
+    ring = FrameRing(size=4)
+    renderer = FrameRenderer(ring.subscribe('renderer'), dynamic_range=11800, maxdim=512)
+    image = renderer.render(frame)
+    assert image.dtype == np.uint8
+    assert image.shape == (512, 512)
+    assert image.max() == 255
+
+    renderer.auto_contrast = False
+    renderer.display_range = 2000
+    image = renderer.render(frame)
+    np.testing.assert_array_equal(image, (frame[::4, ::4] * (255 / 2000)).astype(np.uint8))
+
+    renderer.resize = (950, 950)
+    assert renderer.render(frame).shape == (950, 950)
+    renderer.resize = None
+
+    # float frames do not use the lookup table
+    assert renderer.render(frame.astype(float)).dtype == np.uint8
+
+    renderer.start()
+    try:
+        for _ in range(5):
+            ring.publish(frame)
+        t0 = time.perf_counter()
+        while renderer.latest()[0] is None and time.perf_counter() - t0 < 5:
+            time.sleep(0.01)
+        image, count = renderer.latest()
+        assert image.shape == (512, 512)
+        # stale frames are dropped
+        assert 1 <= count <= 5
+
+        # frames that cannot be rendered are skipped
+        t0 = time.perf_counter()
+        seq = ring.publish(np.zeros(10))
+        while renderer.subscription.cursor < seq and time.perf_counter() - t0 < 5:
+            time.sleep(0.01)
+        count = renderer.latest()[1]
+        ring.publish(frame)
+        t0 = time.perf_counter()
+        while renderer.latest()[1] == count and time.perf_counter() - t0 < 5:
+            time.sleep(0.01)
+        assert renderer.latest()[1] == count + 1
+        assert renderer.thread.is_alive()
+    finally:
+        renderer.stop()
+
+
+def test_frame_ring():
+    import threading
+
+    import numpy as np
+
+    from instamatic.camera.frame_ring import FrameRing
+
+    ring = FrameRing(size=4)
+    assert ring.latest() is None
+
+    slow = ring.subscribe('slow')
+    fast = ring.subscribe('fast')
+
+    for i in range(6):
+        ring.publish(np.full((4, 4), i))
+
+    item = ring.latest()
+    assert item.seq == 5
+    assert item.frame[0, 0] == 5
+
+    # the oldest 2 frames were overwritten
+    items = [slow.get(timeout=0) for _ in range(4)]
+    assert [item.seq for item in items] == [2, 3, 4, 5]
+    assert all(a.timestamp <= b.timestamp for a, b in zip(items, items[1:]))
+    assert slow.dropped == 2
+    assert slow.get(timeout=0) is None
+
+    # skip to the most recent frame
+    assert fast.get(latest=True).seq == 5
+    assert fast.dropped == 5
+    assert ring.dropped_frames() == {'slow': 2, 'fast': 5}
+
+    # new subscribers only see new frames
+    late = ring.subscribe('late')
+    assert late.pending() == 0
+    threading.Timer(0.05, ring.publish, args=(np.zeros((4, 4)),), kwargs={'acquired': True}).start()
+    item = late.get(timeout=5)
+    assert item.seq == 6
+    assert item.acquired
+
+    # closing wakes up waiting subscribers
+    threading.Timer(0.05, ring.close).start()
+    assert late.get(timeout=5) is None
+    assert ring.subscriptions == []
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_videostream_recording(tmp_path):
+    import threading
+
+    import numpy as np
+
+    from instamatic.camera.camera import Camera
+    from instamatic.camera.videostream import Recording
+    from instamatic.camera.videostream import VideoStream
+
+    stream = VideoStream(Camera('test', as_stream=False))
+    try:
+        stream.update_frametime(0.01)
+        sub = stream.subscribe('recorder')
+
+        stack = stream.continuous_collection(exposure=0.01, n=5)
+        assert stack.shape[0] == 5
+        assert stack.flags.c_contiguous
+
+        fn = tmp_path / 'recording.npy'
+        recording = stream.record(4, exposure=0.01, filename=fn)
+        assert recording.wait(timeout=10)
+        assert np.all(np.diff(recording.timestamps) > 0)
+        np.testing.assert_array_equal(np.load(fn), recording.frames)
+
+        # the recorded frames are published to the stream
+        assert sub.pending() >= 9
+
+        # recording also works while the stream is paused
+        stream.block()
+        recording = stream.record(2, exposure=0.01)
+        assert recording.wait(timeout=10)
+        assert len(recording.frames) == 2
+        stream.unblock()
+
+        # stopping early, the file holds the recorded frames
+        fn = tmp_path / 'stopped.npy'
+        recording = stream.record(1000, exposure=0.01, filename=fn)
+        assert recording.stop(timeout=10)
+        assert 0 < recording.count < 1000
+        np.testing.assert_array_equal(np.load(fn)[:recording.count], recording.frames)
+
+        # waiting does not block if the grabber dies during the recording
+        def fail(*args, **kwargs):
+            raise RuntimeError('camera error')
+
+        stream.grabber.cam.getImage = fail
+        with pytest.raises(RuntimeError, match='image grabber has exited'):
+            stream.continuous_collection(exposure=0.01, n=5)
+    finally:
+        stream.close()
+
+    # stop does not block if the grabber thread has exited
+    recording = Recording(2, exposure=0.01)
+    recording.thread = threading.Thread(target=lambda: None)
+    recording.thread.start()
+    recording.thread.join()
+    assert recording.stop(timeout=10)
+    assert recording.done
@@ -228,8 +228,60 @@ def test_align_to(ctrl):
     assert pos != ctrl.stage.xy
 
 
+def test_header_cache(ctrl):
+    from instamatic.TEMController.cache import DEFAULT_TTL
+
+    ctrl.mode.set('mag1')
+    ctrl.beamshift.set(100, 200)
+
+    h = ctrl.to_dict(cached=True)
+    assert h['BeamShift'] == (100, 200)
+    assert ctrl.cache.get('BeamShift') == (100, 200)
+    assert 'DiffFocus' not in h
+
+    # changes through the controller invalidate the cache
+    ctrl.beamshift.set(300, 400)
+    with pytest.raises(KeyError):
+        ctrl.cache.get('BeamShift')
+    assert ctrl.to_dict('BeamShift', cached=True)['BeamShift'] == (300, 400)
+
+    # changes on the microscope itself are picked up after the ttl expires
+    ctrl.tem.setBeamShift(500, 600)
+    assert ctrl.to_dict('BeamShift', cached=True)['BeamShift'] == (300, 400)
+    ctrl.cache.ttl['BeamShift'] = 0
+    assert ctrl.to_dict('BeamShift', cached=True)['BeamShift'] == (500, 600)
+    ctrl.cache.ttl['BeamShift'] = DEFAULT_TTL['BeamShift']
+
+    # so does resetting the deflector to its neutral value
+    ctrl.to_dict('BeamShift', cached=True)
+    ctrl.beamshift.neutral()
+    with pytest.raises(KeyError):
+        ctrl.cache.get('BeamShift')
+
+    # stage position is never cached
+    ctrl.stage.set(x=0, y=0)
+    ctrl.to_dict('StagePosition', cached=True)
+    with pytest.raises(KeyError):
+        ctrl.cache.get('StagePosition')
+
+
 if __name__ == '__main__':
     test_ctrl()
 
     from IPython import embed
     embed(banner1='')
+
+
+def test_from_dict(ctrl):
+    ctrl.mode.set('mag1')
+    ctrl.beamshift.set(100, 200)
+    dct = ctrl.to_dict('FunctionMode', 'BeamShift', 'Magnification')
+
+    ctrl.beamshift.set(300, 400)
+    ctrl.from_dict(dct)
+    assert ctrl.beamshift.get() == (100, 200)
+
+    # nothing else is set if the function mode cannot be set
+    with pytest.raises(ValueError):
+        ctrl.from_dict({**dct, 'FunctionMode': 'rawr', 'BeamShift': (500, 600)})
+    assert ctrl.beamshift.get() == (100, 200)
@@ -18,10 +18,14 @@ def header():
     return {'value': 123, 'string': 'test'}
 
 
-def test_tiff(data, header):
+@pytest.mark.parametrize('header_format', ['json', 'msgpack', 'yaml'])
+def test_tiff(data, header, header_format):
+    if header_format == 'msgpack':
+        pytest.importorskip('msgpack')
+
     out = 'out.tiff'
 
-    formats.write_tiff(out, data, header)
+    formats.write_tiff(out, data, header, header_format=header_format)
 
     assert os.path.exists(out)
 
@@ -31,6 +35,67 @@ def test_tiff(data, header):
     assert header == h
 
 
+def test_tiff_header_compatibility(tmp_path, data):
+    import tifffile
+    import yaml
+
+    header = {'tuple': (1.0, 2.0), 'array': np.array([1, 2]), 'float': np.float32(0.5)}
+
+    fn = tmp_path / 'new.tiff'
+    formats.write_tiff(fn, data, header, header_format='json')
+
+    # JSON header can be read as yaml by older versions
+    with tifffile.TiffFile(fn) as tiff:
+        assert yaml.safe_load(tiff.pages[0].description) == {'tuple': [1.0, 2.0], 'array': [1, 2], 'float': 0.5}
+
+    img, h = formats.read_tiff(fn)
+    assert h == {'tuple': [1.0, 2.0], 'array': [1, 2], 'float': 0.5}
+
+    # yaml header written by older versions
+    fn = tmp_path / 'old.tiff'
+    with tifffile.TiffWriter(fn) as f:
+        f.save(data=data, software='instamatic', description=yaml.dump({'list': [1.0, 2.0], 'string': 'old'}))
+
+    img, h = formats.read_tiff(fn)
+    assert h == {'list': [1.0, 2.0], 'string': 'old'}
+
+
+def test_tiff_header_types(tmp_path, data):
+    import yaml
+
+    header = {'tuple': (1.0, 2.0), 'array': np.array([1, 2]), 'float': np.float32(0.5)}
+
+    fn = tmp_path / 'types.tiff'
+    formats.write_tiff(fn, data, header)
+
+    # the default header reads back the same as with older (yaml) versions
+    expected = yaml.load(yaml.dump(header), Loader=yaml.Loader)
+
+    img, h = formats.read_tiff(fn)
+    assert h.keys() == expected.keys()
+    for key, value in expected.items():
+        assert type(h[key]) is type(value)
+        np.testing.assert_array_equal(h[key], value)
+
+
+def test_tiff_stack(tmp_path, data, header):
+    for i in range(3):
+        formats.write_tiff(tmp_path / f'{i:05d}.tiff', data + i, {**header, 'value': i})
+
+    stack, headers = formats.read_tiff_stack(tmp_path)
+
+    assert stack.shape == (3, *data.shape)
+    np.testing.assert_array_equal(stack[2], data + 2)
+    assert [h['value'] for h in headers] == [0, 1, 2]
+
+    stack, headers = formats.read_tiff_stack(str(tmp_path / '0000[12].tiff'))
+    assert len(stack) == len(headers) == 2
+    assert headers[0]['value'] == 1
+
+    with pytest.raises(OSError, match='nothing_'):
+        formats.read_tiff_stack(str(tmp_path / 'nothing_*.tiff'))
+
+
 def test_cbf(data, header):
     out = 'out.cbf'
 
@@ -38,9 +103,24 @@ def test_cbf(data, header):
 
     assert os.path.exists(out)
 
-    # Reader Not implemented:
-    with pytest.raises(NotImplementedError):
-        img, h = formats.read_image(out)
+    img, h = formats.read_image(out)
+
+    assert np.allclose(img, data)
+    assert h['X-Binary-Element-Type'] == 'signed 64-bit integer'
+
+
+@pytest.mark.parametrize('values', [
+    [0, 1, 2, 127, 128, 0, -128, 32767, 32768, 0, -32768, 2147483647, 2147483648, 0, -2**40, 2**40],
+    [0x80, 0x8080, 0x808080, 0x80808080, 0x8080808080],  # values that contain escape bytes
+])
+def test_cbf_byte_offset(values):
+    from instamatic.formats.xdscbf import compByteOffset, decByteOffset
+
+    arr = np.cumsum(np.array(values * 10, dtype=np.int64))
+
+    out = decByteOffset(compByteOffset(arr), size=arr.size, dtype=np.int64)
+
+    np.testing.assert_array_equal(out, arr)
 
 
 def test_mrc(data, header):
@@ -71,6 +151,30 @@ def test_smv(data, header):
     assert h['string'] == header['string']
 
 
+def test_smv_header_template(tmp_path, data):
+    header = {'HEADER_BYTES': 512, 'DIM': 2, 'SIZE1': 64, 'SIZE2': 64, 'PHI': None, 'DISTANCE': 500.0}
+    template = formats.HeaderTemplate(header, fields=('PHI',))
+
+    out = template.format(PHI='1.2500')
+    assert len(out) == 512
+    assert out == formats.adscimage.format_header({**header, 'PHI': '1.2500'})
+
+    fns = [tmp_path / f'{i:05d}.img' for i in range(3)]
+    stack = np.array([data + i for i in range(3)])
+    formats.write_adsc_stack(fns, stack, template, [{'PHI': f'{i:.4f}'} for i in range(3)])
+
+    img, h = formats.read_image(fns[2])
+    assert np.allclose(img, data + 2)
+    assert h['PHI'] == '2.0000'
+    assert h['DISTANCE'] == '500.0'
+
+    with pytest.raises(KeyError):
+        formats.HeaderTemplate(header, fields=('OSC_START',))
+
+    with pytest.raises(ValueError):
+        template.format(PHI='x' * 512)
+
+
 def test_hdf5(data, header):
     out = 'out.h5'
 
@@ -82,3 +186,75 @@ def test_hdf5(data, header):
 
     assert np.allclose(img, data)
     assert header == h
+
+
+def test_mrc_stack(tmp_path, data):
+    fn = tmp_path / 'stack.mrc'
+    data = data.astype(np.uint16)
+
+    with formats.MrcStack.create(fn, shape=data.shape, dtype=np.uint16) as stack:
+        for i in range(3):
+            stack.append(data + i)
+        assert len(stack) == 3
+
+    stack = formats.MrcStack(fn)
+    assert len(stack) == 3
+    assert stack.shape == (3, *data.shape)
+    np.testing.assert_array_equal(stack[1], data + 1)
+    np.testing.assert_array_equal(stack[1:], [data + 1, data + 2])
+
+    with pytest.raises(OSError):
+        stack.append(data)
+
+    stack.close()
+
+    with formats.MrcStack(fn, mode='r+') as stack:
+        stack.append(np.array([data + 3, data + 4]))
+        stack[0] = data + 10
+
+    h = formats.mrc.read_mrc_header(fn)
+    assert h['nz'] == 5
+    assert h['amax'] == data.max() + 10
+
+    stack = formats.MrcStack(fn)
+    np.testing.assert_array_equal(stack[0], data + 10)
+    np.testing.assert_array_equal(stack[4], data + 4)
+    stack.close()
+
+    img, h = formats.read_image(fn)
+    np.testing.assert_array_equal(img, data + 10)
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_hdf5_stack(tmp_path, data, header, compression):
+    fn = tmp_path / 'stack.h5'
+    data = data.astype(np.uint16)
+
+    with formats.HDF5Stack.create(fn, shape=data.shape, compression=compression) as stack:
+        stack.attrs['name'] = 'test'
+        for i in range(3):
+            stack.append(data + i, {**header, 'value': i})
+        stack.append(np.array([data + 3, data + 4]), [{'value': 3}, {'string': 'no value'}])
+
+    with pytest.raises(ValueError):
+        formats.HDF5Stack.create(tmp_path / 'invalid.h5', shape=data.shape, compression='invalid')
+
+    stack = formats.HDF5Stack(fn)
+    assert len(stack) == 5
+    assert stack.attrs['name'] == 'test'
+    assert stack.columns == ['value']
+    np.testing.assert_array_equal(stack[4], data + 4)
+    np.testing.assert_array_equal(stack.column('value'), [0, 1, 2, 3, np.nan])
+
+    img, h = stack.read(1)
+    np.testing.assert_array_equal(img, data + 1)
+    assert h == {**header, 'value': 1}
+
+    with pytest.raises(OSError):
+        stack.append(data)
+
+    stack.close()
+
+    img, h = formats.read_image(fn)
+    np.testing.assert_array_equal(img, data)
+    assert h == {**header, 'value': 0}
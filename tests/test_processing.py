@@ -0,0 +1,378 @@
+import numpy as np
+import pytest
+
+from instamatic.formats import read_adsc, read_hdf5, read_image, read_tiff
+
+
+def make_frame(shape=(128, 128), center=(60, 70), sigma=3.0):
+    x, y = np.indices(shape)
+    img = 1000 * np.exp(-((x - center[0])**2 + (y - center[1])**2) / (2 * sigma**2))
+    return img + 10
+
+
+def test_acquisition_pipeline(tmp_path):
+    from instamatic.processing.acquisition_pipeline import AcquisitionPipeline
+    from instamatic.processing.ImgConversionTPX import ImgConversionTPX
+
+    nframes = 10
+
+    pipeline = AcquisitionPipeline(tiff_path=tmp_path / 'tiff',
+                                   smv_path=tmp_path / 'SMV',
+                                   mrc_path=tmp_path / 'RED',
+                                   maxsize=2,
+                                   workers=1)
+
+    for i in range(1, nframes + 1):
+        pipeline.put(i, make_frame(), {'ImageGetTime': 0.0, 'ImageExposureTime': 0.1})
+
+    stats = pipeline.close()
+
+    assert stats['frames'] == nframes
+    assert stats['max_queued'] <= 2
+    assert len(pipeline) == nframes
+
+    img, h = read_tiff(tmp_path / 'tiff' / '00001.tiff')
+    assert img.dtype == np.uint16
+    assert np.allclose(h['beam_center'], (60, 70), atol=0.5)
+
+    img_conv = ImgConversionTPX(buffer=pipeline,
+                                osc_angle=0.5,
+                                start_angle=-10.0,
+                                end_angle=-5.0,
+                                rotation_axis=0.0,
+                                acquisition_time=0.1,
+                                flatfield=None,
+                                pixelsize=0.01,
+                                physical_pixelsize=0.055,
+                                wavelength=0.0251)
+
+    assert img_conv.observed_range == set(range(1, nframes + 1))
+    assert img_conv.data_shape == (128, 128)
+    assert np.allclose(img_conv.mean_beam_center, (60, 70), atol=0.5)
+    np.testing.assert_array_equal(img_conv.data[1], np.ushort(make_frame()))
+
+    img_conv.write_smv_headers(tmp_path / 'SMV')
+
+    img, h = read_adsc(tmp_path / 'SMV' / 'data' / '00001.img')
+    assert h['BEAMLINE'] == 'TimePix_SU'
+    assert float(h['DISTANCE']) == round(img_conv.distance, 4)
+    assert float(h['OSC_START']) == -10.0
+    np.testing.assert_array_equal(img, np.ushort(make_frame()))
+
+    img_conv.smv_writer(tmp_path / 'SMV2')
+
+    img, h = read_adsc(tmp_path / 'SMV2' / 'data' / '00003.img')
+    assert h == {key: str(value) for key, value in img_conv.get_smv_header(3).items()}
+    np.testing.assert_array_equal(img, np.ushort(make_frame()))
+
+    fn = img_conv.hdf5_writer(tmp_path / 'HDF5')
+    img, h = read_hdf5(fn, index=2)
+    assert h['frame'] == 3
+    np.testing.assert_array_equal(img, np.ushort(make_frame()))
+
+
+def test_acquisition_pipeline_error(tmp_path):
+    import time
+
+    from instamatic.processing.acquisition_pipeline import AcquisitionPipeline
+
+    pipeline = AcquisitionPipeline(tiff_path=tmp_path / 'tiff', workers=1)
+
+    # a frame without a header cannot be written
+    pipeline.put(1, make_frame(), None)
+
+    t0 = time.perf_counter()
+    while not pipeline._exception and time.perf_counter() - t0 < 5:
+        time.sleep(0.01)
+
+    # the failure is reported on the next frame, and again when closing
+    with pytest.raises(TypeError):
+        pipeline.put(2, make_frame(), {})
+    with pytest.raises(TypeError):
+        pipeline.close()
+
+
+def test_find_beam_centers():
+    from instamatic.tools import find_beam_center_with_beamstop, find_beam_centers
+
+    centers = [(50.3, 70.8), (64.0, 64.0), (80.6, 40.1)]
+    stack = np.array([make_frame(center=center) for center in centers])
+
+    # 2 frames per chunk
+    found = find_beam_centers(stack, sigma=10, chunk_bytes=2 * stack[0].size * 8)
+    assert found.shape == (3, 2)
+    np.testing.assert_allclose(found, centers, atol=0.2)
+
+    found = find_beam_centers(iter(stack), use_beamstop=True, z=99)
+    expected = [find_beam_center_with_beamstop(img, z=99) for img in stack]
+    np.testing.assert_array_equal(found, expected)
+
+    # blank frames have no blobs, and fall back to the peak positions
+    stack[1] = 10
+    found = find_beam_centers(stack, sigma=10, use_beamstop=True, z=99, chunk_bytes=1)
+    np.testing.assert_array_equal(found[[0, 2]], [expected[0], expected[2]])
+    assert np.all(np.isfinite(found[1]))
+    assert find_beam_centers(stack[1:2], use_beamstop=True).shape == (1, 2)
+
+
+def test_process_pool_writer(tmp_path):
+    pytest.importorskip('multiprocessing.shared_memory')
+    from instamatic.processing.frame_writer import ProcessPoolWriter
+
+    frames = [make_frame(center=(20 + i, 40)) for i in range(5)]
+
+    with ProcessPoolWriter(shape=frames[0].shape, dtype=frames[0].dtype, workers=2, nslots=2) as writer:
+        for i, img in enumerate(frames):
+            writer.submit(img, [('tiff', tmp_path / f'{i:05d}.tiff', {'i': i}),
+                                ('mrc', tmp_path / f'{i:05d}.mrc', None)])
+
+    assert writer.nframes == len(frames)
+
+    for i, img in enumerate(frames):
+        out, h = read_tiff(tmp_path / f'{i:05d}.tiff')
+        assert h == {'i': i}
+        np.testing.assert_array_equal(out, np.round(img).astype(np.uint16))
+
+        out, h = read_image(tmp_path / f'{i:05d}.mrc')
+        np.testing.assert_array_equal(np.flipud(out), np.round(img).astype(np.uint16))
+
+
+def test_frame_source(tmp_path):
+    from instamatic.formats import write_tiff
+    from instamatic.processing.frame_source import FrameSource
+    from instamatic.processing.ImgConversionTVIPS import ImgConversionTVIPS
+
+    frames = np.array([make_frame(center=(60 + i, 70)) for i in range(4)])
+
+    fns = []
+    for i, img in enumerate(frames, 1):
+        fn = tmp_path / f'{i:05d}.tiff'
+        write_tiff(fn, img, header={'ImageGetTime': float(i), 'ImageExposureTime': 0.1})
+        fns.append(fn)
+
+    source = FrameSource.from_tiff(fns)
+    assert len(source) == 4
+    assert source.headers[2]['ImageGetTime'] == 2.0
+    np.testing.assert_array_equal(source[2], frames[1])
+
+    stack = np.lib.format.open_memmap(tmp_path / 'stack.npy', mode='w+', dtype=frames.dtype, shape=frames.shape)
+    stack[:] = frames
+    source = FrameSource(stack, headers=dict(source.headers))
+    assert list(source) == [1, 2, 3, 4]
+    assert source.frame_shape == (128, 128)
+
+    with pytest.raises(KeyError):
+        source[5]
+
+    flatfield = np.full((128, 128), 2.0)
+    np.testing.assert_allclose(source.with_flatfield(flatfield)[1], frames[0] * flatfield.mean() / flatfield)
+
+    img_conv = ImgConversionTVIPS(buffer=source,
+                                  osc_angle=0.5,
+                                  start_angle=-10.0,
+                                  end_angle=-8.0,
+                                  rotation_axis=0.0,
+                                  acquisition_time=0.1,
+                                  flatfield=None,
+                                  pixelsize=0.01,
+                                  physical_pixelsize=0.055,
+                                  wavelength=0.0251)
+
+    assert img_conv.observed_range == {1, 2, 3, 4}
+    assert img_conv.data_shape == (128, 128)
+    np.testing.assert_allclose(img_conv.get_mean_image(), frames.mean(axis=0))
+    np.testing.assert_allclose(img_conv.beam_centers[4], (63, 70), atol=0.5)
+
+
+def test_flatfield_corrector(tmp_path):
+    from instamatic.formats import write_tiff
+    from instamatic.processing.flatfield import FlatfieldCorrector, apply_flatfield_correction, remove_deadpixels
+
+    rng = np.random.default_rng(0)
+    flatfield = rng.uniform(0.5, 1.5, size=(64, 64))
+    deadpixels = np.array([[0, 0], [10, 10], [10, 11], [63, 20]])
+
+    fn = tmp_path / 'flatfield.tiff'
+    write_tiff(fn, flatfield, header={'deadpixels': deadpixels})
+
+    corrector = FlatfieldCorrector.from_file(fn)
+
+    stack = rng.integers(0, 1000, size=(5, 64, 64)).astype(np.uint16)
+
+    expected = []
+    for img in stack:
+        img = remove_deadpixels(img.astype(float), deadpixels)
+        expected.append(apply_flatfield_correction(img, flatfield))
+
+    corrected = corrector.correct_stack(stack)
+    np.testing.assert_allclose(corrected, expected)
+    np.testing.assert_allclose(corrector(stack[0]), expected[0])
+
+    # dead pixels are interpolated from their live neighbours only
+    img = np.ones((64, 64))
+    img[tuple(deadpixels.T)] = 0
+    img = remove_deadpixels(img, deadpixels)
+    assert np.all(img == 1)
+
+    with pytest.warns(UserWarning):
+        img = corrector(np.ones((32, 32)))
+    assert img.shape == (32, 32)
+
+
+def test_neural_network_batch():
+    from instamatic.neural_network import neural_network
+
+    rng = np.random.default_rng(0)
+    weight = rng.normal(size=(3, 3, 4, 8))
+    offset = rng.normal(size=8)
+    layer = rng.normal(size=(10, 12, 4))
+
+    def reference(layer, weight, offset):
+        """im2col with loops over every output pixel."""
+        h, w, _ = layer.shape
+        expected = np.empty((h - 2, w - 2, weight.shape[-1]))
+        for n in range(h - 2):
+            for p in range(w - 2):
+                expected[n, p] = np.tensordot(layer[n:n + 3, p:p + 3], weight, axes=3) + offset
+        return expected
+
+    np.testing.assert_allclose(neural_network.conv_layer(layer, weight, offset), reference(layer, weight, offset))
+
+    # with C * 3 * 3 <= K, the strided view is used (as in the first layer of `predict`)
+    weight1 = rng.normal(size=(3, 3, 1, 64))
+    offset1 = rng.normal(size=64)
+    expected = reference(layer[..., :1], weight1, offset1)
+    np.testing.assert_allclose(neural_network.conv_layer(layer[..., :1], weight1, offset1), expected)
+    np.testing.assert_allclose(neural_network.conv_layer(np.stack([layer[..., :1]] * 2), weight1, offset1), [expected] * 2)
+    np.testing.assert_allclose(neural_network.conv_layer(layer[..., :1], weight[:, :, :1], offset),
+                               neural_network.conv_layer(layer[np.newaxis, ..., :1], weight[:, :, :1], offset)[0])
+
+    pooled = neural_network.max_pooling(layer[:9])
+    assert pooled.shape == (4, 6, 4)
+    assert pooled[1, 2, 3] == layer[2:4, 4:6, 3].max()
+
+    x = np.linspace(0, 1, 150)
+    images = np.stack([np.exp(-((x[:, None] - c)**2 + (x[None] - c)**2) / 0.01)[..., None] for c in (0.3, 0.5, 0.7)])
+
+    predictions = neural_network.predict(images, batch_size=2)
+    assert predictions.shape == (3,)
+    np.testing.assert_allclose(predictions, [neural_network.predict(img) for img in images], rtol=1e-5)
+
+
+def test_registrar():
+    from scipy.ndimage import fourier_shift, gaussian_filter
+
+    from instamatic.imreg import Registrar, translation
+
+    rng = np.random.default_rng(0)
+    reference = gaussian_filter(rng.random((96, 101)), 2)
+
+    true_shifts = np.array([(3.3, -5.7), (-10.25, 7.5), (0.4, 0.1)])
+    stack = np.stack([np.fft.ifft2(fourier_shift(np.fft.fft2(reference), shift)).real for shift in true_shifts])
+
+    registrar = Registrar(reference, upsample_factor=20)
+    shifts = registrar.register(stack)
+    np.testing.assert_allclose(shifts, -true_shifts, atol=0.05)
+
+    shift, peak = registrar.register(stack[0], return_peak=True)
+    np.testing.assert_allclose(shift, shifts[0])
+    assert 0 < peak <= 1
+
+    assert translation(reference, stack[1]) == [10, -8]
+
+    windowed = Registrar(reference, window='hann', normalization=None)
+    np.testing.assert_allclose(windowed.register(stack), np.round(-true_shifts), atol=1)
+
+
+def test_correlation_pipeline():
+    import time
+
+    from scipy.ndimage import fourier_shift, gaussian_filter
+
+    from instamatic.calibrate.pipeline import CorrelationPipeline
+    from instamatic.imreg import Registrar
+
+    rng = np.random.default_rng(0)
+    reference = gaussian_filter(rng.random((64, 64)), 2)
+    true_shifts = [(i, -i) for i in range(5)]
+    imgs = [np.fft.ifft2(fourier_shift(np.fft.fft2(reference), shift)).real for shift in true_shifts]
+
+    with CorrelationPipeline(Registrar(reference, upsample_factor=10)) as pipeline:
+        for img in imgs:
+            with pipeline.timer('acquire'):
+                time.sleep(0.01)
+            pipeline.submit(img)
+        shifts = pipeline.results()
+
+    np.testing.assert_allclose(shifts, -np.array(true_shifts), atol=0.1)
+    assert set(pipeline.timings) == {'acquire', 'correlate', 'wait', 'total'}
+    assert pipeline.timings['acquire'] >= 0.05
+
+    # register each image against the previous one
+    with CorrelationPipeline() as pipeline:
+        for last_img, img in zip(imgs, imgs[1:]):
+            pipeline.submit(img, reference=last_img)
+        shifts = pipeline.results()
+
+    np.testing.assert_allclose(shifts, [(-1, 1)] * 4, atol=0.1)
+
+
+def make_correct_lp(cell=(10.0, 11.0, 12.0, 90.0, 95.0, 90.0), spgr=14):
+    """Minimal `CORRECT.LP` with the lines read by `xds_parser`."""
+    shells = [(4.0, 1000, 200, 99.0, 10.5, 8.0, 99.5), (2.0, 800, 300, 90.0, 3.2, 20.0, 95.0)]
+    lines = [' UNIT_CELL_CONSTANTS= {:9.3f}{:9.3f}{:9.3f}{:8.3f}{:8.3f}{:8.3f} as used by INTEGRATE'.format(*cell),
+             '     a        b          ISa',
+             ' 1.0E+00  2.0E-03    15.30',
+             ' SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION']
+    for res, ntot, nuniq, compl, ios, rmeas, cchalf in shells:
+        lines.append(f'  {res:8.2f} {ntot:8d} {nuniq:8d} {nuniq:8d} {compl:8.1f}% 5.0% 5.0% {ntot:8d} {ios:8.2f} {rmeas:8.1f}% {cchalf:8.1f}* 0 0.000 0')
+    lines += ['    total     1800      500      500     85.0% 5.0% 5.0% 1800     5.00     10.0%     99.0* 0 0.000 0',
+              '   WILSON LINE (using all data) : A=  -2.5 B=  12.3 CORRELATION=  0.95',
+              f' SPACE GROUP NUMBER   {spgr}',
+              ' UNIT CELL PARAMETERS {:9.3f}{:9.3f}{:9.3f}{:8.3f}{:8.3f}{:8.3f}'.format(*cell),
+              '   ' + '-' * 74,
+              '  20.00  2.00',
+              '']
+    return '\n'.join(lines)
+
+
+def test_xds_harvest(tmp_path, monkeypatch):
+    import os
+
+    from instamatic.utils import xds_parser
+
+    for i in range(4):
+        drc = tmp_path / f'{i}'
+        drc.mkdir()
+        (drc / 'CORRECT.LP').write_text(make_correct_lp(cell=(10.0 + i, 11.0, 12.0, 90.0, 95.0, 90.0)))
+    (tmp_path / '4').mkdir()
+    (tmp_path / '4' / 'CORRECT.LP').write_text(' INDEXING FAILED\n')
+
+    fns = sorted(xds_parser.parse_fns([tmp_path]))
+    cache = tmp_path / 'cache.sqlite'
+
+    ps = xds_parser.harvest(fns, cache=cache, processes=2)
+    assert [p.unit_cell[0] for p in ps] == [10.0, 11.0, 12.0, 13.0]
+    assert ps[0].d['total']['ntot'] == 1800
+    assert ps[0].d == xds_parser.xds_parser(fns[0]).d
+
+    # only the changed file is parsed again
+    parsed = []
+    parse_file = xds_parser._parse_file
+    monkeypatch.setattr(xds_parser, '_parse_file', lambda fn: parsed.append(fn) or parse_file(fn))
+
+    fn = tmp_path / '2' / 'CORRECT.LP'
+    fn.write_text(make_correct_lp(cell=(20.0, 11.0, 12.0, 90.0, 95.0, 90.0)))
+    os.utime(fn, ns=(0, 1_000_000_000))
+
+    ps = xds_parser.harvest(fns, cache=cache, processes=1)
+    assert parsed == [fn.resolve()]
+    assert [p.unit_cell[0] for p in ps] == [10.0, 11.0, 20.0, 13.0]
+    assert ps[0].d == xds_parser.xds_parser(fns[0]).d
+
+    # the cache holds python literals, not pickles
+    import sqlite3
+    with sqlite3.connect(str(cache)) as db:
+        data = [row[0] for row in db.execute('SELECT data FROM results WHERE data IS NOT NULL')]
+    assert len(data) == 4
+    assert all(isinstance(item, str) for item in data)
@@ -0,0 +1,483 @@
+import queue
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from instamatic.server import framing
+
+
+@pytest.fixture()
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+@pytest.fixture()
+def tem_server(monkeypatch):
+    """TEM server with the simulated microscope on a free port, the
+    microscope clients are pointed to it."""
+    from instamatic.server import tem_server
+    from instamatic.TEMController import microscope_client
+
+    server = tem_server.TemServer(name='test', q=queue.Queue())
+    server.daemon = True
+    server.start()
+
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(5)
+    monkeypatch.setattr(microscope_client, 'HOST', 'localhost')
+    monkeypatch.setattr(microscope_client, 'PORT', listener.getsockname()[1])
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=tem_server.handle, args=(conn, server), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    yield server
+
+    listener.shutdown(socket.SHUT_RDWR)
+    listener.close()
+    server.pool.shutdown()
+
+
+def test_framing(sockets):
+    a, b = sockets
+
+    messages = [b'x', bytes(range(256)) * 1000]
+
+    def send():
+        for msg in messages:
+            framing.send_msg(a, msg)
+        a.close()
+
+    t = threading.Thread(target=send)
+    t.start()
+    for msg in messages:
+        assert framing.recv_msg(b) == msg
+    t.join()
+
+    assert framing.recv_msg(b) == b''
+
+
+def test_framing_array(sockets):
+    a, b = sockets
+
+    arr = np.arange(1024 * 1024, dtype=np.uint16).reshape(1024, 1024)
+    header = framing.array_header(arr)
+
+    t = threading.Thread(target=framing.send_array, args=(a, arr))
+    t.start()
+    out = framing.recv_array(b, **header)
+    t.join()
+
+    assert out.dtype == arr.dtype
+    np.testing.assert_array_equal(out, arr)
+
+
+def test_shm_ring():
+    pytest.importorskip('multiprocessing.shared_memory')
+    from instamatic.server.shm_ring import SharedMemoryRing
+
+    ring = SharedMemoryRing((16, 16), 'uint16', nslots=2)
+    client = SharedMemoryRing.attach(**ring.info())
+
+    try:
+        arr = np.ones((16, 16), dtype=np.uint16)
+        info1 = ring.put(arr, owner=1)
+        info2 = ring.put(arr * 2, owner=2)
+        assert ring.put(arr * 3) is None  # all slots held
+
+        np.testing.assert_array_equal(client.frames[info1['slot']], arr)
+        np.testing.assert_array_equal(client.frames[info2['slot']], arr * 2)
+
+        assert not ring.release(info1['slot'], info1['seq'] + 1)  # stale
+        assert ring.release(info1['slot'], info1['seq'])
+        info3 = ring.put(arr * 3)
+        assert info3['slot'] == info1['slot']
+        assert info3['seq'] > info2['seq']
+
+        assert ring.release_owner(2) == 1
+        assert ring.n_free == 1
+    finally:
+        client.close()
+        ring.close()
+        ring.unlink()
+
+
+def test_shm_ring_client_views():
+    pytest.importorskip('multiprocessing.shared_memory')
+    import gc
+
+    from instamatic.camera.camera_client import CamClient
+    from instamatic.server.shm_ring import SharedMemoryRing
+
+    ring = SharedMemoryRing((16, 16), 'uint16', nslots=1)
+
+    client = CamClient.__new__(CamClient)
+    client.verbose = False
+    client.rings = {}
+    client._release = []
+
+    def release():
+        gc.collect()
+        for name, slot, seq in client._release:
+            ring.release(slot, seq)
+        client._release = []
+
+    try:
+        arr = np.ones((16, 16), dtype=np.uint16)
+        img = client.get_data_from_shared_memory(**ring.put(arr))
+        view = img[2:5].T
+
+        # the slot is held as long as any view of the frame is alive
+        del img
+        release()
+        assert ring.put(arr * 2) is None
+        np.testing.assert_array_equal(view, 1)
+
+        del view
+        release()
+        img = client.get_data_from_shared_memory(**ring.put(arr * 2))
+        np.testing.assert_array_equal(img, 2)
+        del img
+        release()
+    finally:
+        for r in client.rings.values():
+            r.close()
+        ring.close()
+        ring.unlink()
+
+
+def test_tem_server(sockets):
+    from instamatic.server import tem_server
+    from instamatic.server.serializer import dumper, loader
+
+    server = tem_server.TemServer(name='test', q=queue.Queue())
+    server.daemon = True
+    server.start()
+
+    a, b = sockets
+    threading.Thread(target=tem_server.handle, args=(b, server), daemon=True).start()
+
+    framing.send_msg(a, dumper({'func_name': 'getMagnification', 'id': 1}))
+    framing.send_msg(a, dumper({'func_name': 'setFunctionMode', 'args': ('invalid',), 'id': 2}))
+
+    responses = [loader(framing.recv_msg(a)) for _ in range(2)]
+    responses = {response['id']: response for response in responses}
+
+    assert responses[1]['status'] == 200
+    assert responses[2]['status'] == 500
+
+    batch = [{'func_name': 'getMagnification'}, {'func_name': 'setFunctionMode', 'args': ('invalid',)}]
+    framing.send_msg(a, dumper({'batch': batch, 'id': 3}))
+    response = loader(framing.recv_msg(a))
+
+    assert response['id'] == 3
+    assert [status for status, data in response['data']] == [200, 500]
+    assert response['data'][0][1] == responses[1]['data']
+    assert 'getMagnification' in server.get_call_statistics()
+
+
+def test_microscope_client_pending_calls(tem_server):
+    import gc
+
+    from instamatic.TEMController.microscope_client import MicroscopeClient
+
+    tem = MicroscopeClient(interface='simulate')
+    try:
+        mag = tem.getMagnification()
+
+        # the ordered calls are answered in order
+        pending = tem.submit('getFunctionMode', ordered=True)
+        assert tem.submit('getMagnification', ordered=True).result() == mag
+        assert len(tem._responses) == 1
+
+        # responses to calls that are never collected are dropped
+        del pending
+        gc.collect()
+        assert tem._responses == {}
+
+        pending = tem.submit('getFunctionMode', ordered=True)
+        del pending
+        gc.collect()
+        assert tem.submit('getMagnification', ordered=True).result() == mag
+        assert tem._responses == {}
+        assert tem._abandoned == set()
+    finally:
+        tem.s.close()
+
+
+@pytest.mark.parametrize('protocol', ['pickle5', 'msgpack_numpy'])
+def test_serializer_ndarray(sockets, protocol):
+    from instamatic.server import serializer
+
+    if protocol not in serializer.PROTOCOLS:
+        pytest.skip(f'{protocol} is not available')
+
+    loader, dumper = serializer.get_serializer(protocol)
+
+    arr = np.arange(512 * 512, dtype=np.uint16).reshape(512, 512)
+    dct = {'id': 1, 'status': 200, 'data': arr, 'duration': 0.1}
+
+    a, b = sockets
+    t = threading.Thread(target=framing.send_msg, args=(a, dumper(dct)))
+    t.start()
+    ret = loader(framing.recv_msg(b))
+    t.join()
+
+    assert ret['id'] == 1
+    assert ret['data'].dtype == arr.dtype
+    np.testing.assert_array_equal(ret['data'], arr)
+
+
+def test_serializer_negotiate(sockets):
+    from instamatic.server import serializer, tem_server
+
+    assert serializer.negotiate(['unknown', 'json', 'pickle']) == 'json'
+    with pytest.raises(ValueError):
+        serializer.negotiate(['unknown'])
+
+    assert serializer.parse_handshake(serializer.handshake(['json'])) == ['json']
+    assert serializer.parse_handshake(serializer.pickle_dumper({'func_name': 'getMagnification'})) is None
+
+    a, b = sockets
+    client = tem_server.ClientConnection(b)
+    client.negotiate_protocol(['unknown', 'json'])
+
+    assert serializer.parse_handshake_reply(framing.recv_msg(a)) == 'json'
+    assert client.loader is serializer.json_loader
+
+
+def test_job_scheduler(tmp_path, sockets):
+    import json
+
+    from instamatic.server import job_scheduler
+    from instamatic.server.job_scheduler import JobScheduler
+
+    database = tmp_path / 'jobs.sqlite'
+    started = threading.Event()
+    proceed = threading.Event()
+    order = []
+
+    def run(data):
+        started.set()
+        proceed.wait(timeout=10)
+        order.append(data)
+        if data == 'fail':
+            raise RuntimeError('indexing failed')
+        return f'result {data}'
+
+    scheduler = JobScheduler(run, workers=1, database=database)
+    first = scheduler.submit('first')
+    assert started.wait(timeout=10)
+
+    # queued behind the running job, the high priority job goes first
+    low = scheduler.submit('low')
+    high = scheduler.submit({'path': 'high'}, priority=5)
+    fail = scheduler.submit('fail', priority=-1)
+    assert scheduler.get(first)['status'] == 'running'
+    assert scheduler.get(low)['status'] == 'queued'
+
+    proceed.set()
+    assert scheduler.wait(fail, timeout=10)['status'] == 'failed'
+    assert order == ['first', {'path': 'high'}, 'low', 'fail']
+    assert scheduler.get(high)['result'] == "result {'path': 'high'}"
+    assert 'indexing failed' in scheduler.get(fail)['result']
+
+    # submission and queries over the socket
+    a, b = sockets
+    t = threading.Thread(target=job_scheduler.handle, args=(b, scheduler))
+    t.start()
+
+    a.send(b'some/path')
+    assert a.recv(1024).decode() == f'OK, job {fail + 1} submitted'
+
+    a.send(json.dumps({'command': 'wait', 'job_id': fail + 1, 'timeout': 10}).encode())
+    job = json.loads(a.recv(4096))
+    assert job['status'] == 'done'
+    assert job['result'] == 'result some/path'
+
+    a.send(json.dumps({'command': 'status', 'job_id': 999}).encode())
+    assert 'error' in json.loads(a.recv(4096))
+
+    a.send(b'close')
+    t.join()
+    scheduler.shutdown()
+
+    # unfinished jobs are picked up again after a restart (the first worker never finishes)
+    proceed.clear()
+    started.clear()
+    scheduler = JobScheduler(run, workers=1, database=database)
+    queued = scheduler.submit('queued')
+    assert started.wait(timeout=10)
+    scheduler.shutdown(wait=False)
+
+    scheduler = JobScheduler(lambda data: 'restarted', workers=1, database=database)
+    assert scheduler.wait(queued, timeout=10)['result'] == 'restarted'
+    assert len(scheduler.jobs(status='done')) == 5
+    scheduler.shutdown()
+    proceed.set()
+
+
+def test_job_scheduler_send_request():
+    from instamatic.server.job_scheduler import send_request
+
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+    host, port = server.getsockname()
+
+    def serve():
+        """Reply in two parts, then close the connection without
+        replying."""
+        conn, _ = server.accept()
+        conn.recv(1024)
+        conn.send(b'{"job_id"')
+        conn.send(b': 1}')
+        conn.recv(1024)
+        conn.close()
+
+        conn, _ = server.accept()
+        conn.recv(1024)
+        conn.close()
+
+    t = threading.Thread(target=serve)
+    t.start()
+
+    assert send_request({'command': 'submit', 'data': 'path'}, host, port) == {'job_id': 1}
+    with pytest.raises(ConnectionError):
+        send_request({'command': 'jobs'}, host, port)
+
+    t.join()
+    server.close()
+
+
+def test_async_microscope_client_disconnect(monkeypatch):
+    import asyncio
+
+    from instamatic.exceptions import TEMCommunicationError
+    from instamatic.server.serializer import json_dumper
+    from instamatic.TEMController import microscope_client
+
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+    monkeypatch.setattr(microscope_client, 'HOST', 'localhost')
+    monkeypatch.setattr(microscope_client, 'PORT', server.getsockname()[1])
+
+    def serve():
+        """Accept the handshake, then close the connection on the first
+        request."""
+        conn, _ = server.accept()
+        framing.recv_msg(conn)
+        framing.send_msg(conn, json_dumper({'protocol': 'json'}))
+        framing.recv_msg(conn)
+        conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    async def main():
+        tem = microscope_client.AsyncMicroscopeClient(interface='simulate')
+        await tem.connect()
+        try:
+            with pytest.raises(TEMCommunicationError):
+                await asyncio.wait_for(tem.getMagnification(), timeout=5)
+            # later calls fail immediately instead of waiting forever
+            with pytest.raises(TEMCommunicationError):
+                await asyncio.wait_for(tem.getMagnification(), timeout=5)
+        finally:
+            await tem.close()
+
+    try:
+        asyncio.run(main())
+    finally:
+        server.close()
+
+
+def test_async_clients(tem_server, monkeypatch):
+    import asyncio
+
+    from instamatic.camera import camera_client
+    from instamatic.camera.camera import Camera
+    from instamatic.exceptions import TEMCommunicationError
+    from instamatic.server.serializer import dumper, loader
+    from instamatic.TEMController.microscope_client import AsyncMicroscopeClient
+
+    cam = Camera(name='test')
+
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+    monkeypatch.setattr(camera_client, 'HOST', 'localhost')
+    monkeypatch.setattr(camera_client, 'PORT', listener.getsockname()[1])
+
+    def serve():
+        """Minimal CAM server (the real one only runs on Windows), images
+        are sent over the socket."""
+        conn, _ = listener.accept()
+        with conn:
+            while True:
+                data = framing.recv_msg(conn)
+                if not data:
+                    break
+                cmd = loader(data)
+                if cmd['attr_name'] == 'get_attrs':
+                    framing.send_msg(conn, dumper((200, {})))
+                elif cmd['attr_name'] == 'getImage':
+                    arr = cam.getImage(*cmd.get('args', ()), **cmd.get('kwargs', {}))
+                    framing.send_msg(conn, dumper((200, framing.array_header(arr))))
+                    framing.send_array(conn, arr)
+                else:
+                    framing.send_msg(conn, dumper((500, ('AttributeError', (cmd['attr_name'],)))))
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    async def main():
+        async with AsyncMicroscopeClient(interface='simulate') as tem:
+            await tem.setBeamShift(100, 200)
+
+            # concurrent calls get their own response
+            shift, mag, mode = await asyncio.gather(tem.getBeamShift(), tem.getMagnification(), tem.getFunctionMode())
+            assert tuple(shift) == (100, 200)
+            assert mag == await tem.getMagnification()
+            assert mode == await tem.getFunctionMode()
+
+            # large requests are sent in parts, which must not be interleaved
+            n1, n2 = 3000, 4000
+            ret1, ret2 = await asyncio.gather(tem.batch([('getMagnification',)] * n1), tem.batch([('getFunctionMode',)] * n2))
+            assert ret1 == [mag] * n1
+            assert ret2 == [mode] * n2
+
+            ret = await tem.batch([('getMagnification',), ('setFunctionMode', ('rawr',))], return_exceptions=True)
+            assert ret[0] == mag
+            assert isinstance(ret[1], Exception)
+
+            async with camera_client.AsyncCamClient(name='test', interface='simulate') as cam_client:
+                img, shift = await asyncio.gather(cam_client.getImage(exposure=0.01), tem.getBeamShift())
+                assert img.shape == tuple(cam.getCameraDimensions())
+                assert tuple(shift) == (100, 200)
+
+        # closing the client fails the calls that wait for a response
+        tem = AsyncMicroscopeClient(interface='simulate')
+        await tem.connect()
+        a = (await tem.getStagePosition())[3]
+        task = asyncio.ensure_future(tem.setStagePosition(a=a - 40 if a > 0 else a + 40))  # takes 2 s
+        await asyncio.sleep(0.1)
+        await tem.close()
+        with pytest.raises(TEMCommunicationError):
+            await asyncio.wait_for(task, timeout=5)
+
+    try:
+        asyncio.run(main())
+    finally:
+        listener.close()